@@ -3,6 +3,12 @@ __version__ = "1.3.0"
 from . import dtypes
 from .dtypes import *
 
+from . import maps
+from .maps import *
+
+from . import map_store
+from .map_store import *
+
 from . import plugins
 from .plugins import *
 
@@ -1,9 +1,15 @@
+import logging
+from collections.abc import Iterator
+
 import numpy as np
 import awkward as ak
 import numba
 
 from scipy.interpolate import interp1d
 
+logging.basicConfig(handlers=[logging.StreamHandler()])
+log = logging.getLogger("fuse.common")
+
 # Lets wait 10 minutes for the plugin to finish
 FUSE_PLUGIN_TIMEOUT = 600
 
@@ -55,6 +61,428 @@ def dynamic_chunking(data, scale, n_min):
     return clusters_undo_sort
 
 
+@numba.njit()
+def find_chunk_starts(time, last_time, n_open, scale, n_min):
+    """Function which continues the dynamic chunking of time sorted data.
+
+    Same splitting rule as dynamic_chunking: a new chunk is started if
+    the time difference to the previous interaction is larger than scale
+    and the current chunk holds at least n_min interactions. The state of
+    the previous batch of data is passed via last_time and n_open.
+
+    Args:
+        time: Time sorted interaction times
+        last_time: Time of the last interaction of the previous batch
+        n_open: Number of interactions in the current chunk
+        scale: Separation scale
+        n_min: Minimum number of interactions per chunk
+
+    Returns:
+        chunk_starts: Indices of the first interactions of the new chunks
+        n_open: Number of interactions in the last chunk
+    """
+    chunk_starts = np.zeros(len(time), dtype=np.int64)
+    n_chunks = 0
+    for i in range(len(time)):
+        if (n_open > 0) and (time[i] - last_time > scale) and (n_open >= n_min):
+            chunk_starts[n_chunks] = i
+            n_chunks += 1
+            n_open = 0
+        n_open += 1
+        last_time = time[i]
+    return chunk_starts[:n_chunks], n_open
+
+
+class DynamicChunkBuilder:
+    """Class which groups time sorted data into chunks.
+
+    The data can be added in multiple batches, each being later than the
+    previous ones. A chunk is returned as soon as the start of the
+    following chunk is known. Chunks that lie within one batch are
+    returned as slices of it.
+
+    The chunk boundaries are placed in the gap between two chunks at
+    chunk_delay_fraction of the gap length. The first chunk starts
+    first_chunk_left before the first interaction and the last chunk
+    ends last_chunk_length after the last interaction.
+
+    If time_window (left, right) is given, the first chunk starts at
+    left and the last chunk ends at right instead, e.g. so that the
+    chunks of shards of one simulation follow each other. All data
+    needs to be within the time window. Bounds which are None are
+    placed as without time window.
+    """
+
+    def __init__(
+        self,
+        separation_scale,
+        n_interactions_per_chunk,
+        first_chunk_left=1e6,
+        last_chunk_length=1e8,
+        chunk_delay_fraction=0.75,
+        time_window=None,
+    ):
+        self.separation_scale = separation_scale
+        self.n_interactions_per_chunk = n_interactions_per_chunk
+        self.first_chunk_left = np.int64(first_chunk_left)
+        self.last_chunk_length = np.int64(last_chunk_length)
+        self.chunk_delay_fraction = chunk_delay_fraction
+        self.time_window = (None, None)
+        if time_window is not None:
+            self.time_window = tuple(
+                None if bound is None else np.int64(bound) for bound in time_window
+            )
+
+        self.chunk_bounds = []
+        self.last_gap = None
+        self.open_chunk = []
+        self.n_open = 0
+        self.last_time = 0
+
+    def add(self, data):
+        """Add time sorted data and yield all chunks completed by it.
+
+        Yields:
+            chunk_data, chunk_left, chunk_right
+        """
+        if len(data) == 0:
+            return
+
+        time = data["time"]
+        chunk_starts, n_open = find_chunk_starts(
+            time,
+            self.last_time,
+            self.n_open,
+            self.separation_scale,
+            self.n_interactions_per_chunk,
+        )
+
+        if len(self.chunk_bounds) == 0:
+            if self.time_window[0] is None:
+                self.chunk_bounds.append(time[0] - self.first_chunk_left)
+            elif time[0] < self.time_window[0]:
+                raise ValueError(
+                    f"Data at {time[0]} ns is before the start of the time window at "
+                    f"{self.time_window[0]} ns!"
+                )
+            else:
+                self.chunk_bounds.append(self.time_window[0])
+
+        if len(chunk_starts):
+            # The end of a chunk can be in the previous batch
+            chunk_ends = time[np.maximum(chunk_starts - 1, 0)]
+            chunk_ends[chunk_starts == 0] = self.last_time
+            gaps = time[chunk_starts] - chunk_ends
+            chunk_rights = chunk_ends + (self.chunk_delay_fraction * gaps).astype(np.int64)
+            self.last_gap = gaps[-1]
+
+            offsets = np.append(0, chunk_starts)
+            for start, stop, chunk_right in zip(offsets[:-1], offsets[1:], chunk_rights):
+                self.open_chunk.append(data[start:stop])
+                chunk_left = self.chunk_bounds[-1]
+                self.chunk_bounds.append(chunk_right)
+                yield self._pop_open_chunk(), chunk_left, chunk_right
+
+        self.open_chunk.append(data[chunk_starts[-1] if len(chunk_starts) else 0 :])
+        self.n_open = n_open
+        self.last_time = time[-1]
+
+    def finish(self):
+        """Return the last chunk.
+
+        Returns:
+            chunk_data, chunk_left, chunk_right
+        """
+        if len(self.chunk_bounds) == 0:
+            raise ValueError("No interactions left to simulate! Check the input file and cuts.")
+
+        chunk_data = self._pop_open_chunk()
+
+        if self.time_window[1] is not None:
+            if chunk_data["time"][-1] > self.time_window[1]:
+                raise ValueError(
+                    f"Data at {chunk_data['time'][-1]} ns is after the end of the time window "
+                    f"at {self.time_window[1]} ns! Delayed interactions can not reach into "
+                    "the following time window, decrease cut_delayed."
+                )
+            self.chunk_bounds.append(self.time_window[1])
+            return chunk_data, self.chunk_bounds[-2], self.chunk_bounds[-1]
+
+        if self.last_gap is None:
+            log.warning(
+                "Only one Chunk created! Only a few events simulated? "
+                "If no, your chunking parameters might not be optimal. "
+                "Try to decrease the source_rate or decrease the n_interactions_per_chunk."
+            )
+            chunk_right = chunk_data["time"][-1] + self.last_chunk_length
+        else:
+            chunk_right = chunk_data["time"][-1] + np.int64(
+                self.chunk_delay_fraction * (self.last_gap + self.last_chunk_length)
+            )
+        self.chunk_bounds.append(chunk_right)
+
+        return chunk_data, self.chunk_bounds[-2], self.chunk_bounds[-1]
+
+    def _pop_open_chunk(self):
+        open_chunk = [part for part in self.open_chunk if len(part)] or self.open_chunk[:1]
+        self.open_chunk = []
+        if len(open_chunk) == 1:
+            return open_chunk[0]
+        return np.concatenate(open_chunk)
+
+
+def extend_poisson_event_times(event_times, n_events, event_rate, rng):
+    """Append event times of a Poisson process until n_events times are
+    drawn. Used if the number of events is not known in advance.
+
+    Args:
+        event_times: numpy array of the event times drawn so far [ns]
+        n_events: Number of event times needed
+        event_rate: Event rate [1/ns]
+        rng: numpy random number generator
+
+    Returns:
+        numpy.array: int64 event times
+    """
+    n_new = n_events - len(event_times)
+    if n_new <= 0:
+        return event_times
+    last_time = event_times[-1] if len(event_times) else 0
+    time_differences = rng.exponential(1 / event_rate, size=n_new)
+    new_times = last_time + np.cumsum(time_differences).astype(np.int64)
+    return np.append(event_times, new_times).astype(np.int64)
+
+
+def _check_sorted_eventids(eventid):
+    if np.any(eventid[1:] < eventid[:-1]):
+        raise ValueError(
+            "The rows of the input need to be sorted by eventid to read it in batches!"
+        )
+
+
+def count_sorted_events(eventid_batches):
+    """Count the events in batches of eventids. Only one batch is held in
+    memory. The eventids need to be sorted, a ValueError is raised
+    otherwise.
+
+    Args:
+        eventid_batches: Iterable of numpy arrays of eventids
+
+    Returns:
+        int: Number of events
+    """
+    n_events = 0
+    last_eventid = None
+    for eventid in eventid_batches:
+        if len(eventid) == 0:
+            continue
+        if last_eventid is not None:
+            eventid = np.concatenate([[last_eventid], eventid])
+        _check_sorted_eventids(eventid)
+        n_events += np.count_nonzero(np.diff(eventid)) + int(last_eventid is None)
+        last_eventid = eventid[-1]
+    return n_events
+
+
+def iterate_complete_events(batches):
+    """Regroup batches of interactions such that no event is split between
+    two batches. The rows need to be sorted by eventid, so the rows of an
+    event are consecutive. A ValueError is raised otherwise.
+
+    The rows of the last event of a batch are held back until the next
+    batch is read.
+
+    Args:
+        batches: Iterable of numpy arrays with an eventid field
+
+    Yields:
+        numpy.array: batches of complete events
+    """
+    held_back = None
+    for batch in batches:
+        if held_back is not None:
+            batch = np.concatenate([held_back, batch])
+        if len(batch) == 0:
+            continue
+
+        eventid = batch["eventid"]
+        _check_sorted_eventids(eventid)
+        other_events = np.flatnonzero(eventid != eventid[-1])
+        last_event_start = other_events[-1] + 1 if len(other_events) else 0
+
+        held_back = batch[last_event_start:]
+        if last_event_start > 0:
+            yield batch[:last_event_start]
+
+    if (held_back is not None) and len(held_back):
+        yield held_back
+
+
+def is_in_memory_input(input_data):
+    """Check if the input of a source plugin is given in memory instead of
+    as a file.
+
+    In-memory input is a structured numpy array, a list of structured
+    arrays or a callable or iterator yielding structured arrays.
+    """
+    if isinstance(input_data, np.ndarray) or callable(input_data):
+        return True
+    if isinstance(input_data, Iterator):
+        return True
+    if isinstance(input_data, (list, tuple)) and len(input_data) > 0:
+        return all(isinstance(batch, np.ndarray) for batch in input_data)
+    return False
+
+
+def iterate_in_memory_input(input_data):
+    """Iterate over the batches of an in-memory input.
+
+    Args:
+        input_data: structured array, list of structured arrays, callable
+            returning an iterable of structured arrays or an iterator
+
+    Yields:
+        numpy.array: batches of the input
+    """
+    if isinstance(input_data, np.ndarray):
+        yield input_data
+    elif callable(input_data):
+        yield from input_data()
+    else:
+        yield from input_data
+
+
+# Number of rows read at once from HDF5 files if no batch size is given
+HDF5_ROWS_PER_BATCH = 1_000_000
+
+# File extensions of the supported columnar input formats
+columnar_file_formats = {
+    "parquet": "parquet",
+    "pq": "parquet",
+    "arrow": "arrow",
+    "feather": "arrow",
+    "ipc": "arrow",
+    "h5": "hdf5",
+    "hdf5": "hdf5",
+}
+
+
+def iterate_columnar_file(file, columns, rows_per_batch=None):
+    """Iterate over a Parquet, Arrow IPC or HDF5 file in batches of rows.
+
+    Only the requested columns are decoded. Parquet files are read per
+    row group, Arrow IPC files per record batch and HDF5 files in batches
+    of HDF5_ROWS_PER_BATCH rows if rows_per_batch is None. Numeric
+    columns are converted without a copy where possible. HDF5 files need
+    one dataset per column or a single compound dataset in the root
+    group. The batches are not regrouped into events, see
+    iterate_complete_events.
+
+    Args:
+        file: Path to the file
+        columns: Names of the columns to read
+        rows_per_batch: Number of rows per batch. If None, the row groups
+            or record batches of the file are used.
+
+    Yields:
+        dict: numpy array of each column
+    """
+    file_format = columnar_file_formats[file.split(".")[-1]]
+    columns = list(columns)
+
+    if file_format == "hdf5":
+        yield from _iterate_hdf5_file(file, columns, rows_per_batch)
+        return
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"pyarrow is needed to read {file}!")
+
+    if file_format == "parquet":
+        reader = pq.ParquetFile(file)
+        _check_columns(reader.schema_arrow.names, columns)
+        if rows_per_batch is None:
+            batches = (
+                reader.read_row_group(i, columns=columns) for i in range(reader.num_row_groups)
+            )
+        else:
+            batches = reader.iter_batches(batch_size=int(rows_per_batch), columns=columns)
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(file))
+        _check_columns(reader.schema.names, columns)
+        batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+        if rows_per_batch is not None:
+            batches = (
+                batch.slice(start, int(rows_per_batch))
+                for batch in batches
+                for start in range(0, batch.num_rows, int(rows_per_batch))
+            )
+
+    for batch in batches:
+        yield {column: _arrow_to_numpy(batch.column(column)) for column in columns}
+
+
+def _iterate_hdf5_file(file, columns, rows_per_batch):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError(f"h5py is needed to read {file}!")
+
+    with h5py.File(file, "r") as f:
+        datasets = [dataset for dataset in f.values() if isinstance(dataset, h5py.Dataset)]
+
+        if (len(datasets) == 1) and (datasets[0].dtype.names is not None):
+            # Single compound dataset
+            reference = datasets[0]
+            _check_columns(reference.dtype.names, columns)
+
+            def read(start, stop):
+                data = reference.fields(columns)[start:stop]
+                return {column: _decode_bytes(data[column]) for column in columns}
+
+        else:
+            # One dataset per column
+            _check_columns(f.keys(), columns)
+            reference = f[columns[0]]
+
+            def read(start, stop):
+                data = {}
+                for column in columns:
+                    dataset = f[column]
+                    if h5py.check_string_dtype(dataset.dtype) is not None:
+                        dataset = dataset.asstr()
+                    data[column] = _decode_bytes(dataset[start:stop])
+                return data
+
+        n_rows = len(reference)
+        rows_per_batch = int(rows_per_batch or HDF5_ROWS_PER_BATCH)
+
+        for start in range(0, n_rows, rows_per_batch):
+            yield read(start, start + rows_per_batch)
+
+
+def _decode_bytes(array):
+    if array.dtype.kind == "S":
+        return array.astype(str)
+    return array
+
+
+def _check_columns(available_columns, columns):
+    missing_columns = set(columns) - set(available_columns)
+    if missing_columns:
+        raise ValueError(f"Not all needed columns provided! {missing_columns} are missing.")
+
+
+def _arrow_to_numpy(column):
+    """Convert an arrow column to numpy, without a copy for numeric columns
+    without missing values."""
+    if hasattr(column, "combine_chunks"):
+        column = column.combine_chunks()
+    return column.to_numpy(zero_copy_only=False)
+
+
 def full_array_to_numpy(array, dtype):
     len_output = len(awkward_to_flat_numpy(array["x"]))
 
@@ -66,6 +494,200 @@ def full_array_to_numpy(array, dtype):
     return numpy_data
 
 
+# Names of Geant4 particles and processes with a fixed integer code.
+# The string fields of geant4_interactions (type, parenttype, creaproc and edproc)
+# are stored as codes of this vocabulary. Names which are not in the list are
+# appended per run and saved in the metadata of geant4_interactions.
+g4_vocabulary = (
+    "",
+    "none",
+    "primary",
+    "alpha",
+    "neutron",
+    "gamma",
+    "e-",
+    "e+",
+    "proton",
+    "deuteron",
+    "triton",
+    "He3",
+    "mu-",
+    "mu+",
+    "pi-",
+    "pi+",
+    "anti_nu_e",
+    "nu_e",
+    "opticalphoton",
+    "Kr83[9.405]",
+    "Kr83[41.557]",
+    "ionIoni",
+    "hadElastic",
+    "eIoni",
+    "hIoni",
+    "muIoni",
+    "msc",
+    "eBrem",
+    "phot",
+    "compt",
+    "conv",
+    "Rayl",
+    "annihil",
+    "nCapture",
+    "neutronInelastic",
+    "protonInelastic",
+    "RadioactiveDecay",
+    "RadioactiveDecayBase",
+    "Radioactivation",
+    "Decay",
+    "CoulombScat",
+    "Transportation",
+    "NotDefined",
+)
+
+g4_codes = {name: np.int16(code) for code, name in enumerate(g4_vocabulary)}
+
+# Fields of geant4_interactions which are stored as codes of the vocabulary
+g4_string_fields = ("type", "parenttype", "creaproc", "edproc")
+
+# Mass and charge number of clusters without a defined isotope
+infinity = np.iinfo(np.int8).max
+
+# Rules to classify a cluster by its main interaction. The first matching
+# rule sets A, Z and the NEST interaction type of the cluster. Conditions
+# are given as a name or a list of names per field of g4_string_fields,
+# fields prefixed with "not_" match all other names.
+default_classification_rules = [
+    dict(edproc="ionIoni", not_type="alpha", A=0, Z=0, nestid=0),
+    dict(type="neutron", edproc="hadElastic", A=0, Z=0, nestid=0),
+    dict(type="alpha", A=4, Z=2, nestid=6),
+    dict(parenttype=["Kr83[9.405]", "Kr83[41.557]"], A=infinity, Z=0, nestid=11),
+    dict(type="gamma", A=0, Z=0, nestid=7),
+    dict(type="e-", A=0, Z=0, nestid=8),
+    dict(A=infinity, Z=infinity, nestid=12),
+]
+
+
+def classification_rule_conditions(rule):
+    """Function to get the conditions of a classification rule.
+
+    Returns:
+        list: (field, names, negate) for each field with a condition
+    """
+    conditions = []
+    for key, names in rule.items():
+        if key in ("A", "Z", "nestid"):
+            continue
+        negate = key.startswith("not_")
+        field = key[len("not_") :] if negate else key
+        if field not in g4_string_fields:
+            raise ValueError(
+                f"Unknown field {field} in classification rule {rule}! "
+                f"Conditions can be set on {g4_string_fields}."
+            )
+        names = [names] if isinstance(names, str) else list(names)
+        conditions.append((field, names, negate))
+    return conditions
+
+
+def g4_run_vocabulary(extra_names=()):
+    """Function to get the vocabulary a run starts with.
+
+    These are the names of g4_vocabulary followed by the extra_names
+    which are not in it. Further names are appended in the order in
+    which they are read from the input.
+    """
+    vocabulary = list(g4_vocabulary)
+    for name in extra_names:
+        if name not in vocabulary:
+            vocabulary.append(name)
+    return vocabulary
+
+
+def classification_vocabulary(rules, vocabulary=g4_vocabulary):
+    """Function to get the vocabulary of a run with the given classification
+    rules.
+
+    Names used in the rules but missing in the vocabulary are appended
+    in the order of the rules. This way their codes are known before
+    any input is read.
+    """
+    vocabulary = list(vocabulary)
+    for rule in rules:
+        for _, names, _ in classification_rule_conditions(rule):
+            for name in names:
+                if name not in vocabulary:
+                    vocabulary.append(name)
+    return vocabulary
+
+
+def encode_g4_strings(strings, vocabulary):
+    """Function to convert Geant4 particle or process names into integer
+    codes.
+
+    Args:
+        strings: numpy array of names
+        vocabulary: list of known names. New names are appended.
+
+    Returns:
+        numpy.array: int16 codes of the names
+    """
+    names, inverse = np.unique(strings, return_inverse=True)
+
+    codes = np.zeros(len(names), dtype=np.int16)
+    for i, name in enumerate(names):
+        name = str(name)
+        if name not in vocabulary:
+            if len(vocabulary) > np.iinfo(np.int16).max:
+                raise ValueError("Too many different Geant4 names to encode them as int16!")
+            vocabulary.append(name)
+        codes[i] = vocabulary.index(name)
+
+    return codes[inverse.reshape(-1)]
+
+
+def decode_g4_strings(codes, vocabulary=g4_vocabulary):
+    """Function to convert integer codes back into Geant4 particle or process
+    names.
+
+    Args:
+        codes: numpy array of int16 codes
+        vocabulary: list of names, e.g. the g4_vocabulary entry of the
+            geant4_interactions metadata
+
+    Returns:
+        numpy.array: names as unicode strings
+    """
+    return np.asarray(vocabulary, dtype=str)[codes]
+
+
+def decode_g4_fields(data, vocabulary=g4_vocabulary):
+    """Function to get a copy of geant4_interactions where the particle and
+    process codes are replaced by their names.
+
+    Args:
+        data: geant4_interactions
+        vocabulary: list of names, e.g. the g4_vocabulary entry of the
+            geant4_interactions metadata
+
+    Returns:
+        numpy.array: structured array with string fields
+    """
+    vocabulary = np.asarray(vocabulary, dtype=str)
+
+    dtype = []
+    for descr in data.dtype.descr:
+        name = descr[0][1] if isinstance(descr[0], tuple) else descr[0]
+        dtype.append((descr[0], vocabulary.dtype.str if name in g4_string_fields else descr[1]))
+
+    decoded = np.zeros(len(data), dtype=dtype)
+    for name in data.dtype.names:
+        if name in g4_string_fields:
+            decoded[name] = vocabulary[data[name]]
+        else:
+            decoded[name] = data[name]
+    return decoded
+
+
 @numba.njit()
 def _sample_from_distribution(p, channel, spe_scaling_factor_distributions):
     """Function to sample from a SPE scaling factor distribution for a given
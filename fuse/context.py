@@ -1,13 +1,15 @@
 # mypy: ignore-errors
 
-from copy import deepcopy
 import logging
+import uuid
 
 import numpy as np
 import strax
 import straxen
 from straxen import URLConfig
 import fuse
+from fuse.maps import RegularGridMap, rasterize_map
+from fuse.common import is_in_memory_input
 
 logging.basicConfig(handlers=[logging.StreamHandler()])
 log = logging.getLogger("fuse.context")
@@ -17,9 +19,7 @@ microphysics_plugins = [
     fuse.micro_physics.ChunkInput,
     fuse.micro_physics.FindCluster,
     fuse.micro_physics.MergeCluster,
-    fuse.micro_physics.XENONnT_TPC,
-    fuse.micro_physics.XENONnT_BelowCathode,
-    fuse.micro_physics.VolumesMerger,
+    fuse.micro_physics.DetectorVolumes,
     fuse.micro_physics.ElectricField,
     fuse.micro_physics.NestYields,
     fuse.micro_physics.MicroPhysicsSummary,
@@ -220,10 +220,74 @@ def set_simulation_config_file(context, config_file_name):
                 context.config[option_key] = option.default
 
 
-@URLConfig.register("pattern_map")
-def pattern_map(map_data, pmt_mask, method="WeightedNearestNeighbors"):
-    """Pattern map handling."""
+# In-memory inputs of the source plugins, by their name
+_in_memory_inputs = dict()
+
+
+def register_in_memory_input(input_data, name=None):
+    """Function to register in-memory input of ChunkInput or ChunkCsvInput.
+
+    The returned key is set as file_name or input_file instead of the
+    data itself, so strax does not need to copy and hash the data. The
+    input is only known in the process where it was registered.
+
+    Args:
+        input_data: structured array, list of structured arrays, callable
+            returning an iterable of structured arrays or an iterator
+        name: name of the input, a random name is used if None
+
+    Returns:
+        key of the input, memory://<name>
+    """
+    if not is_in_memory_input(input_data):
+        raise ValueError(
+            "In-memory input needs to be a structured array, a list of structured arrays or a "
+            "callable or iterator yielding structured arrays!"
+        )
+    if name is None:
+        name = uuid.uuid4().hex
+    _in_memory_inputs[name] = input_data
+    return f"memory://{name}"
+
+
+def remove_in_memory_input(key):
+    """Function to remove in-memory input registered with
+    register_in_memory_input."""
+    _in_memory_inputs.pop(key.split("://", 1)[-1], None)
 
+
+@URLConfig.register("memory")
+def in_memory_input(name):
+    """Return the in-memory input registered with register_in_memory_input."""
+    if name not in _in_memory_inputs:
+        raise ValueError(
+            f"No in-memory input registered as {name}! "
+            "Use fuse.context.register_in_memory_input in this process."
+        )
+    return _in_memory_inputs[name]
+
+
+@URLConfig.register("pattern_map")
+def pattern_map(map_data, pmt_mask, method="WeightedNearestNeighbors", quantize_bits=None):
+    """Pattern map handling.
+
+    With method=RegularGridMap the map is interpolated by
+    fuse.maps.RegularGridMap, which can keep the map quantized in memory
+    (quantize_bits=8 or 16).
+    """
+
+    if method == "RegularGridMap":
+        quantize_bits = None if quantize_bits is None else int(quantize_bits)
+        itp_map = RegularGridMap(map_data, quantize_bits=quantize_bits)
+        if not (pmt_mask is None):
+            assert (
+                itp_map.values["map"].shape[-1] == pmt_mask.shape[0]
+            ), "Error! Pattern map and PMT gains must have same dimensions!"
+            itp_map.scale_channels(np.asarray(pmt_mask, dtype=np.float64))
+        return itp_map
+
+    # Do not modify the loaded resource, it can be shared with other plugins
+    map_data = dict(map_data)
     if "compressed" in map_data:
         compressor, dtype, shape = map_data["compressed"]
         map_data["map"] = np.frombuffer(
@@ -237,7 +301,8 @@ def pattern_map(map_data, pmt_mask, method="WeightedNearestNeighbors"):
         assert (
             map_data["map"].shape[-1] == pmt_mask.shape[0]
         ), "Error! Pattern map and PMT gains must have same dimensions!"
-        map_data["map"][..., ~pmt_mask] = 0.0
+        if not np.all(pmt_mask):
+            map_data["map"] = np.where(pmt_mask, map_data["map"], 0)
     return straxen.InterpolatingMap(map_data, method=method)
 
 
@@ -246,22 +311,69 @@ def modify_s2_pattern_map(
     s2_pattern_map, s2_mean_area_fraction_top, n_tpc_pmts, n_top_pmts, turned_off_pmts
 ):
     """Modify the S2 pattern map to match a given input AFT."""
-    if s2_mean_area_fraction_top > 0:
-        s2map = deepcopy(s2_pattern_map)
-        # First we need to set turned off pmts before scaling
-        s2map.data["map"][..., turned_off_pmts] = 0
-        s2map_topeff_ = s2map.data["map"][..., :n_top_pmts].sum(axis=2, keepdims=True)
-        s2map_toteff_ = s2map.data["map"].sum(axis=2, keepdims=True)
-        orig_aft_ = np.nanmean(s2map_topeff_ / s2map_toteff_)
-        # Getting scales for top/bottom separately to preserve total efficiency
-        scale_top_ = s2_mean_area_fraction_top / orig_aft_
-        scale_bot_ = (1 - s2_mean_area_fraction_top) / (1 - orig_aft_)
-        s2map.data["map"][..., :n_top_pmts] *= scale_top_
-        s2map.data["map"][..., n_top_pmts:n_tpc_pmts] *= scale_bot_
-        s2_pattern_map.__init__(s2map.data)
+    if (s2_mean_area_fraction_top > 0) and isinstance(s2_pattern_map, RegularGridMap):
+        # Only the channel scales are changed, the map values are shared
+        s2map = s2_pattern_map.copy()
+        channel_weights = np.ones(len(s2map.scales["map"]))
+        channel_weights[turned_off_pmts] = 0
+        s2map.scale_channels(channel_weights)
+        top_weights = np.zeros(len(channel_weights))
+        top_weights[:n_top_pmts] = 1
+        orig_aft_ = np.nanmean(s2map.channel_sums(top_weights) / s2map.channel_sums())
+        channel_weights[:n_top_pmts] = s2_mean_area_fraction_top / orig_aft_
+        channel_weights[n_top_pmts:n_tpc_pmts] = (1 - s2_mean_area_fraction_top) / (1 - orig_aft_)
+        channel_weights[n_tpc_pmts:] = 1
+        s2map.scale_channels(channel_weights)
+        return s2map
+    elif s2_mean_area_fraction_top > 0:
+        # Loaded through SharedURLConfig, the scaled map is kept in the map store
+        # under the resolved URL
+        scaled_pattern = _scale_s2_pattern(
+            s2_pattern_map.data["map"],
+            s2_mean_area_fraction_top,
+            n_tpc_pmts,
+            n_top_pmts,
+            turned_off_pmts,
+        )
+        return straxen.InterpolatingMap(dict(s2_pattern_map.data, map=scaled_pattern))
     return s2_pattern_map
 
 
+def _scale_s2_pattern(pattern, s2_mean_area_fraction_top, n_tpc_pmts, n_top_pmts, turned_off_pmts):
+    """Function which returns the S2 pattern with the turned off PMTs set to
+    zero and scaled to the given AFT."""
+    # First we need to set turned off pmts before scaling
+    turned_on = np.ones(pattern.shape[-1], dtype=bool)
+    turned_on[turned_off_pmts] = False
+    s2map_topeff_ = np.sum(
+        pattern[..., :n_top_pmts], axis=2, keepdims=True, where=turned_on[:n_top_pmts]
+    )
+    s2map_toteff_ = np.sum(pattern, axis=2, keepdims=True, where=turned_on)
+    orig_aft_ = np.nanmean(s2map_topeff_ / s2map_toteff_)
+    # Getting scales for top/bottom separately to preserve total efficiency
+    scale_top_ = s2_mean_area_fraction_top / orig_aft_
+    scale_bot_ = (1 - s2_mean_area_fraction_top) / (1 - orig_aft_)
+
+    scaled_pattern = np.array(pattern)
+    scaled_pattern[..., turned_off_pmts] = 0
+    scaled_pattern[..., :n_top_pmts] *= scale_top_
+    scaled_pattern[..., n_top_pmts:n_tpc_pmts] *= scale_bot_
+    return scaled_pattern
+
+
+@URLConfig.register("rasterize")
+def rasterize(itp_map, resolution=None, map_cache_dir=None):
+    """Rasterize an interpolating map onto a regular grid.
+
+    Use it in front of itp_map, e.g.
+    rasterize://itp_map://resource://...&method=WeightedNearestNeighbors&resolution=512
+    The raster is cached on disk, see fuse.maps.rasterize_map.
+    """
+    if resolution is not None:
+        resolution = np.asarray(resolution, dtype=np.int64)
+    return rasterize_map(itp_map, resolution=resolution, cache_dir=map_cache_dir)
+
+
 # Probably not needed!
 @URLConfig.register("simple_load")
 def load(data):
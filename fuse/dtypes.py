@@ -4,12 +4,12 @@ import numpy as np
 g4_fields = [
     (("Time with respect to the start of the event [ns]", "t"), np.float64),
     (("Energy deposit [keV]", "ed"), np.float32),
-    (("Particle type", "type"), "<U18"),
+    (("Particle type (Geant4 vocabulary code)", "type"), np.int16),
     (("Geant4 track ID", "trackid"), np.int16),
-    (("Particle type of the parent particle", "parenttype"), "<U18"),
+    (("Particle type of the parent particle (Geant4 vocabulary code)", "parenttype"), np.int16),
     (("Trackid of the parent particle", "parentid"), np.int16),
-    (("Geant4 process creating the particle", "creaproc"), "<U25"),
-    (("Geant4 process responsible for the energy deposit", "edproc"), "<U25"),
+    (("Geant4 process creating the particle (Geant4 vocabulary code)", "creaproc"), np.int16),
+    (("Geant4 process of the energy deposit (Geant4 vocabulary code)", "edproc"), np.int16),
     (("Geant4 event ID", "eventid"), np.int32),
 ]
 
@@ -0,0 +1,182 @@
+import glob
+import hashlib
+import logging
+import os
+from copy import copy
+
+import numpy as np
+import strax
+import straxen
+
+export, __all__ = strax.exporter()
+
+logging.basicConfig(handlers=[logging.StreamHandler()])
+log = logging.getLogger("fuse.map_store")
+
+# Directory of the memory-mapped arrays shared between processes, set with the
+# environment variable FUSE_SHARED_MAP_DIR. Arrays are not memory-mapped if it is not set.
+SHARED_MAP_DIR = os.environ.get("FUSE_SHARED_MAP_DIR") or None
+
+# Arrays larger than this are memory-mapped from SHARED_MAP_DIR,
+# can be changed with the environment variable FUSE_SHARED_ARRAY_MIN_BYTES
+SHARED_ARRAY_MIN_BYTES = int(os.environ.get("FUSE_SHARED_ARRAY_MIN_BYTES", 2**26))
+
+# Number of maps kept in the map store, the least recently used are removed first.
+# Can be changed with the environment variable FUSE_MAP_STORE_SIZE
+MAP_STORE_SIZE = int(os.environ.get("FUSE_MAP_STORE_SIZE", 32))
+
+# Packages whose objects are searched for arrays to share
+shared_object_packages = ("fuse", "straxen")
+
+# Process-wide store of the loaded maps, keyed by the hash of the resolved URL
+_map_store = straxen.CacheDict(cache_len=MAP_STORE_SIZE)
+
+
+@export
+class SharedURLConfig(straxen.URLConfig):
+    """URLConfig which loads each resolved URL only once per process.
+
+    Plugins using the same URL, after the plugin and config references
+    are resolved, share the same value. Arrays of the value are made
+    read-only. If SHARED_MAP_DIR is set, arrays larger than
+    SHARED_ARRAY_MIN_BYTES are written to it under the hash of their
+    content and memory-mapped, so that worker processes loading the same
+    map share one copy in memory.
+    """
+
+    def fetch(self, plugin):
+        url = super(straxen.URLConfig, self).fetch(plugin)
+        if not isinstance(url, str) or (self.SCHEME_SEP not in url):
+            return self.validate_type(url)
+
+        protocol, arg, kwargs = self.url_to_ast(url)
+        run_id = getattr(plugin, "run_id", "000000")
+        key = strax.deterministic_hash((plugin.config, run_id, protocol, arg, kwargs))
+        value = self.cache.get(key, None)
+        if value is None:
+            protocol, arg, kwargs = self.deref_ast(
+                protocol, arg, kwargs, config=plugin.config, plugin=plugin
+            )
+            value = load_shared(
+                strax.deterministic_hash((protocol, arg, kwargs)),
+                lambda: self.validate_type(self.eval(protocol, arg, kwargs)),
+            )
+            self.cache[key] = value
+        return value
+
+
+@export
+def load_shared(key, load, min_shared_bytes=None, shared_dir=None):
+    """Function which returns the value of key from the map store, and
+    loads it with load() if it is not in the store yet.
+
+    The store keeps the MAP_STORE_SIZE most recently used values.
+
+    Args:
+        key: key of the value, e.g. the hash of the resolved URL
+        load: function without arguments returning the value
+        min_shared_bytes: arrays larger than this are memory-mapped,
+            default is SHARED_ARRAY_MIN_BYTES
+        shared_dir: directory of the memory-mapped arrays, default is
+            SHARED_MAP_DIR. Arrays are not memory-mapped if both are None.
+    """
+    if key not in _map_store:
+        if min_shared_bytes is None:
+            min_shared_bytes = SHARED_ARRAY_MIN_BYTES
+        if shared_dir is None:
+            shared_dir = SHARED_MAP_DIR
+        if shared_dir is None:
+            min_shared_bytes = np.inf
+        _map_store[key] = _read_only(load(), min_shared_bytes, shared_dir, dict())
+    return _map_store[key]
+
+
+@export
+def shared_key(value):
+    """Function which returns the key of value in the map store, or None if
+    value is not in the store."""
+    for key, stored in _map_store.items():
+        if stored is value:
+            return key
+    return None
+
+
+@export
+def clear_map_store(remove_shared_files=False, shared_dir=None):
+    """Function to remove all maps from the map store.
+
+    Args:
+        remove_shared_files: if True, the memory-mapped files in shared_dir
+            are deleted, also those written by other processes. Arrays
+            which are already mapped stay readable.
+        shared_dir: directory of the memory-mapped arrays, default is
+            SHARED_MAP_DIR
+    """
+    _map_store.clear()
+
+    if shared_dir is None:
+        shared_dir = SHARED_MAP_DIR
+    if remove_shared_files and (shared_dir is not None):
+        for file_name in glob.glob(os.path.join(shared_dir, "*.bin")):
+            os.remove(file_name)
+
+
+def _read_only(value, min_shared_bytes, shared_dir, memo):
+    """Function which returns value with read-only arrays.
+
+    Dictionaries, lists, tuples and objects of fuse and straxen are
+    copied if they contain arrays. The arrays are replaced by read-only
+    views, their data is not copied.
+    """
+    if id(value) in memo:
+        return memo[id(value)]
+
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            result = value
+        elif value.nbytes >= min_shared_bytes:
+            result = _memory_map(value, shared_dir)
+        else:
+            # The value can be held by other caches, only the view is read-only
+            result = value.view()
+            result.setflags(write=False)
+    elif type(value) is dict:
+        result = {k: _read_only(v, min_shared_bytes, shared_dir, memo) for k, v in value.items()}
+    elif type(value) in (list, tuple):
+        result = type(value)(_read_only(v, min_shared_bytes, shared_dir, memo) for v in value)
+    elif hasattr(value, "__dict__") and (
+        type(value).__module__.split(".")[0] in shared_object_packages
+    ):
+        result = copy(value)
+        memo[id(value)] = result
+        for k, v in vars(value).items():
+            setattr(result, k, _read_only(v, min_shared_bytes, shared_dir, memo))
+    else:
+        result = value
+
+    memo[id(value)] = result
+    return result
+
+
+def _memory_map(array, shared_dir):
+    """Function which writes the array to shared_dir, named by the hash of
+    its content, and returns it read-only memory-mapped."""
+    array = np.ascontiguousarray(array)
+    content_hash = hashlib.blake2b(digest_size=20)
+    # Reshaped views of the same values share the file
+    content_hash.update(array.dtype.str.encode())
+    content_hash.update(array.data)
+    file_name = os.path.join(shared_dir, f"{content_hash.hexdigest()}.bin")
+
+    if not os.path.exists(file_name):
+        os.makedirs(shared_dir, exist_ok=True)
+        tmp_file = f"{file_name}.tmp-{os.getpid()}"
+        try:
+            array.tofile(tmp_file)
+            os.replace(tmp_file, file_name)
+            log.debug(f"Wrote shared array to {file_name}")
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    return np.asarray(np.memmap(file_name, dtype=array.dtype, mode="r", shape=array.shape))
@@ -0,0 +1,895 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import weakref
+from copy import copy
+
+import numpy as np
+import numba
+import strax
+import straxen
+
+from .map_store import load_shared
+
+export, __all__ = strax.exporter()
+
+logging.basicConfig(handlers=[logging.StreamHandler()])
+log = logging.getLogger("fuse.maps")
+
+# Number of grid points processed at once when summing over channels
+CHANNEL_SUM_BLOCK_SIZE = 2**16
+
+# Directory of the rasterized maps, can be changed with the environment variable
+# FUSE_MAP_CACHE_DIR
+MAP_CACHE_DIR = os.environ.get(
+    "FUSE_MAP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fuse", "maps")
+)
+
+# Directory of the derived arrays, set with the environment variable FUSE_DERIVED_CACHE_DIR.
+# Derived arrays are only kept in memory if it is not set.
+DERIVED_CACHE_DIR = os.environ.get("FUSE_DERIVED_CACHE_DIR") or None
+
+# Change this if the format of the rasterized maps changes
+RASTER_CACHE_VERSION = 1
+
+# Change this if the derived maps change
+DERIVED_CACHE_VERSION = 1
+
+# Default total number of grid points of a rasterized map
+DEFAULT_RASTER_POINTS = 2**20
+
+# Relative rasterization error above which a warning is printed
+RASTER_ERROR_TOLERANCE = 0.01
+
+# Largest number of clusters kept by MemoizedMap
+MEMO_MAX_CLUSTERS = 2**20
+
+# Fields of a map file which do not hold map values
+map_metadata_fields = (
+    "timestamp",
+    "description",
+    "coordinate_system",
+    "name",
+    "irregular",
+    "compressed",
+    "quantized",
+    "rotated",
+)
+
+
+@export
+class RegularGridMap:
+    """Map on a regular grid with multilinear interpolation.
+
+    The map data uses the same format as straxen.InterpolatingMap.
+    The coordinate system can be given as a gridspec
+    ``[['x', [x_min, x_max, n_x]], ...]`` or as a list of the grid
+    points. Values are interpolated (bilinear in 2D, trilinear in 3D)
+    and extrapolated linearly outside of the grid, like
+    scipy.interpolate.RegularGridInterpolator with fill_value=None.
+
+    Array valued maps, e.g. pattern maps with one value per PMT, have a
+    scale factor per channel. With quantize_bits the values are kept as
+    uint8 or uint16 in memory and are only dequantized during the
+    interpolation. Maps stored quantized in the file are kept as they
+    are if their integer type fits into quantize_bits.
+
+    With extrapolate=False, positions outside of the grid get the value
+    of the closest grid edge instead.
+
+    The interpolator is called with
+        'positions': [[x1, y1], [x2, y2], [x3, y3], [x4, y4], ...]
+        'map_name': key of the map, default is 'map'
+    """
+
+    def __init__(self, data, quantize_bits=None, extrapolate=True):
+        if quantize_bits not in (None, 8, 16):
+            raise ValueError("quantize_bits must be None, 8 or 16!")
+
+        self.data = dict(data)
+        self.quantize_bits = quantize_bits
+        self.extrapolate = extrapolate
+
+        grid_min, grid_step, grid_n, point_index = _parse_regular_grid(
+            self.data["coordinate_system"]
+        )
+        self.dimensions = len(grid_n)
+        self.grid_min = grid_min
+        self.grid_step = grid_step
+        self.grid_n = grid_n
+
+        compressed = self.data.pop("compressed", None)
+        scale = self.data.pop("quantized", None)
+        self.map_names = sorted([k for k in self.data.keys() if k not in map_metadata_fields])
+
+        self.values = {}
+        self.scales = {}
+        self.array_valued = {}
+        for map_name in self.map_names:
+            map_data = self.data[map_name]
+            if (map_name == "map") and (compressed is not None):
+                compressor, dtype, shape = compressed
+                map_data = np.frombuffer(
+                    strax.io.COMPRESSORS[compressor]["decompress"](map_data), dtype=dtype
+                ).reshape(*shape)
+            map_scale = scale if map_name == "map" else None
+            values, channel_scale = self._prepare_values(map_data, map_scale)
+
+            if np.ndim(map_data) > 0 and len(map_data) == len(point_index):
+                array_valued = np.ndim(map_data) == 2
+            else:
+                array_valued = np.ndim(map_data) == self.dimensions + 1
+            values = values.reshape(len(point_index), -1)
+            if not np.array_equal(point_index, np.arange(len(point_index))):
+                reordered = np.empty_like(values)
+                reordered[point_index] = values
+                values = reordered
+
+            self.values[map_name] = values
+            self.scales[map_name] = np.full(values.shape[1], channel_scale, dtype=np.float64)
+            self.array_valued[map_name] = array_valued
+            self.data[map_name] = values.reshape(*self.grid_n, -1)
+
+    def _prepare_values(self, map_data, scale):
+        """Function which returns the values to keep in memory and their
+        scale."""
+        is_integer = np.issubdtype(np.asarray(map_data).dtype, np.integer)
+
+        if self.quantize_bits is not None:
+            if (
+                (scale is not None)
+                and is_integer
+                and (np.asarray(map_data).dtype.itemsize * 8 <= self.quantize_bits)
+                and (np.min(map_data) >= 0)
+            ):
+                return np.asarray(map_data), float(scale)
+
+            values = np.asarray(map_data, dtype=np.float64)
+            if scale is not None:
+                values = values * scale
+            return quantize_values(values, self.quantize_bits)
+
+        if scale is not None:
+            return scale * np.asarray(map_data).astype(np.float32), 1.0
+        # No copy for float32 arrays, e.g. memory-mapped maps
+        return np.asarray(map_data, dtype=np.float32), 1.0
+
+    def __call__(self, positions, map_name="map"):
+        """Returns the value of the map at the given positions.
+
+        :param positions: array (n_dim) or (n_points, n_dim) of positions
+        :param map_name: Name of the map to use. Default is 'map'.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, self.dimensions)
+        result = _interpolate_regular_grid(
+            positions,
+            self.grid_min,
+            self.grid_step,
+            self.grid_n,
+            self.values[map_name],
+            self.scales[map_name],
+            self.extrapolate,
+        )
+        if not self.array_valued[map_name]:
+            return result[:, 0]
+        return result
+
+    def copy(self):
+        """Returns a copy sharing the map values but with its own channel
+        scales."""
+        new = copy(self)
+        new.data = dict(self.data)
+        new.scales = {name: scale.copy() for name, scale in self.scales.items()}
+        return new
+
+    def scale_coordinates(self, scaling_factor):
+        """Scales the coordinate system by the specified factor, like
+        straxen.InterpolatingMap.scale_coordinates.
+
+        :param scaling_factor: array (n_dim) of scaling factors or a scalar
+        """
+        scaling_factor = np.broadcast_to(
+            np.asarray(scaling_factor, dtype=np.float64), (self.dimensions,)
+        )
+        # New arrays, copies of this map keep their coordinate system
+        self.grid_min = self.grid_min * scaling_factor
+        self.grid_step = self.grid_step * scaling_factor
+
+    def scale_channels(self, factors, map_name="map"):
+        """Multiply the channels of an array valued map by the given
+        factors, without touching the stored values."""
+        self.scales[map_name] *= factors
+
+    def channel_sums(self, weights=None, map_name="map"):
+        """Returns the weighted sum over the channels at each grid point."""
+        values = self.values[map_name]
+        weights = self.scales[map_name] * (1 if weights is None else np.asarray(weights))
+
+        sums = np.zeros(len(values), dtype=np.float64)
+        for start in range(0, len(values), CHANNEL_SUM_BLOCK_SIZE):
+            block = values[start : start + CHANNEL_SUM_BLOCK_SIZE]
+            sums[start : start + len(block)] = block.astype(np.float32) @ weights
+        return sums
+
+    def sum_channels(self, weights=None, map_name="map"):
+        """Returns a new map with the weighted sum over the channels of an
+        array valued map as a single channel."""
+        data = {k: v for k, v in self.data.items() if k not in self.map_names}
+        data["coordinate_system"] = [
+            [f"axis_{i}", [self.grid_min[i], self._grid_max(i), int(self.grid_n[i])]]
+            for i in range(self.dimensions)
+        ]
+        data["map"] = self.channel_sums(weights, map_name).reshape(*self.grid_n, 1)
+        return RegularGridMap(data, quantize_bits=None, extrapolate=self.extrapolate)
+
+    def _grid_max(self, i):
+        return self.grid_min[i] + self.grid_step[i] * max(self.grid_n[i] - 1, 0)
+
+
+@export
+class MemoizedMap:
+    """Wrapper of a map which evaluates each position only once.
+
+    Positions of a call are deduplicated and the map is only evaluated
+    at the unique positions. If the cluster_id of each position is
+    given, the values of the clusters are also kept for later calls, as
+    long as the position of the cluster does not change. Use
+    memoized_map to get the MemoizedMap of a map, so that all plugins
+    evaluating the same map share it.
+
+    The number of positions answered without and with an evaluation of
+    the map are counted in hits and misses.
+    """
+
+    def __init__(self, itp_map, max_clusters=MEMO_MAX_CLUSTERS):
+        self.itp_map = itp_map
+        self.max_clusters = max_clusters
+        self.hits = 0
+        self.misses = 0
+        self._memo = dict()
+
+    def __call__(self, positions, map_name="map", cluster_id=None):
+        """Returns the value of the map at the given positions.
+
+        :param positions: array (n_points, n_dim) of positions
+        :param map_name: Name of the map to use. Default is 'map'.
+        :param cluster_id: array (n_points) of the cluster of each position
+        """
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return self.itp_map(positions, map_name=map_name)
+
+        keys = None
+        if cluster_id is not None:
+            keys, first, inverse = np.unique(cluster_id, return_index=True, return_inverse=True)
+            unique_positions = positions[first]
+            if not np.array_equal(unique_positions[inverse], positions, equal_nan=True):
+                # The clusters do not have a single position
+                keys = None
+        if keys is None:
+            unique_positions, inverse = np.unique(positions, axis=0, return_inverse=True)
+
+        values, n_evaluated = self._evaluate(unique_positions, map_name, keys)
+        self.hits += len(positions) - n_evaluated
+        self.misses += n_evaluated
+        return values[inverse.reshape(-1)]
+
+    def _evaluate(self, positions, map_name, keys):
+        """Function which returns the values at the unique positions, using
+        the kept values of the clusters.
+
+        Returns:
+            values: values at the positions
+            n_evaluated: number of positions the map was evaluated at
+        """
+        if keys is None:
+            return self.itp_map(positions, map_name=map_name), len(positions)
+
+        values = None
+        missing = np.ones(len(keys), dtype=bool)
+        if map_name in self._memo:
+            memo_keys, memo_positions, memo_values = self._memo[map_name]
+            index = np.minimum(np.searchsorted(memo_keys, keys), len(memo_keys) - 1)
+            missing = (memo_keys[index] != keys) | np.any(
+                memo_positions[index] != positions, axis=1
+            )
+            values = memo_values[index]
+
+        if np.any(missing):
+            new_values = self.itp_map(positions[missing], map_name=map_name)
+            if values is None:
+                values = new_values
+            else:
+                values = values.astype(np.result_type(values, new_values))
+                values[missing] = new_values
+        self._remember(map_name, keys, positions, values)
+        return values, int(np.sum(missing))
+
+    def _remember(self, map_name, keys, positions, values):
+        """Function which keeps the values of the clusters, sorted by
+        cluster_id."""
+        if map_name in self._memo:
+            memo_keys, memo_positions, memo_values = self._memo[map_name]
+            keep = ~np.isin(memo_keys, keys)
+            if np.sum(keep) + len(keys) <= self.max_clusters:
+                keys = np.concatenate([memo_keys[keep], keys])
+                positions = np.concatenate([memo_positions[keep], positions])
+                values = np.concatenate([memo_values[keep], values])
+                order = np.argsort(keys, kind="stable")
+                keys, positions, values = keys[order], positions[order], values[order]
+        self._memo[map_name] = (keys, positions, values)
+
+    def clear(self):
+        """Function to forget the values of all clusters."""
+        self._memo.clear()
+
+    def __getattr__(self, name):
+        # Everything else, e.g. data or map_names, comes from the map
+        if name == "itp_map":
+            raise AttributeError(name)
+        return getattr(self.itp_map, name)
+
+
+_memoized_maps = weakref.WeakKeyDictionary()
+
+
+@export
+def memoized_map(itp_map):
+    """Function which returns the MemoizedMap of a map.
+
+    The same MemoizedMap is returned for the same map object, so
+    plugins sharing a map, e.g. through SharedURLConfig, share the kept
+    values of the clusters.
+    """
+    if itp_map not in _memoized_maps:
+        _memoized_maps[itp_map] = MemoizedMap(itp_map)
+    return _memoized_maps[itp_map]
+
+
+# Attributes of straxen.InterpolateAndExtrapolate used by the shared neighbour search
+SHARED_SEARCH_ATTRIBUTES = ("kdtree", "values", "neighbours_to_use", "array_valued", "rotated")
+
+# straxen versions [first, last) the shared neighbour search is tested with, the maps are
+# evaluated on their own with other versions
+SHARED_SEARCH_STRAXEN_VERSIONS = ((4, 0, 0), (5, 0, 0))
+
+# Number of positions used to check the shared neighbour search against an interpolator
+SHARED_SEARCH_CHECK_POINTS = 100
+
+# Interpolators checked against the shared neighbour search, True if they agree
+_checked_interpolators = weakref.WeakKeyDictionary()
+
+
+@export
+def evaluate_maps(positions, maps):
+    """Function to evaluate several maps at the same positions.
+
+    Maps interpolated with WeightedNearestNeighbors on the same points,
+    e.g. the sub-maps of one straxen.InterpolatingMap, share a single
+    search of the neighbours and their weights. The results are the
+    same as calling each map on its own.
+
+    The shared search follows straxen.InterpolateAndExtrapolate and is
+    only used with the straxen versions in SHARED_SEARCH_STRAXEN_VERSIONS.
+    The first evaluation of each interpolator is compared with the
+    interpolator itself, if they differ, e.g. after a change in straxen,
+    the map is evaluated on its own.
+
+    Args:
+        positions: array (n_points, n_dim) of positions
+        maps: dict of key: (itp_map, map_name)
+
+    Returns:
+        dict of key: values
+    """
+    positions = np.asarray(positions)
+    result = dict()
+
+    # Group the interpolators which search the same neighbours
+    groups = []
+    for key, (itp_map, map_name) in maps.items():
+        interpolator = getattr(itp_map, "interpolators", {}).get(map_name)
+        if not _supports_shared_search(interpolator):
+            result[key] = itp_map(positions, map_name=map_name)
+            continue
+        for group in groups:
+            other = group[0][1]
+            if (
+                (interpolator.kdtree is other.kdtree)
+                or np.array_equal(interpolator.kdtree.data, other.kdtree.data)
+            ) and (
+                (interpolator.neighbours_to_use, interpolator.rotated)
+                == (other.neighbours_to_use, other.rotated)
+            ):
+                group.append((key, interpolator))
+                break
+        else:
+            groups.append([(key, interpolator)])
+
+    for group in groups:
+        group_result = _weighted_nearest_neighbors(positions, group)
+        for key, interpolator in group:
+            if not _check_shared_search(interpolator, positions, group_result[key]):
+                group_result[key] = interpolator(positions)
+        result.update(group_result)
+    return {key: result[key] for key in maps}
+
+
+def _supports_shared_search(interpolator):
+    """Function which checks if an interpolator can be evaluated with the
+    shared neighbour search."""
+    if type(interpolator) is not straxen.InterpolateAndExtrapolate:
+        return False
+    if not _straxen_is_supported(straxen.__version__):
+        return False
+    if _checked_interpolators.get(interpolator) is False:
+        return False
+
+    missing = [name for name in SHARED_SEARCH_ATTRIBUTES if not hasattr(interpolator, name)]
+    if missing:
+        log.warning(
+            f"straxen.InterpolateAndExtrapolate has no attributes {missing}, "
+            "the maps are evaluated without the shared neighbour search."
+        )
+        _checked_interpolators[interpolator] = False
+        return False
+    return True
+
+
+def _straxen_is_supported(version):
+    """Function which checks if the shared neighbour search is tested with
+    a straxen version."""
+    version = tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+    first, last = SHARED_SEARCH_STRAXEN_VERSIONS
+    return first <= version < last
+
+
+def _check_shared_search(interpolator, positions, values):
+    """Function which compares the values of the shared neighbour search
+    with the interpolator on the first positions, once per interpolator.
+
+    Returns:
+        True if the values agree
+    """
+    if interpolator not in _checked_interpolators:
+        n_check = min(len(positions), SHARED_SEARCH_CHECK_POINTS)
+        agree = np.allclose(
+            values[:n_check], interpolator(positions[:n_check]), rtol=1e-9, equal_nan=True
+        )
+        if not agree:
+            log.warning(
+                "The shared neighbour search differs from straxen.InterpolateAndExtrapolate, "
+                "the map is evaluated without it."
+            )
+        _checked_interpolators[interpolator] = agree
+    return _checked_interpolators[interpolator]
+
+
+def _weighted_nearest_neighbors(points, group):
+    """Function which evaluates straxen InterpolateAndExtrapolate
+    interpolators on the same points with one neighbour search.
+
+    Args:
+        points: array (n_points, n_dim) of positions
+        group: list of (key, interpolator)
+    """
+    first = group[0][1]
+    if first.rotated:
+        assert (
+            points.shape[1] == 2
+        ), "InterpolateAndExtrapolate rotated expects points of dimension 2"
+        points = np.array(straxen.rotate_perp_wires(points[:, 0], points[:, 1])).T
+
+    # kdtree doesn't grok NaNs, mask valid values
+    valid = np.all(np.isfinite(points), axis=-1)
+    distances, indices = first.kdtree.query(points[valid], first.neighbours_to_use)
+    weights = 1 / np.clip(distances, 1e-6, float("inf"))
+
+    result = dict()
+    for key, interpolator in group:
+        if interpolator.array_valued:
+            values = np.empty((len(points), interpolator.values.shape[-1]))
+        else:
+            values = np.empty(len(points))
+        values[~valid] = np.nan
+
+        neighbour_values = interpolator.values[indices]
+        if (neighbour_values.ndim == 3) and interpolator.array_valued:
+            values[valid] = np.einsum(
+                "ijk, ij->ik",
+                neighbour_values,
+                weights / weights.sum(axis=-1)[:, np.newaxis],
+            )
+        else:
+            neighbour_weights = weights
+            if interpolator.array_valued:
+                neighbour_weights = np.repeat(weights, values.shape[-1]).reshape(
+                    neighbour_values.shape
+                )
+            values[valid] = np.average(
+                neighbour_values,
+                weights=neighbour_weights,
+                axis=-2 if interpolator.array_valued else -1,
+            )
+        result[key] = values
+    return result
+
+
+def quantize_values(values, bits):
+    """Function to quantize non-negative values into unsigned integers.
+
+    Returns:
+        quantized: uint8 or uint16 array
+        scale: value of one integer step
+    """
+    if np.any(~np.isfinite(values)) or np.any(values < 0):
+        raise ValueError("Only finite, non-negative maps can be quantized!")
+
+    max_integer = 2**bits - 1
+    max_value = np.max(values) if values.size else 0
+    scale = max_value / max_integer if max_value > 0 else 1.0
+    quantized = np.rint(values / scale).astype(np.uint8 if bits == 8 else np.uint16)
+    return quantized, float(scale)
+
+
+@export
+def rasterize_map(
+    itp_map,
+    resolution=None,
+    cache_dir=None,
+    n_validation_points=10000,
+    tolerance=RASTER_ERROR_TOLERANCE,
+):
+    """Function to rasterize an interpolating map onto a regular grid.
+
+    The map, e.g. a straxen.InterpolatingMap using WeightedNearestNeighbors,
+    is evaluated once on a regular grid spanning its coordinate system.
+    The raster is stored in cache_dir under the hash of the map and
+    memory-mapped when the same map is rasterized again. Positions
+    outside of the grid get the value of the closest grid edge.
+
+    The rasterization error is the largest difference to the original
+    map at its grid points and at random positions inside of the grid,
+    relative to the range of the map values. It is logged, kept in
+    the attribute rasterization_errors and a warning is printed if it
+    is larger than tolerance.
+
+    Args:
+        itp_map: map to rasterize, called as itp_map(positions, map_name=...)
+        resolution: number of grid points per dimension, an int or one
+            value per dimension. Default is DEFAULT_RASTER_POINTS in total.
+        cache_dir: directory of the cache, default is MAP_CACHE_DIR
+        n_validation_points: number of random positions to compute the error
+        tolerance: relative error above which a warning is printed
+
+    Returns:
+        RegularGridMap
+    """
+    if cache_dir is None:
+        cache_dir = MAP_CACHE_DIR
+
+    points = np.asarray(itp_map.coordinate_system, dtype=np.float64)
+    if (points.ndim != 2) or (len(points) == 0):
+        raise ValueError("Only maps with at least one dimension can be rasterized!")
+    if "rotated" in itp_map.data:
+        raise ValueError("Maps in rotated coordinates can not be rasterized!")
+    dimensions = points.shape[1]
+
+    if resolution is None:
+        resolution = max(int(DEFAULT_RASTER_POINTS ** (1 / dimensions)), 2)
+    grid_n = np.broadcast_to(np.asarray(resolution, dtype=np.int64), (dimensions,)).copy()
+    grid_min = points.min(axis=0)
+    grid_max = points.max(axis=0)
+    grid_n[grid_min == grid_max] = 1
+
+    cache_key = strax.deterministic_hash(
+        dict(
+            cache_version=RASTER_CACHE_VERSION,
+            map=_map_hash(itp_map),
+            grid_min=grid_min.tolist(),
+            grid_max=grid_max.tolist(),
+            grid_n=grid_n.tolist(),
+        )
+    )
+    raster_dir = os.path.join(cache_dir, f"raster-{cache_key}")
+
+    if not os.path.exists(os.path.join(raster_dir, "metadata.json")):
+        _write_raster(itp_map, grid_min, grid_max, grid_n, raster_dir, n_validation_points)
+    else:
+        log.debug(f"Reading rasterized map from cache {raster_dir}")
+
+    raster, errors = _read_raster(raster_dir)
+    for map_name, error in errors.items():
+        message = (
+            f"Rasterized {map_name} on a {'x'.join(map(str, grid_n))} grid, "
+            f"largest relative error {error:.2g}"
+        )
+        if error > tolerance:
+            log.warning(message + f" is larger than {tolerance}!")
+        else:
+            log.info(message)
+    raster.rasterization_errors = errors
+    return raster
+
+
+def _map_hash(itp_map):
+    """Hash of the coordinate system, values and interpolation settings of a
+    map."""
+    map_hash = hashlib.sha1()
+    points = np.ascontiguousarray(itp_map.coordinate_system, dtype=np.float64)
+    map_hash.update(str(points.shape).encode())
+    map_hash.update(points.tobytes())
+    for map_name in itp_map.map_names:
+        values = np.ascontiguousarray(itp_map.data[map_name], dtype=np.float64)
+        map_hash.update(f"{map_name}{values.shape}".encode())
+        map_hash.update(values.tobytes())
+
+        interpolator = getattr(itp_map, "interpolators", {}).get(map_name)
+        map_hash.update(type(interpolator).__name__.encode())
+        map_hash.update(str(getattr(interpolator, "neighbours_to_use", None)).encode())
+    return map_hash.hexdigest()
+
+
+def _write_raster(itp_map, grid_min, grid_max, grid_n, raster_dir, n_validation_points):
+    """Function which evaluates the map on the grid, computes the
+    rasterization errors and writes the raster to raster_dir."""
+    grid = [np.linspace(left, right, n) for left, right, n in zip(grid_min, grid_max, grid_n)]
+    coordinate_system = [
+        [f"axis_{i}", [float(left), float(right), int(n)]]
+        for i, (left, right, n) in enumerate(zip(grid_min, grid_max, grid_n))
+    ]
+
+    data = dict(coordinate_system=coordinate_system)
+    for map_name in itp_map.map_names:
+        data[map_name] = _evaluate_on_grid(itp_map, grid, map_name)
+    raster = RegularGridMap(data, extrapolate=False)
+
+    # Compare to the original map at its grid points and at random positions
+    rng = np.random.default_rng(0)
+    positions = np.concatenate(
+        [
+            np.asarray(itp_map.coordinate_system, dtype=np.float64),
+            rng.uniform(grid_min, grid_max, (n_validation_points, len(grid_min))),
+        ]
+    )
+    errors = dict()
+    for map_name in itp_map.map_names:
+        original = np.asarray(itp_map(positions, map_name=map_name), dtype=np.float64)
+        difference = np.abs(raster(positions, map_name=map_name) - original)
+        value_range = np.nanmax(original) - np.nanmin(original)
+        errors[map_name] = float(np.nanmax(difference) / (value_range if value_range > 0 else 1))
+
+    tmp_dir = f"{raster_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        map_files = dict()
+        for i, map_name in enumerate(itp_map.map_names):
+            map_files[map_name] = f"map_{i}.npy"
+            np.save(os.path.join(tmp_dir, map_files[map_name]), data[map_name])
+        metadata = dict(
+            coordinate_system=coordinate_system,
+            map_files=map_files,
+            rasterization_errors=errors,
+        )
+        with open(os.path.join(tmp_dir, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+        try:
+            os.replace(tmp_dir, raster_dir)
+            log.info(f"Wrote rasterized map to cache {raster_dir}")
+        except OSError:
+            log.debug(f"Cache {raster_dir} was already written by another process.")
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+def _evaluate_on_grid(itp_map, grid, map_name):
+    """Function which evaluates a map on all points of a grid, in blocks
+    of CHANNEL_SUM_BLOCK_SIZE points.
+
+    Returns:
+        float32 array of shape (n_1, ..., n_dim) or (n_1, ..., n_dim, n_channels)
+    """
+    grid_n = [len(g) for g in grid]
+    n_points = int(np.prod(grid_n))
+
+    values = None
+    for start in range(0, n_points, CHANNEL_SUM_BLOCK_SIZE):
+        index = np.unravel_index(
+            np.arange(start, min(start + CHANNEL_SUM_BLOCK_SIZE, n_points)), grid_n
+        )
+        positions = np.column_stack([g[i] for g, i in zip(grid, index)])
+        block = np.asarray(itp_map(positions, map_name=map_name), dtype=np.float32)
+        if values is None:
+            values = np.empty((n_points,) + block.shape[1:], dtype=np.float32)
+        values[start : start + len(block)] = block
+    return values.reshape(*grid_n, *values.shape[1:])
+
+
+def _read_raster(raster_dir):
+    """Function which memory-maps a rasterized map from the cache.
+
+    Returns:
+        raster: RegularGridMap
+        errors: rasterization error of each map
+    """
+    with open(os.path.join(raster_dir, "metadata.json")) as f:
+        metadata = json.load(f)
+
+    data = dict(coordinate_system=metadata["coordinate_system"])
+    for map_name, file_name in metadata["map_files"].items():
+        data[map_name] = np.load(os.path.join(raster_dir, file_name), mmap_mode="r")
+    return RegularGridMap(data, extrapolate=False), metadata["rasterization_errors"]
+
+
+@export
+def cached_derived_array(name, source_key, parameters, derive, cache_dir=None):
+    """Function which returns an array derived from a source array, like
+    the sum of a pattern map over the PMTs.
+
+    The derived array is computed once per source and parameters and
+    kept read-only in the map store. If cache_dir or DERIVED_CACHE_DIR is
+    set, it is also stored on disk and memory-mapped by later processes.
+    The source is identified by source_key, e.g. its key in the map store
+    from fuse.map_store.shared_key, the source array itself is not read.
+
+    Args:
+        name: name of the derived array
+        source_key: JSON serializable key of the source. If None, the
+            array is derived on every call.
+        parameters: JSON serializable parameters of derive
+        derive: function without arguments returning the derived array
+        cache_dir: directory of the disk cache, default is DERIVED_CACHE_DIR
+    """
+    if source_key is None:
+        return derive()
+    if cache_dir is None:
+        cache_dir = DERIVED_CACHE_DIR
+
+    cache_key = strax.deterministic_hash(
+        dict(
+            cache_version=DERIVED_CACHE_VERSION,
+            name=name,
+            source=source_key,
+            parameters=parameters,
+        )
+    )
+    if not cache_dir:
+        return load_shared(f"{name}-{cache_key}", derive)
+    return load_shared(
+        f"{name}-{cache_key}",
+        lambda: _load_derived_array(
+            name, os.path.join(cache_dir, f"{name}-{cache_key}.npy"), derive
+        ),
+    )
+
+
+def _load_derived_array(name, file_name, derive):
+    """Function which memory-maps a derived array from the disk cache, or
+    derives it and writes it to the cache first."""
+    if os.path.exists(file_name):
+        log.debug(f"Reading {name} from cache {file_name}")
+        return np.asarray(np.load(file_name, mmap_mode="r"))
+
+    derived = derive()
+    tmp_file = f"{file_name}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            np.save(f, derived)
+        os.replace(tmp_file, file_name)
+        log.info(f"Wrote {name} to cache {file_name}")
+    except OSError as e:
+        log.warning(f"Could not write {name} to cache {file_name}: {e}")
+        return derived
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return np.asarray(np.load(file_name, mmap_mode="r"))
+
+
+def _parse_regular_grid(coordinate_system):
+    """Function to get the regular grid of a coordinate system.
+
+    Returns:
+        grid_min, grid_step, grid_n: grid along each dimension
+        point_index: index of each point of the coordinate system in the
+            C-ordered grid
+    """
+    if len(coordinate_system) == 0:
+        raise ValueError("RegularGridMap needs at least one dimension!")
+
+    if isinstance(coordinate_system[0][0], str):
+        grid = [np.linspace(left, right, int(n)) for _, (left, right, n) in coordinate_system]
+        n_points = int(np.prod([len(g) for g in grid]))
+        point_index = np.arange(n_points)
+    else:
+        points = np.asarray(coordinate_system, dtype=np.float64)
+        grid = [np.unique(points[:, i]) for i in range(points.shape[1])]
+        indices = [np.searchsorted(g, points[:, i]) for i, g in enumerate(grid)]
+        point_index = np.ravel_multi_index(indices, [len(g) for g in grid])
+        if len(np.unique(point_index)) != int(np.prod([len(g) for g in grid])):
+            raise ValueError("The coordinate system is not a complete grid!")
+
+    grid_min = np.array([g[0] for g in grid], dtype=np.float64)
+    grid_n = np.array([len(g) for g in grid], dtype=np.int64)
+    grid_step = np.ones(len(grid), dtype=np.float64)
+    for i, g in enumerate(grid):
+        if len(g) > 1:
+            steps = np.diff(g)
+            if not np.allclose(steps, steps[0], rtol=1e-6, atol=0):
+                raise ValueError(f"The grid of dimension {i} is not regularly spaced!")
+            grid_step[i] = (g[-1] - g[0]) / (len(g) - 1)
+
+    return grid_min, grid_step, grid_n, point_index
+
+
+@numba.njit(nogil=True, cache=True)
+def _interpolate_regular_grid(
+    positions, grid_min, grid_step, grid_n, values, scales, extrapolate=True
+):
+    """Multilinear interpolation of the values on a regular grid.
+
+    Args:
+        positions: (n_points, n_dim) positions
+        grid_min, grid_step, grid_n: grid along each dimension
+        values: (n_grid_points, n_channels) values of the C-ordered grid
+        scales: scale factor of each channel
+        extrapolate: if False, positions are clipped to the grid
+    """
+    n_points, n_dim = positions.shape
+    n_channels = values.shape[1]
+    result = np.zeros((n_points, n_channels), dtype=np.float64)
+
+    strides = np.ones(n_dim, dtype=np.int64)
+    for k in range(n_dim - 2, -1, -1):
+        strides[k] = strides[k + 1] * grid_n[k + 1]
+
+    index = np.zeros(n_dim, dtype=np.int64)
+    fraction = np.zeros(n_dim, dtype=np.float64)
+
+    for i in range(n_points):
+        finite = True
+        for k in range(n_dim):
+            if not np.isfinite(positions[i, k]):
+                finite = False
+            elif grid_n[k] == 1:
+                index[k] = 0
+                fraction[k] = 0.0
+            else:
+                u = (positions[i, k] - grid_min[k]) / grid_step[k]
+                if not extrapolate:
+                    u = min(max(u, 0.0), grid_n[k] - 1.0)
+                j = min(max(int(np.floor(u)), 0), grid_n[k] - 2)
+                index[k] = j
+                fraction[k] = u - j
+        if not finite:
+            result[i, :] = np.nan
+            continue
+
+        for corner in range(2**n_dim):
+            weight = 1.0
+            flat_index = 0
+            for k in range(n_dim):
+                if (corner >> k) & 1:
+                    weight *= fraction[k]
+                    flat_index += (index[k] + 1) * strides[k]
+                else:
+                    weight *= 1.0 - fraction[k]
+                    flat_index += index[k] * strides[k]
+            if weight == 0:
+                continue
+            for c in range(n_channels):
+                result[i, c] += weight * values[flat_index, c]
+
+        for c in range(n_channels):
+            if scales[c] == 0:
+                result[i, c] = 0.0
+            else:
+                result[i, c] *= scales[c]
+
+    return result
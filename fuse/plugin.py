@@ -2,6 +2,7 @@ import strax
 import straxen
 import numpy as np
 import logging
+from immutabledict import immutabledict
 
 logging.basicConfig(handlers=[logging.StreamHandler()])
 
@@ -34,6 +35,19 @@ class FuseBasePlugin(strax.Plugin):
         help="Define the random seed manually. You need to set deterministic_seed to False",
     )
 
+    def __init_subclass__(cls, **kwargs):
+        """Collect the config options of all base classes.
+
+        strax only inherits the options of the first base class with
+        options, mixins sharing options between plugins would be lost.
+        """
+        super().__init_subclass__(**kwargs)
+
+        takes_config = dict()
+        for base in reversed(cls.__mro__):
+            takes_config.update(base.__dict__.get("takes_config", dict()))
+        cls.takes_config = immutabledict(takes_config)
+
     def setup(self):
         super().setup()
 
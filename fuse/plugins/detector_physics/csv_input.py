@@ -13,7 +13,16 @@ from ...dtypes import (
     quanta_fields,
     electric_fields,
 )
-from ...common import dynamic_chunking
+from ...common import (
+    DynamicChunkBuilder,
+    is_in_memory_input,
+    iterate_in_memory_input,
+    extend_poisson_event_times,
+    iterate_complete_events,
+    iterate_columnar_file,
+    columnar_file_formats,
+    count_sorted_events,
+)
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -34,9 +43,21 @@ microphysics_summary_fields = (
 @export
 class ChunkCsvInput(FuseBasePlugin):
     """Plugin which reads a CSV file containing instructions for the detector
-    physics simulation and returns the data in chunks."""
+    physics simulation and returns the data in chunks.
+
+    Instead of a CSV file, Parquet, Arrow IPC and HDF5 files with the
+    same columns can be used. Only the needed columns are read. In-memory
+    input with the fields of the CSV file is registered with
+    ``key = fuse.context.register_in_memory_input(data)`` and input_file
+    is set to the key.
+
+    If rows_per_batch is set, the file is read in batches of rows and
+    chunks are emitted while reading. The rows need to be sorted by
+    eventid in this case, the same holds for in-memory input given by a
+    callable or iterator.
+    """
 
-    __version__ = "0.2.2"
+    __version__ = "0.2.7"
 
     depends_on: Tuple = tuple()
     provides = "microphysics_summary"
@@ -50,7 +71,8 @@ class ChunkCsvInput(FuseBasePlugin):
     input_file = straxen.URLConfig(
         track=False,
         infer_type=False,
-        help="CSV file to read",
+        help="CSV, Parquet, Arrow IPC or HDF5 file to read. In-memory input is given by the "
+        "key returned by fuse.context.register_in_memory_input",
     )
 
     separation_scale = straxen.URLConfig(
@@ -73,6 +95,14 @@ class ChunkCsvInput(FuseBasePlugin):
         help="n_interactions_per_chunk",
     )
 
+    rows_per_batch = straxen.URLConfig(
+        default=None,
+        track=False,
+        help="If set, the input file is read in batches of this number of rows and chunks are "
+        "emitted while reading. The rows need to be sorted by eventid. The event times are "
+        "drawn as for a file loaded at once. If None, the file is loaded at once",
+    )
+
     def infer_dtype(self):
         return microphysics_summary_fields + strax.time_fields
 
@@ -83,6 +113,12 @@ class ChunkCsvInput(FuseBasePlugin):
     def setup(self):
         super().setup()
 
+        if is_in_memory_input(self.config["input_file"]):
+            raise ValueError(
+                "In-memory input can not be set as input_file directly! Register it with "
+                "fuse.context.register_in_memory_input and set the returned key."
+            )
+
         self.file_reader = csv_file_loader(
             input_file=self.input_file,
             random_number_generator=self.rng,
@@ -90,6 +126,7 @@ class ChunkCsvInput(FuseBasePlugin):
             separation_scale=self.separation_scale,
             n_interactions_per_chunk=self.n_interactions_per_chunk,
             debug=self.debug,
+            rows_per_batch=self.rows_per_batch,
         )
         self.file_reader_iterator = self.file_reader.output_chunk()
 
@@ -123,7 +160,12 @@ class ChunkCsvInput(FuseBasePlugin):
 
 
 class csv_file_loader:
-    """Class to load a CSV file with detector simulation instructions."""
+    """Class to load a CSV file with detector simulation instructions.
+
+    The instructions can also be given in memory as a structured array,
+    a list of arrays or a callable or iterator yielding arrays. Csv files
+    with rows_per_batch set and callables or iterators are streamed.
+    """
 
     def __init__(
         self,
@@ -136,6 +178,7 @@ class csv_file_loader:
         first_chunk_left=1e6,
         last_chunk_length=1e8,
         debug=False,
+        rows_per_batch=None,
     ):
         self.input_file = input_file
         self.rng = random_number_generator
@@ -146,6 +189,7 @@ class csv_file_loader:
         self.last_chunk_length = np.int64(last_chunk_length)
         self.first_chunk_left = np.int64(first_chunk_left)
         self.debug = debug
+        self.rows_per_batch = rows_per_batch
 
         # The csv file needs to have these columns:
         _fields = ChunkCsvInput.needed_csv_input_fields()
@@ -153,18 +197,37 @@ class csv_file_loader:
         self.dtype = _fields + strax.time_fields
 
     def output_chunk(self):
-        instructions, n_simulated_events = self.__load_csv_file()
+        if is_in_memory_input(self.input_file):
+            if not isinstance(self.input_file, (np.ndarray, list, tuple)):
+                batches = (
+                    self.__convert_in_memory_batch(batch)
+                    for batch in iterate_in_memory_input(self.input_file)
+                )
+                yield from self.__output_chunk_streaming(batches)
+                return
+            instructions, n_simulated_events = self.__load_in_memory_input()
+        elif self.input_file.split(".")[-1] in columnar_file_formats:
+            if self.rows_per_batch is not None:
+                yield from self.__output_chunk_streaming(
+                    self.__iterate_columnar_file(), self.__count_events()
+                )
+                return
+            instructions = np.concatenate(list(self.__iterate_columnar_file()))
+            n_simulated_events = len(np.unique(instructions["eventid"]))
+        elif self.rows_per_batch is not None:
+            yield from self.__output_chunk_streaming(
+                self.__iterate_csv_file(), self.__count_events()
+            )
+            return
+        else:
+            instructions, n_simulated_events = self.__load_csv_file()
 
         # Assign event times and dynamic chunking
         if self.event_rate > 0:
-            event_times = self.rng.uniform(
-                low=0, high=n_simulated_events / self.event_rate, size=n_simulated_events
-            ).astype(np.int64)
-            event_times = np.sort(event_times)
-
-            structure = np.unique(instructions["eventid"], return_counts=True)[1]
-            interaction_time = np.repeat(event_times[: len(structure)], structure)
-            instructions["time"] = interaction_time + instructions["t"]
+            event_times = self.__uniform_event_times(n_simulated_events)
+
+            event_index = np.unique(instructions["eventid"], return_inverse=True)[1]
+            instructions["time"] = event_times[event_index] + instructions["t"]
         elif self.event_rate == 0:
             instructions["time"] = instructions["t"]
             log.debug("Using event times from provided input file.")
@@ -175,58 +238,195 @@ class csv_file_loader:
         instructions = instructions[sort_idx]
 
         # Group into chunks
-        chunk_idx = dynamic_chunking(
-            instructions["time"], scale=self.separation_scale, n_min=self.n_interactions_per_chunk
+        chunk_builder = DynamicChunkBuilder(
+            separation_scale=self.separation_scale,
+            n_interactions_per_chunk=self.n_interactions_per_chunk,
+            first_chunk_left=self.first_chunk_left,
+            last_chunk_length=self.last_chunk_length,
+            chunk_delay_fraction=self.chunk_delay_fraction,
         )
+        self.chunk_bounds = chunk_builder.chunk_bounds
+
+        for chunk_data, chunk_left, chunk_right in chunk_builder.add(instructions):
+            yield chunk_data, chunk_left, chunk_right, False
+
+        chunk_data, chunk_left, chunk_right = chunk_builder.finish()
+        log.debug("Build last chunk.")
+        yield chunk_data, chunk_left, chunk_right, True
+
+    def __uniform_event_times(self, n_simulated_events):
+        """Draw the sorted event times uniformly distributed over the
+        duration of the run."""
+        event_times = self.rng.uniform(
+            low=0, high=n_simulated_events / self.event_rate, size=n_simulated_events
+        ).astype(np.int64)
+        return np.sort(event_times)
+
+    def __output_chunk_streaming(self, batches, n_simulated_events=None):
+        """Assign event times and build chunks batch by batch.
+
+        With a source rate > 0 and a known number of events, e.g. of a
+        file, the event times are drawn as for input loaded at once. If
+        the number of events is not known in advance, e.g. for input from
+        a generator, the event times are drawn from a Poisson process.
+        After each batch, all instructions which are earlier than the next
+        event time are final and handed to the chunk builder.
+        """
+        if self.event_rate == 0:
+            log.debug("Using event times from provided input file.")
+        elif self.event_rate < 0:
+            raise ValueError("Source rate cannot be negative!")
 
-        # Calculate chunk start and end times
-        chunk_start = np.array(
-            [instructions[chunk_idx == i][0]["time"] for i in np.unique(chunk_idx)]
-        )
-        chunk_end = np.array(
-            [instructions[chunk_idx == i][-1]["time"] for i in np.unique(chunk_idx)]
+        chunk_builder = DynamicChunkBuilder(
+            separation_scale=self.separation_scale,
+            n_interactions_per_chunk=self.n_interactions_per_chunk,
+            first_chunk_left=self.first_chunk_left,
+            last_chunk_length=self.last_chunk_length,
+            chunk_delay_fraction=self.chunk_delay_fraction,
         )
-
-        if (len(chunk_start) > 1) & (len(chunk_end) > 1):
-            gap_length = chunk_start[1:] - chunk_end[:-1]
-            gap_length = np.append(gap_length, gap_length[-1] + self.last_chunk_length)
-            chunk_bounds = chunk_end + np.int64(self.chunk_delay_fraction * gap_length)
-            self.chunk_bounds = np.append(chunk_start[0] - self.first_chunk_left, chunk_bounds)
-        else:
-            log.warning("Only one Chunk! Rate too high?")
-            self.chunk_bounds = [
-                chunk_start[0] - self.first_chunk_left,
-                chunk_end[0] + self.last_chunk_length,
-            ]
-
-        source_done = False
-        unique_chunk_index_values = np.unique(chunk_idx)
-        for c_ix, chunk_left, chunk_right in zip(
-            unique_chunk_index_values, self.chunk_bounds[:-1], self.chunk_bounds[1:]
-        ):
-            if c_ix == unique_chunk_index_values[-1]:
-                source_done = True
-                log.debug("Build last chunk.")
-
-            yield instructions[chunk_idx == c_ix], chunk_left, chunk_right, source_done
+        self.chunk_bounds = chunk_builder.chunk_bounds
+
+        event_times = np.zeros(0, dtype=np.int64)
+        if (self.event_rate > 0) and (n_simulated_events is not None):
+            event_times = self.__uniform_event_times(n_simulated_events)
+        pending = np.zeros(0, dtype=self.dtype)
+        n_events_seen = 0
+        for instructions in iterate_complete_events(batches):
+            eventid = instructions["eventid"]
+            new_event = np.diff(eventid, prepend=eventid[0] - 1) != 0
+            event_number = n_events_seen + np.cumsum(new_event) - 1
+            n_events_seen += np.sum(new_event)
+
+            if self.event_rate > 0:
+                if np.any(instructions["t"] < 0):
+                    raise ValueError("Negative t is not supported when streaming the input!")
+                if n_simulated_events is None:
+                    # Draw one event time more to know the time of the next event
+                    event_times = extend_poisson_event_times(
+                        event_times, n_events_seen + 1, self.event_rate, self.rng
+                    )
+                elif n_events_seen > n_simulated_events:
+                    raise ValueError("The input has more events than counted before reading!")
+                instructions["time"] = event_times[event_number] + instructions["t"]
+            else:
+                instructions["time"] = instructions["t"]
+
+            pending = np.concatenate([pending, instructions])
+            pending = pending[np.argsort(pending["time"])]
+
+            # All following instructions are later than the next event time
+            if (self.event_rate > 0) and (n_events_seen < len(event_times)):
+                n_final = np.searchsorted(pending["time"], event_times[n_events_seen])
+                for chunk_data, chunk_left, chunk_right in chunk_builder.add(pending[:n_final]):
+                    yield chunk_data, chunk_left, chunk_right, False
+                pending = pending[n_final:]
+
+        for chunk_data, chunk_left, chunk_right in chunk_builder.add(pending):
+            yield chunk_data, chunk_left, chunk_right, False
+
+        chunk_data, chunk_left, chunk_right = chunk_builder.finish()
+        log.debug(f"Build last chunk. Read {n_events_seen} events.")
+        yield chunk_data, chunk_left, chunk_right, True
 
     def last_chunk_bounds(self):
         return self.chunk_bounds[-1]
 
-    def __load_csv_file(self):
-        log.debug("Load detector simulation instructions from a csv file!")
-        df = pd.read_csv(self.input_file)
+    def __csv_column_dtypes(self):
+        """Check the header of the csv file and return the dtypes used to
+        parse the needed columns.
 
-        missing_columns = set(self.columns) - set(df.columns)
+        Float columns are parsed with their output dtype. Integer columns
+        are parsed as float64, as they can be written as floats, e.g.
+        12.0, and are cast when assigned to the instructions.
+        """
+        header = pd.read_csv(self.input_file, nrows=0).columns
+        missing_columns = set(self.columns) - set(header)
 
         # Check if all needed columns are in place:
         if missing_columns:
             raise ValueError(f"Not all needed columns provided! {missing_columns} are missing.")
 
+        dtype = np.dtype(self.dtype)
+        return {
+            column: dtype[column] if dtype[column].kind == "f" else np.dtype(np.float64)
+            for column in self.columns
+        }
+
+    def __count_events(self):
+        """Count the events of the input file. Only the eventid column is
+        read."""
+        if self.input_file.split(".")[-1] in columnar_file_formats:
+            return count_sorted_events(
+                columns["eventid"]
+                for columns in iterate_columnar_file(
+                    self.input_file, ["eventid"], self.rows_per_batch
+                )
+            )
+
+        with pd.read_csv(
+            self.input_file,
+            usecols=["eventid"],
+            dtype={"eventid": np.float64},
+            chunksize=int(self.rows_per_batch),
+        ) as reader:
+            return count_sorted_events(df["eventid"].values for df in reader)
+
+    def __iterate_csv_file(self):
+        log.debug("Stream detector simulation instructions from a csv file!")
+        column_dtypes = self.__csv_column_dtypes()
+
+        with pd.read_csv(
+            self.input_file,
+            usecols=self.columns,
+            dtype=column_dtypes,
+            chunksize=int(self.rows_per_batch),
+        ) as reader:
+            for df in reader:
+                instructions = np.zeros(len(df), dtype=self.dtype)
+                for column in self.columns:
+                    instructions[column] = df[column].values
+                yield instructions
+
+    def __load_csv_file(self):
+        log.debug("Load detector simulation instructions from a csv file!")
+        column_dtypes = self.__csv_column_dtypes()
+        df = pd.read_csv(self.input_file, usecols=self.columns, dtype=column_dtypes)
+
         n_simulated_events = len(np.unique(df.eventid))
 
         instructions = np.zeros(len(df), dtype=self.dtype)
-        for column in df.columns:
-            instructions[column] = df[column]
+        for column in self.columns:
+            instructions[column] = df[column].values
 
         return instructions, n_simulated_events
+
+    def __iterate_columnar_file(self):
+        log.debug("Load detector simulation instructions from a columnar file!")
+        for columns in iterate_columnar_file(self.input_file, self.columns, self.rows_per_batch):
+            instructions = np.zeros(len(columns["eventid"]), dtype=self.dtype)
+            for column in self.columns:
+                instructions[column] = columns[column]
+            yield instructions
+
+    def __load_in_memory_input(self):
+        log.debug("Load detector simulation instructions from memory!")
+        batches = [
+            self.__convert_in_memory_batch(batch)
+            for batch in iterate_in_memory_input(self.input_file)
+        ]
+        instructions = np.concatenate(batches)
+
+        n_simulated_events = len(np.unique(instructions["eventid"]))
+
+        return instructions, n_simulated_events
+
+    def __convert_in_memory_batch(self, batch):
+        missing_columns = set(self.columns) - set(batch.dtype.names)
+        if missing_columns:
+            raise ValueError(f"Not all needed columns provided! {missing_columns} are missing.")
+
+        instructions = np.zeros(len(batch), dtype=self.dtype)
+        for column in batch.dtype.names:
+            if column in instructions.dtype.names:
+                instructions[column] = batch[column]
+        return instructions
@@ -3,7 +3,9 @@ import straxen
 import logging
 import numpy as np
 
+from ...maps import evaluate_maps
 from ...plugin import FuseBasePlugin
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -21,7 +23,7 @@ class ElectronDrift(FuseBasePlugin):
     time and observed position is calculated.
     """
 
-    __version__ = "0.3.0"
+    __version__ = "0.3.1"
 
     depends_on = "microphysics_summary"
     provides = "drifted_electrons"
@@ -136,7 +138,7 @@ class ElectronDrift(FuseBasePlugin):
         help="Model for the electric field distortion",
     )
 
-    field_dependencies_map_tmp = straxen.URLConfig(
+    field_dependencies_map_tmp = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=field_dependencies_map"
@@ -203,21 +205,25 @@ class ElectronDrift(FuseBasePlugin):
                 norm_dvel *= 1e-4
                 self.drift_velocity_scaling = self.drift_velocity_liquid / norm_dvel
 
-            def rz_map(z, xy, **kwargs):
-                r = np.sqrt(xy[:, 0] ** 2 + xy[:, 1] ** 2)
-                return self.field_dependencies_map_tmp(np.array([r, z]).T, **kwargs)
-
-            self.field_dependencies_map = rz_map
-
+        # Field dependent quantities, evaluated together in field_dependent_values
+        self.field_dependent_maps = dict()
+        if self.enable_survival_probability_map:
+            self.field_dependent_maps["survival_probability_map"] = (
+                self.field_dependencies_map_tmp,
+                "survival_probability_map",
+            )
+        if self.enable_drift_velocity_map:
+            self.field_dependent_maps["drift_speed_map"] = (
+                self.field_dependencies_map_tmp,
+                "drift_speed_map",
+            )
         # Data-driven longitudinal diffusion map
         # TODO: Change to the best way to accommodate simulation/data-driven map
         if self.enable_diffusion_longitudinal_map:
-
-            def _rz_map(z, xy, **kwargs):
-                r = np.sqrt(xy[:, 0] ** 2 + xy[:, 1] ** 2)
-                return self.diffusion_longitudinal_map_tmp(np.array([r, z]).T, **kwargs)
-
-            self.diffusion_longitudinal_map = _rz_map
+            self.field_dependent_maps["diffusion_longitudinal_map"] = (
+                self.diffusion_longitudinal_map_tmp,
+                "map",
+            )
 
     def compute(self, interactions_in_roi):
         # Just apply this to clusters with photons
@@ -234,6 +240,9 @@ class ElectronDrift(FuseBasePlugin):
         z = interactions_in_roi[mask]["z"]
         n_electron = interactions_in_roi[mask]["electrons"].astype(np.int64)
 
+        # maps are in R_true and Z_true, so orginal position should be here
+        field_values = self.field_dependent_values(z, np.array([x, y]).T)
+
         # Reverse engineering FDC
         if self.field_distortion_model == "inverse_fdc":
             z_obs, positions = self.inverse_field_distortion_correction(x, y, z)
@@ -246,15 +255,16 @@ class ElectronDrift(FuseBasePlugin):
         # Remove electrons from Charge Insensitive Volume
         # interaction_in_civ can either be 0 or 1
         interaction_in_civ = self.in_charge_sensitive_volume(
-            xy_int=np.array([x, y]).T,  # maps are in R_true, so orginal position should be here
-            z_int=z,  # maps are in Z_true, so orginal position should be here
+            xy_int=np.array([x, y]).T,
+            z_int=z,
+            field_values=field_values,
         )
         n_electron = self.rng.binomial(n=n_electron, p=interaction_in_civ)
 
         # Absorb electrons during the drift
         # Average drift time of the electrons
         drift_time_mean, drift_time_spread = self.get_s2_drift_time_params(
-            xy_int=np.array([x, y]).T, z_int=z
+            xy_int=np.array([x, y]).T, z_int=z, field_values=field_values
         )
 
         if self.electron_lifetime_liquid > 0:
@@ -328,9 +338,24 @@ class ElectronDrift(FuseBasePlugin):
         positions = np.array([x_obs, y_obs]).T
         return z, positions
 
-    def in_charge_sensitive_volume(self, xy_int, z_int):
+    def field_dependent_values(self, z, xy):
+        """Evaluate all enabled field dependent maps at once. The maps share
+        the search of the neighbouring map points.
+
+        Args:
+            z: 1d array of z (floats)
+            xy: 2d array of xy positions (floats)
+        Returns:
+            dict with the values of each enabled map
+        """
+        r = np.sqrt(xy[:, 0] ** 2 + xy[:, 1] ** 2)
+        return evaluate_maps(np.array([r, z]).T, self.field_dependent_maps)
+
+    def in_charge_sensitive_volume(self, xy_int, z_int, field_values=None):
         if self.enable_survival_probability_map:
-            p_surv = self.field_dependencies_map(z_int, xy_int, map_name="survival_probability_map")
+            if field_values is None:
+                field_values = self.field_dependent_values(z_int, xy_int)
+            p_surv = field_values["survival_probability_map"]
             p_surv = np.clip(p_surv, a_min=0, a_max=1)
 
         else:
@@ -338,22 +363,24 @@ class ElectronDrift(FuseBasePlugin):
 
         return p_surv
 
-    def get_s2_drift_time_params(self, xy_int, z_int):
+    def get_s2_drift_time_params(self, xy_int, z_int, field_values=None):
         """Calculate s2 drift time mean and spread.
 
         Args:
             z_int: 1d array of true z (floats)
             xy_int: 2d array of true xy positions (floats)
+            field_values: dict from field_dependent_values, evaluated if not given
         Returns:
             returns two arrays of floats (mean drift time, drift time spread)
         """
+        if field_values is None:
+            field_values = self.field_dependent_values(z_int, xy_int)
+
         liquid_level = self.gate_to_anode_distance - self.elr_gas_gap_length
-        drift_velocity_below_gate = self.get_avg_drift_velocity(z_int, xy_int)
+        drift_velocity_below_gate = self.get_avg_drift_velocity(z_int, xy_int, field_values)
         drift_velocity_above_gate = liquid_level / self.drift_time_gate
         if self.enable_diffusion_longitudinal_map:
-            diffusion_constant_longitudinal = self.diffusion_longitudinal_map(
-                z_int, xy_int
-            )  # cm²/ns
+            diffusion_constant_longitudinal = field_values["diffusion_longitudinal_map"]  # cm²/ns
         else:
             diffusion_constant_longitudinal = self.diffusion_constant_longitudinal
 
@@ -381,17 +408,20 @@ class ElectronDrift(FuseBasePlugin):
 
         return drift_time_mean, drift_time_spread
 
-    def get_avg_drift_velocity(self, z, xy):
+    def get_avg_drift_velocity(self, z, xy, field_values=None):
         """Calculate s2 drift time mean and spread
         Args:
             z: 1d array of z (floats)
             xy: 2d array of xy positions (floats)
+            field_values: dict from field_dependent_values, evaluated if not given
         Returns:
             array of floats corresponding to average drift velocities
                 from given point to the gate.
         """
         if self.enable_drift_velocity_map:
-            drift_v_LXe = self.field_dependencies_map(z, xy, map_name="drift_speed_map")  # mm/µs
+            if field_values is None:
+                field_values = self.field_dependent_values(z, xy)
+            drift_v_LXe = np.array(field_values["drift_speed_map"])  # mm/µs
             drift_v_LXe *= 1e-4  # cm/ns
             drift_v_LXe *= self.drift_velocity_scaling
         else:
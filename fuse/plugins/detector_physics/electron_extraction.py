@@ -4,6 +4,8 @@ import numpy as np
 import strax
 import straxen
 
+from ...maps import memoized_map
+from ...map_store import SharedURLConfig
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -17,7 +19,7 @@ class ElectronExtraction(FuseBasePlugin):
     """Plugin to simulate the loss of electrons during the extraction of
     drifted electrons from the liquid into the gas phase."""
 
-    __version__ = "0.2.0"
+    __version__ = "0.2.1"
 
     depends_on = ("microphysics_summary", "drifted_electrons")
     provides = "extracted_electrons"
@@ -73,7 +75,7 @@ class ElectronExtraction(FuseBasePlugin):
         help="Boolean indication if the secondary scintillation gain is taken from a map",
     )
 
-    s2_correction_map = straxen.URLConfig(
+    s2_correction_map = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s2_correction_map"
@@ -82,7 +84,7 @@ class ElectronExtraction(FuseBasePlugin):
         help="S2 correction map",
     )
 
-    se_gain_map = straxen.URLConfig(
+    se_gain_map = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=se_gain_map"
@@ -105,16 +107,18 @@ class ElectronExtraction(FuseBasePlugin):
         y = interactions_in_roi[mask]["y_obs"]
 
         xy_int = np.array([x, y]).T  # maps are in R_true, so orginal position should be here
+        # The map values of the clusters are reused by SecondaryScintillation
+        cluster_id = interactions_in_roi[mask]["cluster_id"]
 
         if self.ext_eff_from_map:
             # Extraction efficiency is g2(x,y)/SE_gain(x,y)
-            rel_s2_cor = self.s2_correction_map(xy_int)
+            rel_s2_cor = memoized_map(self.s2_correction_map)(xy_int, cluster_id=cluster_id)
             # Doesn't always need to be flattened, but if s2_correction_map = False,
             # then map is made from MC
             rel_s2_cor = rel_s2_cor.flatten()
 
             if self.se_gain_from_map:
-                se_gains = self.se_gain_map(xy_int)
+                se_gains = memoized_map(self.se_gain_map)(xy_int, cluster_id=cluster_id)
             else:
                 # Is in get_s2_light_yield map is scaled according to relative s2 correction
                 # We also need to do it here to have consistent g2
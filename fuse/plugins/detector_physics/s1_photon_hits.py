@@ -3,9 +3,10 @@ import straxen
 import logging
 
 import numpy as np
-from copy import deepcopy
 
 from ...common import pmt_gains
+from ...maps import RegularGridMap, cached_derived_array, memoized_map
+from ...map_store import SharedURLConfig, shared_key
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -19,7 +20,7 @@ class S1PhotonHits(FuseBasePlugin):
     """Plugin to simulate the number of detected S1 photons using a S1 light
     collection efficiency map."""
 
-    __version__ = "0.2.1"
+    __version__ = "0.2.4"
 
     depends_on = "microphysics_summary"
     provides = "s1_photon_hits"
@@ -57,13 +58,13 @@ class S1PhotonHits(FuseBasePlugin):
         help="Voltage range of the digitizer boards [V]",
     )
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
     )
 
-    s1_pattern_map = straxen.URLConfig(
+    s1_pattern_map = SharedURLConfig(
         default="pattern_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s1_pattern_map"
@@ -104,13 +105,21 @@ class S1PhotonHits(FuseBasePlugin):
         self.pmt_mask = np.array(self.gains) > 0  # Converted from to pe (from cmt by default)
 
         # Build LCE map from s1 pattern map
-        lcemap = deepcopy(self.s1_pattern_map)
-        # AT: this scaling with mast is redundant to `make_patternmap`, but keep it in for now
-        lcemap.data["map"] = np.sum(
-            lcemap.data["map"][:][:][:], axis=3, keepdims=True, where=self.pmt_mask
-        )
-        lcemap.__init__(lcemap.data)
-        self.s1_lce_correction_map = lcemap
+        if isinstance(self.s1_pattern_map, RegularGridMap):
+            self.s1_lce_correction_map = self.s1_pattern_map.sum_channels(self.pmt_mask)
+        else:
+            # The LCE map is cached under the key of the pattern map in the map store
+            pattern = self.s1_pattern_map.data["map"]
+            # AT: this scaling with mast is redundant to `make_patternmap`, but keep it in for now
+            lce = cached_derived_array(
+                "s1_lce_map",
+                shared_key(self.s1_pattern_map),
+                dict(pmt_mask=np.asarray(self.pmt_mask).tolist()),
+                lambda: np.sum(pattern, axis=3, keepdims=True, where=self.pmt_mask),
+            )
+            self.s1_lce_correction_map = straxen.InterpolatingMap(
+                dict(self.s1_pattern_map.data, map=lce)
+            )
 
     def compute(self, interactions_in_roi):
         # Just apply this to clusters with photons
@@ -155,7 +164,7 @@ class S1PhotonHits(FuseBasePlugin):
         Returns:
             return array with number photons
         """
-        ly = self.s1_lce_correction_map(positions)
+        ly = memoized_map(self.s1_lce_correction_map)(positions)
         # Depending on if you use the data driven or mc pattern map for light yield
         # the shape of n_photon_hits will change. Mc needs a squeeze
         if len(ly.shape) != 1:
@@ -12,7 +12,9 @@ from ...common import (
     pmt_transit_time_spread,
     photon_gain_calculation,
 )
+from ...maps import memoized_map
 from ...plugin import FuseBasePlugin
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -33,7 +35,7 @@ class S1PhotonPropagationBase(FuseBasePlugin):
     Note: The timing calculation is defined in the child plugin.
     """
 
-    __version__ = "0.3.3"
+    __version__ = "0.3.4"
 
     depends_on = ("microphysics_summary", "s1_photon_hits")
     provides = "propagated_s1_photons"
@@ -106,13 +108,13 @@ class S1PhotonPropagationBase(FuseBasePlugin):
         help="Number of PMTs in the TPC",
     )
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
     )
 
-    photon_area_distribution = straxen.URLConfig(
+    photon_area_distribution = SharedURLConfig(
         default="simple_load://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=photon_area_distribution"
@@ -121,7 +123,7 @@ class S1PhotonPropagationBase(FuseBasePlugin):
         help="Photon area distribution",
     )
 
-    s1_pattern_map = straxen.URLConfig(
+    s1_pattern_map = SharedURLConfig(
         default="pattern_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s1_pattern_map"
@@ -245,7 +247,7 @@ class S1PhotonPropagationBase(FuseBasePlugin):
         config :params s1_pattern_map: interpolator instance of the s1 pattern
         map returns nested array with photon channels."""
         channels = np.arange(self.n_tpc_pmts)  # +1 for the channel map
-        p_per_channel = self.s1_pattern_map(positions)
+        p_per_channel = memoized_map(self.s1_pattern_map)(positions)
         p_per_channel[:, np.in1d(channels, self.turned_off_pmts)] = 0
 
         _photon_channels = []
@@ -265,7 +267,7 @@ class S1PhotonPropagation(S1PhotonPropagationBase):
     """Child plugin to simulate the propagation of S1 photons using optical
     propagation and luminescence timing from nestpy."""
 
-    __version__ = "0.3.1"
+    __version__ = "0.3.2"
 
     child_plugin = True
 
@@ -14,7 +14,9 @@ from ...common import (
     pmt_transit_time_spread,
     photon_gain_calculation,
 )
+from ...maps import evaluate_maps
 from ...plugin import FuseBaseDownChunkingPlugin
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -33,7 +35,7 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
     Note: The timing calculation is defined in the child plugin.
     """
 
-    __version__ = "0.3.5"
+    __version__ = "0.3.6"
 
     depends_on = (
         "merged_electron_time",
@@ -114,13 +116,13 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
         help="Number of PMTs in the TPC",
     )
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
     )
 
-    photon_area_distribution = straxen.URLConfig(
+    photon_area_distribution = SharedURLConfig(
         default="simple_load://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=photon_area_distribution"
@@ -184,7 +186,7 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
     )
 
     # stupid naming problem...
-    field_dependencies_map_tmp = straxen.URLConfig(
+    field_dependencies_map_tmp = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=field_dependencies_map"
@@ -203,7 +205,7 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
         help="Mean S2 area fraction top",
     )
 
-    s2_pattern_map = straxen.URLConfig(
+    s2_pattern_map = SharedURLConfig(
         default="s2_aft_scaling://pattern_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s2_pattern_map"
@@ -305,15 +307,6 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
             self.photon_area_distribution
         )
 
-        # Field dependencies
-        if self.enable_diffusion_transverse_map:
-
-            def rz_map(z, xy, **kwargs):
-                r = np.sqrt(xy[:, 0] ** 2 + xy[:, 1] ** 2)
-                return self.field_dependencies_map_tmp(np.array([r, z]).T, **kwargs)
-
-            self.field_dependencies_map = rz_map
-
     def compute(self, interactions_in_roi, individual_electrons, start, end):
         # Just apply this to clusters with photons
         mask = interactions_in_roi["n_electron_extracted"] > 0
@@ -496,12 +489,17 @@ class S2PhotonPropagationBase(FuseBaseDownChunkingPlugin):
         assert all(z < 0), "All S2 in liquid should have z < 0"
 
         if self.enable_diffusion_transverse_map:
-            diffusion_constant_radial = self.field_dependencies_map(
-                z, xy, map_name="diffusion_radial_map"
-            )  # cm²/s
-            diffusion_constant_azimuthal = self.field_dependencies_map(
-                z, xy, map_name="diffusion_azimuthal_map"
-            )  # cm²/s
+            # Both maps share the search of the neighbouring map points
+            r = np.sqrt(xy[:, 0] ** 2 + xy[:, 1] ** 2)
+            diffusion_constants = evaluate_maps(
+                np.array([r, z]).T,
+                dict(
+                    radial=(self.field_dependencies_map_tmp, "diffusion_radial_map"),
+                    azimuthal=(self.field_dependencies_map_tmp, "diffusion_azimuthal_map"),
+                ),
+            )
+            diffusion_constant_radial = diffusion_constants["radial"]  # cm²/s
+            diffusion_constant_azimuthal = diffusion_constants["azimuthal"]  # cm²/s
             diffusion_constant_radial *= 1e-9  # cm²/ns
             diffusion_constant_azimuthal *= 1e-9  # cm²/ns
         else:
@@ -567,7 +565,7 @@ class S2PhotonPropagation(S2PhotonPropagationBase):
     luminescence timing from garfield gas gap, singlet and tripled delays and
     optical propagation."""
 
-    __version__ = "0.2.0"
+    __version__ = "0.2.1"
 
     child_plugin = True
 
@@ -674,7 +672,7 @@ class S2PhotonPropagationSimple(S2PhotonPropagationBase):
     simple liminescence model, singlet and tripled delays and optical
     propagation."""
 
-    __version__ = "0.1.0"
+    __version__ = "0.1.1"
 
     child_plugin = True
 
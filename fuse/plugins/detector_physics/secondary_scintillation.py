@@ -6,7 +6,9 @@ import strax
 import straxen
 
 from ...common import pmt_gains
+from ...maps import memoized_map
 from ...plugin import FuseBasePlugin
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -19,7 +21,7 @@ class SecondaryScintillation(FuseBasePlugin):
     """Plugin to simulate the secondary scintillation process in the gas
     phase."""
 
-    __version__ = "0.2.0"
+    __version__ = "0.2.1"
 
     result_name_photons = "s2_photons"
     result_name_photons_sum = "s2_photons_sum"
@@ -109,7 +111,7 @@ class SecondaryScintillation(FuseBasePlugin):
         help="Probability of double photo-electron emission",
     )
 
-    se_gain_map = straxen.URLConfig(
+    se_gain_map = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=se_gain_map"
@@ -118,7 +120,7 @@ class SecondaryScintillation(FuseBasePlugin):
         help="Map of the single electron gain",
     )
 
-    s2_correction_map = straxen.URLConfig(
+    s2_correction_map = SharedURLConfig(
         default="itp_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s2_correction_map"
@@ -127,7 +129,7 @@ class SecondaryScintillation(FuseBasePlugin):
         help="S2 correction map",
     )
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
@@ -152,7 +154,7 @@ class SecondaryScintillation(FuseBasePlugin):
         help="Mean S2 area fraction top",
     )
 
-    s2_pattern_map = straxen.URLConfig(
+    s2_pattern_map = SharedURLConfig(
         default="s2_aft_scaling://pattern_map://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=s2_pattern_map"
@@ -196,7 +198,9 @@ class SecondaryScintillation(FuseBasePlugin):
 
         positions = np.array([individual_electrons["x"], individual_electrons["y"]]).T
 
-        electron_gains = self.get_s2_light_yield(positions=positions)
+        electron_gains = self.get_s2_light_yield(
+            positions=positions, cluster_id=individual_electrons["cluster_id"]
+        )
 
         n_photons_per_ele = self.rng.poisson(electron_gains)
 
@@ -234,19 +238,21 @@ class SecondaryScintillation(FuseBasePlugin):
             self.result_name_photons_sum: result_sum_photons,
         }
 
-    def get_s2_light_yield(self, positions):
+    def get_s2_light_yield(self, positions, cluster_id=None):
         """Calculate s2 light yield...
 
         Args:
             positions: 2d array of positions (floats) returns array
                 of floats (mean expectation)
+            cluster_id: 1d array with the cluster of each position, the
+                map is evaluated once per cluster
         """
 
         if self.se_gain_from_map:
-            sc_gain = self.se_gain_map(positions)
+            sc_gain = memoized_map(self.se_gain_map)(positions, cluster_id=cluster_id)
         else:
             # calculate it from MC pattern map directly if no "se_gain_map" is given
-            sc_gain = self.s2_correction_map(positions)
+            sc_gain = memoized_map(self.s2_correction_map)(positions, cluster_id=cluster_id)
             sc_gain *= self.s2_secondary_sc_gain_mc
 
         # Depending on if you use the data driven or mc pattern map for light yield for S2
@@ -21,3 +21,6 @@ from .wfsim_connection import *
 
 from . import detector_volumes
 from .detector_volumes import *
+
+from . import fused_microphysics
+from .fused_microphysics import *
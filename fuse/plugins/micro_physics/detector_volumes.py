@@ -1,5 +1,6 @@
 import strax
 import straxen
+import numpy as np
 import logging
 
 from ...dtypes import (
@@ -8,7 +9,8 @@ from ...dtypes import (
     cluster_id_fields,
     cluster_misc_fields,
 )
-from ...volume_plugin import VolumePlugin
+from ...plugin import FuseBasePlugin
+from ...volume_plugin import VolumePlugin, compile_volumes, assign_volumes
 from ...vertical_merger_plugin import VerticalMergerPlugin
 
 logging.basicConfig(handlers=[logging.StreamHandler()])
@@ -29,6 +31,168 @@ class VolumesMerger(VerticalMergerPlugin):
         return super().compute(**kwargs)
 
 
+class DetectorVolumesMixin:
+    """Config options and methods of the volume selection, shared by
+    DetectorVolumes and FusedMicroPhysics."""
+
+    # Config options
+    detector_volumes = straxen.URLConfig(
+        default=None,
+        help="List of detector volumes. Each volume is a dict with shape (cylinder, polycone "
+        "or polygon), its geometry in cm, xe_density, vol_id and create_S2. If None, the "
+        "XENONnT TPC and the volume below the cathode are built from the xenonnt options",
+    )
+
+    xenonnt_z_cathode = straxen.URLConfig(
+        default=-148.6515,  # Top of the cathode electrode
+        type=(int, float),
+        help="z position of the XENONnT cathode [cm]",
+    )
+
+    xenonnt_z_gate_mesh = straxen.URLConfig(
+        default=0.0,  # bottom of the gate electrode
+        type=(int, float),
+        help="z position of the XENONnT gate mesh [cm]",
+    )
+
+    xenonnt_z_bottom_pmts = straxen.URLConfig(
+        default=-154.6555,  # Top surface of the bottom PMT window
+        type=(int, float),
+        help="z position of the XENONnT bottom PMT array [cm]",
+    )
+
+    xenonnt_sensitive_volume_radius = straxen.URLConfig(
+        default=66.4,
+        type=(int, float),
+        help="Radius of the XENONnT TPC [cm]",
+    )
+
+    xenon_density_tpc = straxen.URLConfig(
+        default=2.862,
+        type=(int, float),
+        help="Density of xenon in the TPC volume [g/cm3]",
+    )
+
+    xenon_density_below_cathode = straxen.URLConfig(
+        default=2.862,
+        type=(int, float),
+        help="Density of xenon in the below-cathode-volume [g/cm3]",
+    )
+
+    create_S2_xenonnt_TPC = straxen.URLConfig(
+        default=True,
+        type=bool,
+        help="Create S2s in the XENONnT TPC",
+    )
+
+    create_S2_xenonnt_below_cathode = straxen.URLConfig(
+        default=False,
+        type=bool,
+        help="No S2s from below the cathode",
+    )
+
+    def setup(self):
+        super().setup()
+
+        self.volumes = self.get_volumes()
+        self.compiled_volumes = compile_volumes(self.volumes)
+
+    def get_volumes(self):
+        """Function which returns the detector volumes of this plugin."""
+        if self.detector_volumes is not None:
+            return self.detector_volumes
+
+        return [
+            dict(
+                name="tpc",
+                shape="cylinder",
+                min_z=self.xenonnt_z_cathode,
+                max_z=self.xenonnt_z_gate_mesh,
+                max_r=self.xenonnt_sensitive_volume_radius,
+                xe_density=self.xenon_density_tpc,
+                vol_id=1,
+                create_S2=self.create_S2_xenonnt_TPC,
+            ),
+            dict(
+                name="below_cathode",
+                shape="cylinder",
+                min_z=self.xenonnt_z_bottom_pmts,
+                max_z=self.xenonnt_z_cathode,
+                max_r=self.xenonnt_sensitive_volume_radius,
+                xe_density=self.xenon_density_below_cathode,
+                vol_id=2,
+                create_S2=self.create_S2_xenonnt_below_cathode,
+            ),
+        ]
+
+
+class DetectorVolumes(DetectorVolumesMixin, FuseBasePlugin):
+    """Plugin that selects the clusters in the detector volumes in a single
+    pass.
+
+    Each cluster is assigned to the first volume of ``detector_volumes``
+    containing it and gets the ``xe_density``, ``vol_id`` and
+    ``create_S2`` of this volume. Clusters outside of all volumes are
+    dropped. Volumes can be cylinders, polycones or polygons in the
+    (r, z) plane, see ``fuse.volume_plugin.compile_volumes``. By default
+    the XENONnT TPC and the volume below the cathode are used, which
+    gives the same output as XENONnT_TPC, XENONnT_BelowCathode and
+    VolumesMerger.
+    """
+
+    __version__ = "0.1.0"
+    depends_on = "clustered_interactions"
+    provides = "interactions_in_roi"
+    data_kind = "interactions_in_roi"
+
+    save_when = strax.SaveWhen.TARGET
+
+    dtype = (
+        cluster_positions_fields
+        + cluster_id_fields
+        + cluster_misc_fields
+        + primary_positions_fields
+        + strax.time_fields
+    )
+
+    def compute(self, clustered_interactions):
+        return select_volumes(clustered_interactions, self.volumes, self.compiled_volumes)
+
+
+def select_volumes(interactions, volumes, compiled_volumes):
+    """Function to select the interactions in the detector volumes.
+
+    Each interaction gets the properties of the first volume containing
+    it. The result is sorted by time, interactions with the same time
+    are ordered by volume.
+
+    Args:
+        interactions: clustered interactions
+        volumes: list of volume definitions
+        compiled_volumes: volumes compiled with compile_volumes
+    """
+    r = np.sqrt(interactions["x"] ** 2 + interactions["y"] ** 2)
+    volume_index = assign_volumes(r, interactions["z"], *compiled_volumes)
+
+    mask = volume_index >= 0
+    volume_index = volume_index[mask]
+    time = interactions["time"][mask]
+
+    in_order = (np.diff(time) > 0) | ((np.diff(time) == 0) & (np.diff(volume_index) >= 0))
+    if np.all(in_order):
+        selected = interactions[mask]
+    else:
+        order = np.lexsort((volume_index, time))
+        selected = interactions[mask][order]
+        volume_index = volume_index[order]
+
+    for field in ["xe_density", "vol_id", "create_S2"]:
+        values = np.array([volume[field] for volume in volumes], dtype=selected.dtype[field])
+        selected[field] = values[volume_index]
+
+    return selected
+
+
 # Fixed detector dimensions of XENONnT:
 # See also: https://xe1t-wiki.lngs.infn.it/doku.php?id=xenon:xenonnt:analysis:coordinate_system
 
@@ -12,8 +12,38 @@ logging.basicConfig(handlers=[logging.StreamHandler()])
 log = logging.getLogger("fuse.micro_physics.electric_field")
 
 
+class ElectricFieldMixin:
+    """Config options and methods of the electric field assignment,
+    shared by ElectricField and FusedMicroPhysics."""
+
+    # Config options
+    efield_map = straxen.URLConfig(
+        default="itp_map://resource://simulation_config://"
+        "SIMULATION_CONFIG_FILE.json?"
+        "&key=efield_map"
+        "&fmt=json.gz"
+        "&method=RegularGridInterpolator",
+        cache=True,
+        help="Map of the electric field in the detector",
+    )
+
+    def get_electric_field(self, interactions_in_roi, dtype):
+        """Function which returns the electric field values at the
+        positions of the interactions."""
+        electric_field_array = np.zeros(len(interactions_in_roi), dtype=dtype)
+        electric_field_array["time"] = interactions_in_roi["time"]
+        electric_field_array["endtime"] = interactions_in_roi["endtime"]
+
+        if len(interactions_in_roi) > 0:
+            electric_field_array["e_field"] = electric_field_values(
+                interactions_in_roi, self.efield_map
+            )
+
+        return electric_field_array
+
+
 @export
-class ElectricField(FuseBasePlugin):
+class ElectricField(ElectricFieldMixin, FuseBasePlugin):
     """Plugin that calculates the electric field values for the cluster
     position."""
 
@@ -27,39 +57,31 @@ class ElectricField(FuseBasePlugin):
 
     dtype = electric_fields + strax.time_fields
 
-    # Config options
-    efield_map = straxen.URLConfig(
-        default="itp_map://resource://simulation_config://"
-        "SIMULATION_CONFIG_FILE.json?"
-        "&key=efield_map"
-        "&fmt=json.gz"
-        "&method=RegularGridInterpolator",
-        cache=True,
-        help="Map of the electric field in the detector",
-    )
-
     def compute(self, interactions_in_roi):
         if len(interactions_in_roi) == 0:
             return np.zeros(0, dtype=self.dtype)
 
-        electric_field_array = np.zeros(len(interactions_in_roi), dtype=self.dtype)
-        electric_field_array["time"] = interactions_in_roi["time"]
-        electric_field_array["endtime"] = interactions_in_roi["endtime"]
+        return self.get_electric_field(interactions_in_roi, self.dtype)
 
-        r = np.sqrt(interactions_in_roi["x"] ** 2 + interactions_in_roi["y"] ** 2)
-        positions = np.stack((r, interactions_in_roi["z"]), axis=1)
-        electric_field_array["e_field"] = self.efield_map(positions)
 
-        # Clip negative values to 0
-        n_negative_values = np.sum(electric_field_array["e_field"] < 0)
-        if n_negative_values > 0:
-            log.warning(f"Found {n_negative_values} negative electric field values. Clipping to 0.")
-        electric_field_array["e_field"] = np.clip(electric_field_array["e_field"], 0, None)
+def electric_field_values(interactions, efield_map):
+    """Function to get the electric field at the positions of the
+    interactions.
 
-        # Clip NaN values to 0
-        n_nan_values = np.sum(np.isnan(electric_field_array["e_field"]))
-        if n_nan_values > 0:
-            log.warning(f"Found {n_nan_values} NaN electric field values. Clipping to 0.")
-        electric_field_array["e_field"] = np.nan_to_num(electric_field_array["e_field"])
+    Negative and NaN values of the map are clipped to 0.
+    """
+    r = np.sqrt(interactions["x"] ** 2 + interactions["y"] ** 2)
+    positions = np.stack((r, interactions["z"]), axis=1)
+    e_field = efield_map(positions)
 
-        return electric_field_array
+    # Clip negative values to 0
+    n_negative_values = np.sum(e_field < 0)
+    if n_negative_values > 0:
+        log.warning(f"Found {n_negative_values} negative electric field values. Clipping to 0.")
+    e_field = np.clip(e_field, 0, None)
+
+    # Clip NaN values to 0
+    n_nan_values = np.sum(np.isnan(e_field))
+    if n_nan_values > 0:
+        log.warning(f"Found {n_nan_values} NaN electric field values. Clipping to 0.")
+    return np.nan_to_num(e_field)
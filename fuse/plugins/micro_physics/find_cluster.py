@@ -4,7 +4,6 @@ import numpy as np
 import numba
 import strax
 import straxen
-from sklearn.cluster import DBSCAN
 
 from ...plugin import FuseBasePlugin
 
@@ -14,28 +13,9 @@ logging.basicConfig(handlers=[logging.StreamHandler()])
 log = logging.getLogger("fuse.micro_physics.find_cluster")
 
 
-@export
-class FindCluster(FuseBasePlugin):
-    """Plugin to find clusters of energy deposits.
-
-    This plugin is performing the first half of the microclustering
-    process. Energy deposits are grouped into clusters based on their
-    proximity to each other in 3D space and time. The clustering is
-    performed using a 1D temporal clustering algorithm followed by 3D
-    DBSCAN spacial clustering.
-    """
-
-    __version__ = "0.2.1"
-
-    depends_on = "geant4_interactions"
-
-    provides = "cluster_index"
-
-    dtype = [
-        (("Cluster index of the energy deposit", "cluster_ids"), np.int32),
-    ] + strax.time_fields
-
-    save_when = strax.SaveWhen.TARGET
+class FindClusterMixin:
+    """Config options and methods of the microclustering, shared by
+    FindCluster and FusedMicroPhysics."""
 
     # Not start at 0. 0 are set per default for contributing clusters so we want to avoid that
     clusters_seen = 1
@@ -53,23 +33,26 @@ class FindCluster(FuseBasePlugin):
         help="DBSCAN clustering distance (mm)",
     )
 
-    def compute(self, geant4_interactions):
-        """Compute the cluster IDs for a set of GEANT4 interactions.
+    parallel_clustering = straxen.URLConfig(
+        default=False,
+        type=bool,
+        track=False,
+        help="Cluster the time clusters in space in parallel using numba threads",
+    )
 
-        Args:
-            geant4_interactions (np.ndarray): An array of GEANT4 interaction data.
+    def find_cluster_index(self, geant4_interactions):
+        """Function which returns the cluster index of the interactions.
 
-        Returns:
-            np.ndarray: An array of cluster IDs with corresponding time and endtime values.
+        The cluster ids continue from the ones of the previous chunk.
         """
-        if len(geant4_interactions) == 0:
-            return np.zeros(0, dtype=self.dtype)
-
         cluster_ids = self.find_cluster(
-            geant4_interactions, self.micro_separation / 10, self.micro_separation_time
+            geant4_interactions,
+            self.micro_separation / 10,
+            self.micro_separation_time,
+            parallel=self.parallel_clustering,
         )
 
-        numpy_data = np.zeros(len(geant4_interactions), dtype=self.dtype)
+        numpy_data = np.zeros(len(geant4_interactions), dtype=FindCluster.dtype)
         numpy_data["cluster_ids"] = cluster_ids + self.clusters_seen
 
         numpy_data["time"] = geant4_interactions["time"]
@@ -80,44 +63,73 @@ class FindCluster(FuseBasePlugin):
         return numpy_data
 
     @staticmethod
-    def find_cluster(interactions, cluster_size_space, cluster_size_time):
+    def find_cluster(interactions, cluster_size_space, cluster_size_time, parallel=False):
         """Function to find clusters in a set of interactions.
 
-        First interactions are clustered in time, then in space.
+        First interactions are clustered in time, then in space. The
+        cluster ids are ordered by time cluster and, within a time
+        cluster, by the first interaction of each spacial cluster.
         """
 
         time_cluster = simple_1d_clustering(interactions["time"], cluster_size_time)
 
-        # Splitting into time cluster and apply space clustering space:
-        spacial_cluster = np.zeros(len(interactions), dtype=np.int32)
+        # Group the interactions by time cluster, keeping their order within a time cluster
+        sort_index = np.argsort(time_cluster, kind="stable")
+        segment_starts = np.append(0, np.cumsum(np.bincount(time_cluster)))
+
+        cluster_function = _cluster_segments_parallel if parallel else _cluster_segments
+        local_cluster, n_clusters = cluster_function(
+            interactions["x"][sort_index],
+            interactions["y"][sort_index],
+            interactions["z"][sort_index],
+            segment_starts,
+            cluster_size_space,
+        )
 
-        _t_clusters = np.unique(time_cluster)
-        for _t in _t_clusters:
-            time_cluster_mask = time_cluster == _t
-            _cl = _find_cluster(
-                interactions[time_cluster_mask], cluster_size_space=cluster_size_space
-            )
-            spacial_cluster[time_cluster_mask] = _cl
-        _, cluster_id = np.unique((time_cluster, spacial_cluster), axis=1, return_inverse=True)
+        cluster_offsets = np.append(0, np.cumsum(n_clusters))
+        cluster_id = np.zeros(len(interactions), dtype=np.int64)
+        cluster_id[sort_index] = cluster_offsets[time_cluster[sort_index]] + local_cluster
 
         return cluster_id
 
 
-def _find_cluster(x, cluster_size_space):
-    """Function to cluster three dimensional data (x, y, z).
+@export
+class FindCluster(FindClusterMixin, FuseBasePlugin):
+    """Plugin to find clusters of energy deposits.
 
-    Args:
-        x (np.ndarray): structured numpy array with x, y, z coordinates to be clustered
-        cluster_size_space (float): Clustering distance for DBSCAN
-    Returns:
-        Cluster labels
+    This plugin is performing the first half of the microclustering
+    process. Energy deposits are grouped into clusters based on their
+    proximity to each other in 3D space and time. The clustering is
+    performed using a 1D temporal clustering algorithm followed by a 3D
+    single-linkage spacial clustering of each time cluster (equivalent
+    to DBSCAN with min_samples=1).
     """
-    db_cluster = DBSCAN(eps=cluster_size_space, min_samples=1)
 
-    # Conversion from numpy structured array to regular array
-    xprime = np.stack((x["x"], x["y"], x["z"]), axis=1)
+    __version__ = "0.3.1"
+
+    depends_on = "geant4_interactions"
+
+    provides = "cluster_index"
+
+    dtype = [
+        (("Cluster index of the energy deposit", "cluster_ids"), np.int32),
+    ] + strax.time_fields
+
+    save_when = strax.SaveWhen.TARGET
+
+    def compute(self, geant4_interactions):
+        """Compute the cluster IDs for a set of GEANT4 interactions.
+
+        Args:
+            geant4_interactions (np.ndarray): An array of GEANT4 interaction data.
+
+        Returns:
+            np.ndarray: An array of cluster IDs with corresponding time and endtime values.
+        """
+        if len(geant4_interactions) == 0:
+            return np.zeros(0, dtype=self.dtype)
 
-    return db_cluster.fit_predict(xprime)
+        return self.find_cluster_index(geant4_interactions)
 
 
 @numba.jit(nopython=True)
@@ -151,3 +163,136 @@ def simple_1d_clustering(data, scale):
     clusters_undo_sort = np.array(clusters)[idx_undo_sort]
 
     return clusters_undo_sort
+
+
+# Segments with up to this number of interactions are clustered by comparing all pairs
+BRUTE_FORCE_SEGMENT_SIZE = 16
+
+
+def _cluster_segments_python(x, y, z, segment_starts, eps):
+    """Function to cluster three dimensional data in space, segment by
+    segment. Two points are connected if their distance is at most eps.
+    The clusters are the connected components (single-linkage).
+
+    Args:
+        x, y, z (np.ndarray): coordinates, grouped by segment
+        segment_starts (np.ndarray): index of the first point of each
+            segment and the total number of points
+        eps (float): clustering distance
+    Returns:
+        labels (np.ndarray): cluster label within the segment. Labels are
+            ordered by the first point of each cluster.
+        n_clusters (np.ndarray): number of clusters per segment
+    """
+    n_segments = len(segment_starts) - 1
+    labels = np.zeros(segment_starts[-1], dtype=np.int64)
+    n_clusters = np.zeros(n_segments, dtype=np.int64)
+
+    for segment in numba.prange(n_segments):
+        start = segment_starts[segment]
+        stop = segment_starts[segment + 1]
+        n_clusters[segment] = _cluster_segment(
+            x[start:stop], y[start:stop], z[start:stop], eps, labels[start:stop]
+        )
+
+    return labels, n_clusters
+
+
+_cluster_segments = numba.njit(_cluster_segments_python)
+_cluster_segments_parallel = numba.njit(parallel=True)(_cluster_segments_python)
+
+
+@numba.njit
+def _cluster_segment(x, y, z, eps, labels):
+    """Single-linkage clustering of one segment using a spatial hash grid
+    and union-find."""
+    n = len(x)
+    parent = np.arange(n)
+    eps2 = np.float64(eps) ** 2
+
+    # Cells are at least eps wide, so connected points are in neighbouring cells.
+    # The cell size is increased for widely spread points to keep the keys in int64.
+    cell_size = 0.0
+    if n > BRUTE_FORCE_SEGMENT_SIZE:
+        extent = max(x.max() - x.min(), y.max() - y.min(), z.max() - z.min())
+        cell_size = max(np.float64(eps), extent / 2**20)
+
+    if not cell_size > 0:
+        # Small segments, and points at a single position with eps = 0 where no
+        # grid can be built
+        for i in range(n):
+            for j in range(i + 1, n):
+                if _distance2(x, y, z, i, j) <= eps2:
+                    _union(parent, i, j)
+    else:
+        x_min, y_min, z_min = x.min(), y.min(), z.min()
+        cx = ((x - x_min) / cell_size).astype(np.int64)
+        cy = ((y - y_min) / cell_size).astype(np.int64)
+        cz = ((z - z_min) / cell_size).astype(np.int64)
+        ny = cy.max() + 1
+        nz = cz.max() + 1
+        nx = cx.max() + 1
+        keys = (cx * ny + cy) * nz + cz
+
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+
+        for a in range(n):
+            i = order[a]
+            for dx in range(-1, 2):
+                if (cx[i] + dx < 0) or (cx[i] + dx >= nx):
+                    continue
+                for dy in range(-1, 2):
+                    if (cy[i] + dy < 0) or (cy[i] + dy >= ny):
+                        continue
+                    column_key = ((cx[i] + dx) * ny + (cy[i] + dy)) * nz
+                    low = np.searchsorted(sorted_keys, column_key + max(cz[i] - 1, 0))
+                    high = np.searchsorted(
+                        sorted_keys, column_key + min(cz[i] + 1, nz - 1), side="right"
+                    )
+                    # Each pair is compared once, from the point earlier in the cell order
+                    for b in range(max(low, a + 1), high):
+                        j = order[b]
+                        if _distance2(x, y, z, i, j) <= eps2:
+                            _union(parent, i, j)
+
+    # Number the clusters in the order of their first point
+    root_label = np.full(n, -1, dtype=np.int64)
+    n_labels = 0
+    for i in range(n):
+        root = _find(parent, i)
+        if root_label[root] == -1:
+            root_label[root] = n_labels
+            n_labels += 1
+        labels[i] = root_label[root]
+
+    return n_labels
+
+
+@numba.njit
+def _distance2(x, y, z, i, j):
+    dx = np.float64(x[i]) - np.float64(x[j])
+    dy = np.float64(y[i]) - np.float64(y[j])
+    dz = np.float64(z[i]) - np.float64(z[j])
+    return dx * dx + dy * dy + dz * dz
+
+
+@numba.njit
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    # Path compression
+    while parent[i] != root:
+        next_i = parent[i]
+        parent[i] = root
+        i = next_i
+    return root
+
+
+@numba.njit
+def _union(parent, i, j):
+    root_i = _find(parent, i)
+    root_j = _find(parent, j)
+    if root_i != root_j:
+        parent[max(root_i, root_j)] = min(root_i, root_j)
@@ -0,0 +1,83 @@
+import strax
+import numpy as np
+import logging
+
+from ...dtypes import (
+    primary_positions_fields,
+    cluster_positions_fields,
+    cluster_id_fields,
+    cluster_misc_fields,
+    electric_fields,
+)
+from ...plugin import FuseBasePlugin
+from .find_cluster import FindClusterMixin
+from .merge_cluster import MergeClusterMixin
+from .detector_volumes import DetectorVolumesMixin, select_volumes
+from .electric_field import ElectricFieldMixin
+
+export, __all__ = strax.exporter()
+
+logging.basicConfig(handlers=[logging.StreamHandler()])
+log = logging.getLogger("fuse.micro_physics.fused_microphysics")
+
+
+@export
+class FusedMicroPhysics(
+    FindClusterMixin, MergeClusterMixin, DetectorVolumesMixin, ElectricFieldMixin, FuseBasePlugin
+):
+    """Plugin that performs the microclustering, the volume selection and the
+    electric field assignment in one pass over each chunk of
+    geant4_interactions.
+
+    The outputs are identical to the chain FindCluster, MergeCluster,
+    DetectorVolumes and ElectricField, without the intermediate data
+    types cluster_index and clustered_interactions. Register it instead
+    of these plugins. The config options and methods are shared with
+    them through mixins.
+    """
+
+    __version__ = "0.2.0"
+
+    depends_on = "geant4_interactions"
+    provides = ("interactions_in_roi", "electric_field_values")
+    data_kind = {
+        "interactions_in_roi": "interactions_in_roi",
+        "electric_field_values": "interactions_in_roi",
+    }
+
+    save_when = strax.SaveWhen.TARGET
+
+    dtype = dict()
+    dtype["interactions_in_roi"] = (
+        cluster_positions_fields
+        + cluster_id_fields
+        + cluster_misc_fields
+        + primary_positions_fields
+        + strax.time_fields
+    )
+    dtype["electric_field_values"] = electric_fields + strax.time_fields
+
+    def compute(self, geant4_interactions):
+        if len(geant4_interactions) == 0:
+            return self.empty_result()
+
+        # Microclustering
+        cluster_index = self.find_cluster_index(geant4_interactions)
+        interactions = strax.merge_arrs([geant4_interactions, cluster_index])
+        clusters = self.merge_clusters(interactions, self.dtype["interactions_in_roi"])
+
+        # Volume selection
+        interactions_in_roi = select_volumes(clusters, self.volumes, self.compiled_volumes)
+
+        # Electric field
+        electric_field_array = self.get_electric_field(
+            interactions_in_roi, self.dtype["electric_field_values"]
+        )
+
+        return dict(
+            interactions_in_roi=interactions_in_roi,
+            electric_field_values=electric_field_array,
+        )
+
+    def empty_result(self):
+        return {data_type: np.zeros(0, self.dtype[data_type]) for data_type in self.provides}
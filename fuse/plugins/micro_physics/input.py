@@ -1,4 +1,9 @@
 import os
+import glob
+import json
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 import logging
 
@@ -10,7 +15,24 @@ import strax
 import straxen
 
 from ...dtypes import g4_fields, primary_positions_fields, deposit_positions_fields
-from ...common import full_array_to_numpy, reshape_awkward, dynamic_chunking
+from ...common import (
+    full_array_to_numpy,
+    awkward_to_flat_numpy,
+    ak_num,
+    g4_vocabulary,
+    g4_codes,
+    g4_string_fields,
+    encode_g4_strings,
+    g4_run_vocabulary,
+    is_in_memory_input,
+    iterate_in_memory_input,
+    extend_poisson_event_times,
+    iterate_complete_events,
+    iterate_columnar_file,
+    columnar_file_formats,
+    count_sorted_events,
+    DynamicChunkBuilder,
+)
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -18,6 +40,28 @@ export, __all__ = strax.exporter()
 logging.basicConfig(handlers=[logging.StreamHandler()])
 log = logging.getLogger("fuse.micro_physics.input")
 
+# Increase if the content of the input cache changes
+INPUT_CACHE_VERSION = 2
+
+# Columns and dtypes of csv and columnar input files
+g4_file_columns = {
+    "xp": np.float64,
+    "yp": np.float64,
+    "zp": np.float64,
+    "xp_pri": np.float64,
+    "yp_pri": np.float64,
+    "zp_pri": np.float64,
+    "time": np.float64,
+    "ed": np.float64,
+    "type": str,
+    "trackid": np.int64,
+    "parenttype": str,
+    "parentid": np.int64,
+    "creaproc": str,
+    "edproc": str,
+    "eventid": np.int64,
+}
+
 
 # Remove the path and file name option from the config and do this with the run_number??
 @export
@@ -25,10 +69,28 @@ class ChunkInput(FuseBasePlugin):
     """Plugin to read XENONnT Geant4 root or csv files.
 
     The plugin can distribute the events in time based on a source rate
-    and will create multiple chunks of data if needed.
+    and will create multiple chunks of data if needed. Multiple root
+    files can be given as a list or a glob pattern. They are simulated
+    as one continuous run. Parquet, Arrow IPC and HDF5 files with the
+    columns of the csv input are read in batches and only the needed
+    columns are decoded. Their rows need to be sorted by eventid.
+
+    Instead of a file, the input can be a structured numpy array, a list
+    of arrays or a callable or iterator yielding arrays, holding the
+    fields of geant4_interactions except time and endtime. Positions are
+    given in cm and times in ns. The particle and process names can be
+    given as strings or as int16 codes. The input is registered with
+    ``key = fuse.context.register_in_memory_input(data)`` and file_name
+    is set to the key.
+
+    Geant4 particle and process names are stored as int16 codes. The
+    vocabulary is saved in the metadata and the names can be restored
+    with ``fuse.common.decode_g4_fields(data, st.get_metadata(run_id,
+    "geant4_interactions")["g4_vocabulary"])``. The names of
+    fuse.common.g4_vocabulary and extra_g4_names have fixed codes.
     """
 
-    __version__ = "0.3.3"
+    __version__ = "0.5.1"
 
     depends_on: Tuple = tuple()
     provides = "geant4_interactions"
@@ -41,13 +103,16 @@ class ChunkInput(FuseBasePlugin):
 
     # Config options
     path = straxen.URLConfig(
+        default=None,
         track=False,
-        help="Path to the input file",
+        help="Path to the input file. If None, file_name is used as given",
     )
 
     file_name = straxen.URLConfig(
         track=False,
-        help="Name of the input file",
+        help="Name of the input file. Can also be a glob pattern or a list of root files "
+        "which are simulated as one continuous run. In-memory input is given by the key "
+        "returned by fuse.context.register_in_memory_input",
     )
 
     separation_scale = straxen.URLConfig(
@@ -70,6 +135,13 @@ class ChunkInput(FuseBasePlugin):
         help="All interactions happening after this time (including the event time) will be cut",
     )
 
+    outer_cylinder = straxen.URLConfig(
+        default=None,
+        help="Cylinder dict(max_r=..., min_z=..., max_z=...) in [cm]. If set, only deposits "
+        "inside the cylinder are read and events without any of these deposits are skipped. "
+        "If None, all deposits are kept",
+    )
+
     n_interactions_per_chunk = straxen.URLConfig(
         default=1e5,
         type=(int, float),
@@ -94,15 +166,96 @@ class ChunkInput(FuseBasePlugin):
         "and not the entry number (default)",
     )
 
+    n_shards = straxen.URLConfig(
+        default=1,
+        type=int,
+        help="Split the selected events into n_shards contiguous ranges of events. Only the "
+        "range shard_index is simulated. With source_rate > 0, the event times of the shards "
+        "are in non-overlapping time windows, so the shards can be simulated independently "
+        "and laid end to end in time",
+    )
+
+    shard_index = straxen.URLConfig(
+        default=0,
+        type=int,
+        help="Index of the shard to simulate, between 0 and n_shards - 1",
+    )
+
     nr_only = straxen.URLConfig(
         default=False,
         type=bool,
         help="Filter only nuclear recoil events (maximum ER energy deposit 10 keV)",
     )
 
+    entries_in_flight = straxen.URLConfig(
+        default=None,
+        track=False,
+        help="Maximum number of Geant4 entries held in memory while reading a root file. "
+        "If set, the file is read in batches of entries_in_flight // (n_reader_threads + 1) "
+        "entries and the next batches are prefetched in background threads. "
+        "If None, each input file is loaded at once",
+    )
+
+    n_reader_threads = straxen.URLConfig(
+        default=2,
+        type=int,
+        track=False,
+        help="Number of threads used to read and decompress root files ahead of the simulation",
+    )
+
+    input_cache = straxen.URLConfig(
+        default=False,
+        type=bool,
+        track=False,
+        help="Cache the cleaned and flattened interactions in a .fuse_cache directory next to "
+        "the input file. Later runs with the same input file and cut options read the cache "
+        "and only redo the event time assignment",
+    )
+
+    n_decompression_threads = straxen.URLConfig(
+        default=1,
+        type=int,
+        track=False,
+        help="Number of threads used by uproot to decompress the baskets of the root file",
+    )
+
+    n_interpretation_threads = straxen.URLConfig(
+        default=1,
+        type=int,
+        track=False,
+        help="Number of threads used by uproot to interpret the baskets of the root file",
+    )
+
+    eventid_index = straxen.URLConfig(
+        default=True,
+        type=bool,
+        track=False,
+        help="If cut_by_eventid is selected, store the eventids of each root file in an index "
+        "in a .fuse_cache directory next to the file. Later range selections search the index "
+        "instead of reading the full eventid branch",
+    )
+
+    extra_g4_names = straxen.URLConfig(
+        default=[],
+        help="Geant4 names which get their codes before the input is read, in addition to "
+        "fuse.common.g4_vocabulary. Names used in the classification_rules of MergeCluster "
+        "need to be in one of both",
+    )
+
     def setup(self):
         super().setup()
 
+        if is_in_memory_input(self.config["file_name"]):
+            raise ValueError(
+                "In-memory input can not be set as file_name directly! Register it with "
+                "fuse.context.register_in_memory_input and set the returned key."
+            )
+
+        if (self.n_shards > 1) and (not self.deterministic_seed):
+            # The deterministic seed is derived from the lineage which includes the shard index
+            if self.user_defined_random_seed is not None:
+                self.rng = np.random.default_rng((self.seed, self.shard_index))
+
         self.file_reader = file_loader(
             self.path,
             self.file_name,
@@ -112,14 +265,43 @@ class ChunkInput(FuseBasePlugin):
             cut_delayed=self.cut_delayed,
             n_interactions_per_chunk=self.n_interactions_per_chunk,
             arg_debug=self.debug,
-            outer_cylinder=None,  # This is not running
+            outer_cylinder=self.outer_cylinder,
             entry_start=self.entry_start,
             entry_stop=self.entry_stop,
             cut_by_eventid=self.cut_by_eventid,
             cut_nr_only=self.nr_only,
+            entries_in_flight=self.entries_in_flight,
+            n_reader_threads=self.n_reader_threads,
+            vocabulary=self.g4_vocabulary,
+            use_input_cache=self.input_cache,
+            n_decompression_threads=self.n_decompression_threads,
+            n_interpretation_threads=self.n_interpretation_threads,
+            use_eventid_index=self.eventid_index,
+            n_shards=self.n_shards,
+            shard_index=self.shard_index,
         )
         self.file_reader_iterator = self.file_reader.output_chunk()
 
+    @property
+    def g4_vocabulary(self):
+        """Vocabulary of the Geant4 particle and process names of this run.
+
+        Names found in the input file are appended while reading.
+        """
+        if "_g4_vocabulary" not in self.__dict__:
+            self._g4_vocabulary = g4_run_vocabulary(self.extra_g4_names)
+        return self._g4_vocabulary
+
+    def metadata(self, run_id, data_type):
+        """Save the Geant4 vocabulary along with the data.
+
+        The list is filled while the run is processed and written when
+        the saver is closed.
+        """
+        metadata = super().metadata(run_id, data_type)
+        metadata["g4_vocabulary"] = self.g4_vocabulary
+        return metadata
+
     def compute(self):
         try:
             chunk_data, chunk_left, chunk_right, source_done = next(self.file_reader_iterator)
@@ -148,7 +330,13 @@ class ChunkInput(FuseBasePlugin):
 
 
 class file_loader:
-    """Load the complete root file and return interactions in chunks."""
+    """Load a root or csv file and return interactions in chunks.
+
+    Root files can either be loaded completely or streamed in batches of
+    entries. In both cases the event times and chunk boundaries are
+    identical. Multiple root files are treated as one continuous set of
+    entries sharing the same event time axis.
+    """
 
     def __init__(
         self,
@@ -168,10 +356,18 @@ class file_loader:
         entry_stop=None,
         cut_by_eventid=False,
         cut_nr_only=False,
+        entries_in_flight=None,
+        n_reader_threads=1,
+        vocabulary=None,
+        use_input_cache=False,
+        n_decompression_threads=1,
+        n_interpretation_threads=1,
+        use_eventid_index=False,
+        n_shards=1,
+        shard_index=0,
     ):
         self.directory = directory
         self.file_name = file_name
-        self.file_type = self.file_name.split(".")[-1]
         self.rng = random_number_generator
         self.separation_scale = separation_scale
         self.event_rate = event_rate / 1e9  # Conversion to ns
@@ -186,8 +382,37 @@ class file_loader:
         self.entry_stop = entry_stop
         self.cut_by_eventid = cut_by_eventid
         self.cut_nr_only = cut_nr_only
+        self.entries_in_flight = entries_in_flight
+        self.n_reader_threads = max(int(n_reader_threads), 1)
+        self.vocabulary = list(g4_vocabulary) if vocabulary is None else vocabulary
+        self.use_input_cache = use_input_cache
+        self.use_eventid_index = use_eventid_index
+        self.n_shards = int(n_shards)
+        self.shard_index = int(shard_index)
+
+        if (self.n_shards < 1) or not (0 <= self.shard_index < self.n_shards):
+            raise ValueError(
+                f"Invalid shard {self.shard_index} of {self.n_shards} shards! "
+                "shard_index must be between 0 and n_shards - 1."
+            )
+
+        if is_in_memory_input(self.file_name):
+            self.files = []
+            self.file = None
+            self.file_type = "memory"
+            if self.use_input_cache:
+                log.warning("The input cache is not used for in-memory input.")
+                self.use_input_cache = False
+        else:
+            self.files = self._find_input_files()
+            self.file = self.files[0]
 
-        self.file = os.path.join(self.directory, self.file_name)
+            file_types = {file.split(".")[-1] for file in self.files}
+            if len(file_types) > 1:
+                raise ValueError(f"All input files need to be of the same type! Got {file_types}.")
+            self.file_type = file_types.pop()
+            if (self.file_type != "root") and (len(self.files) > 1):
+                raise ValueError("Multiple input files are only supported for root files!")
 
         self.dtype = deposit_positions_fields + g4_fields
         self.columns = list(np.dtype(self.dtype).names)
@@ -195,147 +420,461 @@ class file_loader:
         self.columns.remove("eventid")
         self.dtype += primary_positions_fields + strax.time_fields
 
-        # Prepare cut for root and csv case
-        if self.outer_cylinder:
-            self.cut_string = (
-                f'(r < {self.outer_cylinder["max_r"]}) '
-                f'& ((zp >= {self.outer_cylinder["min_z"] * 10}) '
-                f'& (zp < {self.outer_cylinder["max_z"] * 10}))'
-            )
-        else:
-            self.cut_string = None
+        # Branches read from root files
+        self.root_branches = [c for c in self.columns if c not in ("x", "y", "z", "t")]
+        self.root_branches += ["xp", "yp", "zp", "time", "eventid", "xp_pri", "yp_pri", "zp_pri"]
+
+        # Thread pools used by uproot, they are started when the root files
+        # are read and shut down by _close_root_files
+        self.n_decompression_threads = int(n_decompression_threads)
+        self.n_interpretation_threads = int(n_interpretation_threads)
+        self.decompression_executor = None
+        self.interpretation_executor = None
+
+        # Root files opened by _get_ttree, they are closed after reading
+        self.root_files = dict()
 
     def output_chunk(self):
-        """Function to return one chunk of data from the root or csv file."""
+        """Function to return one chunk of data from the root or csv file.
+
+        The input is processed in batches of events. After each batch,
+        all interactions which are earlier than the first interaction of
+        the next event are final and handed to the chunk builder.
+        """
+
+        prepared_batches, start, stop = self._iterate_prepared_interactions()
+
+        if self.cut_nr_only:
+            log.info("'nr_only' set to True, keeping only the NR events")
+
+        # Need to check start and stop again....
+        if (self.event_rate > 0) and (stop is None):
+            # The number of events is not known in advance, the event times
+            # are drawn from a Poisson process while the events are read
+            event_times = np.zeros(0, dtype=np.int64)
+        elif self.event_rate > 0:
+            event_times = self.rng.uniform(
+                low=start / self.event_rate, high=stop / self.event_rate, size=stop - start
+            ).astype(np.int64)
+            event_times = np.sort(event_times)
+        elif self.event_rate == 0:
+            log.info("Using event times from provided input file.")
+            if self.file_type == "root":
+                msg = (
+                    "Using event times from root file is not recommended! "
+                    "Use a source_rate > 0 instead."
+                )
+                log.warning(msg)
+            if self.entries_in_flight is not None:
+                log.warning(
+                    "Interactions can only be chunked after the full file is read "
+                    "when using the event times from the input file."
+                )
+        else:
+            raise ValueError("Source rate cannot be negative!")
+
+        # The chunks of a shard end where the time window of the events of
+        # the next shard starts, so the chunks of all shards follow each other
+        time_window = None
+        if (self.n_shards > 1) and (self.event_rate > 0) and (stop is not None):
+            time_window = (
+                None if self.shard_index == 0 else np.floor(start / self.event_rate),
+                (
+                    None
+                    if self.shard_index == self.n_shards - 1
+                    else np.floor(stop / self.event_rate)
+                ),
+            )
+
+        chunk_builder = DynamicChunkBuilder(
+            separation_scale=self.separation_scale,
+            n_interactions_per_chunk=self.n_interactions_per_chunk,
+            first_chunk_left=self.first_chunk_left,
+            last_chunk_length=self.last_chunk_length,
+            chunk_delay_fraction=self.chunk_delay_fraction,
+            time_window=time_window,
+        )
+        self.chunk_bounds = chunk_builder.chunk_bounds
+
+        pending = np.zeros(0, dtype=self.dtype)
+        n_events_seen = 0
+        n_interactions = 0
+        n_delayed = 0
+        for inter_reshaped, n_per_event in prepared_batches:
+            if (self.event_rate > 0) and (stop is None):
+                # Draw one event time more to know the time of the next event
+                event_times = extend_poisson_event_times(
+                    event_times, n_events_seen + len(n_per_event) + 1, self.event_rate, self.rng
+                )
+            if self.event_rate > 0:
+                interaction_time = np.repeat(
+                    event_times[n_events_seen : n_events_seen + len(n_per_event)], n_per_event
+                )
+                inter_reshaped["time"] = interaction_time + inter_reshaped["t"]
+            else:
+                inter_reshaped["time"] = inter_reshaped["t"]
+            n_events_seen += len(n_per_event)
+
+            # Remove interactions that happen way after the run ended
+            delay_cut = inter_reshaped["t"] <= self.cut_delayed
+            n_interactions += len(delay_cut)
+            n_delayed += np.sum(~delay_cut)
+            inter_reshaped = inter_reshaped[delay_cut]
+
+            pending = np.concatenate([pending, inter_reshaped])
+            sort_idx = np.argsort(pending["time"])
+            pending = pending[sort_idx]
+
+            # All following interactions are later than the next event time
+            if (self.event_rate > 0) and (n_events_seen < len(event_times)):
+                n_final = np.searchsorted(pending["time"], event_times[n_events_seen])
+                for chunk in chunk_builder.add(pending[:n_final]):
+                    yield chunk + (False,)
+                pending = pending[n_final:]
+
+        log.info(
+            f"Removing {n_delayed} ({n_delayed / max(n_interactions, 1):.4%}) "
+            f"interactions later than {self.cut_delayed:.2e} ns."
+        )
+
+        for chunk in chunk_builder.add(pending):
+            yield chunk + (False,)
+        last_chunk = chunk_builder.finish()
+        log.info(f"Simulated data in {len(self.chunk_bounds) - 1} chunks.")
+        log.debug("Last chunk created!")
+        yield last_chunk + (True,)
+
+    def last_chunk_bounds(self):
+        return self.chunk_bounds[-1]
+
+    def _iterate_prepared_interactions(self):
+        """Function which reads the input in batches and prepares the
+        interactions with _prepare_interactions. If the input cache is used,
+        the prepared interactions are read from or written to the cache.
+
+        Returns:
+            batches: Iterable of (inter_reshaped, n_per_event)
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction
+        """
+        if self.use_input_cache:
+            cache_dir = self._input_cache_dir()
+            if os.path.exists(os.path.join(cache_dir, "metadata.json")):
+                log.info(f"Reading prepared interactions from cache {cache_dir}")
+                return self._read_input_cache(cache_dir)
 
         if self.file_type == "root":
-            interactions, n_simulated_events, start, stop = self._load_root_file()
+            batches, start, stop = self._iterate_root_file()
         elif self.file_type == "csv":
             interactions, n_simulated_events, start, stop = self._load_csv_file()
+            batches = [interactions]
+        elif self.file_type in columnar_file_formats:
+            batches, start, stop = self._iterate_columnar_file()
+        elif self.file_type == "memory":
+            batches, start, stop = self._iterate_in_memory_input()
         else:
             raise ValueError(
-                f'Cannot load events from file "{self.file}": .root or .cvs file needed.'
+                f'Cannot load events from file "{self.file}": .root, .csv, .parquet, .arrow '
+                "or .h5 file needed."
+            )
+
+        prepared_batches = (self._prepare_interactions(batch) for batch in batches)
+
+        if self.use_input_cache:
+            prepared_batches = self._write_input_cache(prepared_batches, cache_dir, start, stop)
+
+        return prepared_batches, start, stop
+
+    def _input_cache_dir(self):
+        """Function which returns the cache directory of the input files.
+
+        The directory name is a hash of the path, size and modification
+        time of the input files and all options changing the prepared
+        interactions. The files are not read to build it.
+        """
+        files = []
+        for file in self.files:
+            file_stat = os.stat(file)
+            files.append([os.path.abspath(file), file_stat.st_size, file_stat.st_mtime_ns])
+
+        cache_key = strax.deterministic_hash(
+            dict(
+                cache_version=INPUT_CACHE_VERSION,
+                files=files,
+                dtype=str(np.dtype(self.dtype)),
+                entry_start=self.entry_start,
+                entry_stop=self.entry_stop,
+                cut_by_eventid=self.cut_by_eventid,
+                cut_nr_only=self.cut_nr_only,
+                cut_delayed=self.cut_delayed,
+                outer_cylinder=self.outer_cylinder,
+                n_shards=self.n_shards,
+                shard_index=self.shard_index,
+                subtract_event_time=self.event_rate > 0,
+                vocabulary=list(self.vocabulary),
+            )
+        )
+        name = os.path.basename(self.files[0])
+        return os.path.join(os.path.dirname(self.files[0]), ".fuse_cache", f"{name}-{cache_key}")
+
+    def _write_input_cache(self, prepared_batches, cache_dir, start, stop):
+        """Function which passes the prepared batches through and writes them
+        to the cache. The cache is only kept if all batches were written."""
+        tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        complete = False
+        try:
+            n_events = 0
+            n_interactions = 0
+            with open(os.path.join(tmp_dir, "interactions.bin"), "wb") as f_inter, open(
+                os.path.join(tmp_dir, "n_per_event.bin"), "wb"
+            ) as f_events:
+                for inter_reshaped, n_per_event in prepared_batches:
+                    inter_reshaped.tofile(f_inter)
+                    n_per_event.astype(np.int64).tofile(f_events)
+                    n_events += len(n_per_event)
+                    n_interactions += len(inter_reshaped)
+                    yield inter_reshaped, n_per_event
+
+            metadata = dict(
+                start=int(start),
+                stop=int(stop),
+                n_events=n_events,
+                n_interactions=n_interactions,
+                vocabulary=list(self.vocabulary),
+            )
+            with open(os.path.join(tmp_dir, "metadata.json"), "w") as f:
+                json.dump(metadata, f)
+            complete = True
+
+            try:
+                os.replace(tmp_dir, cache_dir)
+                log.info(f"Wrote prepared interactions to cache {cache_dir}")
+            except OSError:
+                log.debug(f"Cache {cache_dir} was already written by another process.")
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            if not complete:
+                log.debug("Input was not read completely, discarding the cache.")
+
+    def _read_input_cache(self, cache_dir):
+        """Function which reads prepared interactions from the cache.
+
+        The cached arrays are memory-mapped and copied batch by batch.
+
+        Returns:
+            batches: Iterable of (inter_reshaped, n_per_event)
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction
+        """
+        with open(os.path.join(cache_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+
+        # Names are appended to the vocabulary of this run in the cached order
+        self.vocabulary[:] = metadata["vocabulary"]
+
+        def read_batches():
+            if metadata["n_events"] == 0:
+                return
+            interactions = np.memmap(
+                os.path.join(cache_dir, "interactions.bin"), dtype=self.dtype, mode="r"
             )
+            n_per_event = np.fromfile(os.path.join(cache_dir, "n_per_event.bin"), dtype=np.int64)
+            event_offsets = np.append(0, np.cumsum(n_per_event))
+
+            n_events_per_batch = len(n_per_event)
+            if self.entries_in_flight is not None:
+                n_events_per_batch = max(int(self.entries_in_flight) // 2, 1)
+
+            for i in range(0, len(n_per_event), n_events_per_batch):
+                j = min(i + n_events_per_batch, len(n_per_event))
+                yield (
+                    np.array(interactions[event_offsets[i] : event_offsets[j]]),
+                    n_per_event[i:j],
+                )
+
+        return read_batches(), metadata["start"], metadata["stop"]
+
+    def _find_input_files(self):
+        """Function which builds the list of input files from file_name.
+
+        file_name can be a single file name, a glob pattern or a list of
+        both. Files matching a glob pattern are sorted by name.
+        """
+        file_names = self.file_name
+        if isinstance(file_names, str):
+            file_names = [file_names]
+
+        files = []
+        for file_name in file_names:
+            file = file_name
+            if self.directory is not None:
+                file = os.path.join(self.directory, file_name)
+            if glob.has_magic(file):
+                matches = sorted(glob.glob(file))
+                if len(matches) == 0:
+                    raise ValueError(f'No input files found matching "{file}"!')
+                files.extend(matches)
+            else:
+                files.append(file)
+
+        if len(files) == 0:
+            raise ValueError("No input files given!")
+
+        return files
+
+    def _prepare_interactions(self, interactions):
+        """Function which applies the energy and NR cuts to a batch of events,
+        sorts the interactions of each event in time and converts them to a
+        flat numpy array.
+
+        Returns:
+            inter_reshaped: numpy array of the interactions
+            n_per_event: Number of interactions of each remaining event
+        """
+        if isinstance(interactions, np.ndarray):
+            return self._prepare_flat_interactions(interactions)
 
         # Removing all events with zero energy deposit
         m = interactions["ed"] > 0
         interactions = interactions[m]
 
+        interactions = self._encode_g4_strings(interactions)
+
         if self.cut_nr_only:
-            log.info("'nr_only' set to True, keeping only the NR events")
-            m = ((interactions["type"] == "neutron") & (interactions["edproc"] == "hadElastic")) | (
-                interactions["edproc"] == "ionIoni"
-            )
+            m = (
+                (interactions["type"] == g4_codes["neutron"])
+                & (interactions["edproc"] == g4_codes["hadElastic"])
+            ) | (interactions["edproc"] == g4_codes["ionIoni"])
             e_dep_er = ak.sum(interactions[~m]["ed"], axis=1)
             e_dep_nr = ak.sum(interactions[m]["ed"], axis=1)
             interactions = interactions[(e_dep_er < 10) & (e_dep_nr > 0)]
 
         # Removing all events with no interactions:
-        m = ak.num(interactions["ed"]) > 0
+        m = ak_num(interactions["ed"]) > 0
         interactions = interactions[m]
 
+        if len(interactions) == 0:
+            return np.zeros(0, dtype=self.dtype), np.zeros(0, dtype=np.int64)
+
         # Sort interactions in events by time and subtract time of the first interaction
         interactions = interactions[ak.argsort(interactions["t"])]
 
         if self.event_rate > 0:
             interactions["t"] = interactions["t"] - interactions["t"][:, 0]
 
-        inter_reshaped = full_array_to_numpy(interactions, self.dtype)
+        n_per_event = ak.to_numpy(ak_num(interactions["ed"]))
 
-        # Need to check start and stop again....
-        if self.event_rate > 0:
-            event_times = self.rng.uniform(
-                low=start / self.event_rate, high=stop / self.event_rate, size=stop - start
-            ).astype(np.int64)
-            event_times = np.sort(event_times)
+        return full_array_to_numpy(interactions, self.dtype), n_per_event
 
-            structure = np.unique(inter_reshaped["eventid"], return_counts=True)[1]
+    def _prepare_flat_interactions(self, interactions):
+        """Same as _prepare_interactions but for a flat numpy array of
+        interactions. Events are defined by the eventid.
 
-            # Check again why [:len(structure)] is needed
-            interaction_time = np.repeat(event_times[: len(structure)], structure)
-            inter_reshaped["time"] = interaction_time + inter_reshaped["t"]
-        elif self.event_rate == 0:
-            log.info("Using event times from provided input file.")
-            if self.file_type == "root":
-                msg = (
-                    "Using event times from root file is not recommended! "
-                    "Use a source_rate > 0 instead."
-                )
-                log.warning(msg)
-            inter_reshaped["time"] = inter_reshaped["t"]
-        else:
-            raise ValueError("Source rate cannot be negative!")
+        Returns:
+            inter_reshaped: numpy array of the interactions
+            n_per_event: Number of interactions of each remaining event
+        """
+        # Removing all interactions with zero energy deposit
+        interactions = interactions[interactions["ed"] > 0]
 
-        # Remove interactions that happen way after the run ended
-        delay_cut = inter_reshaped["t"] <= self.cut_delayed
-        log.info(
-            f"Removing {np.sum(~delay_cut)} ({np.sum(~delay_cut) / len(delay_cut):.4%}) "
-            f"interactions later than {self.cut_delayed:.2e} ns."
-        )
-        inter_reshaped = inter_reshaped[delay_cut]
+        # Sort interactions by event and in time within each event
+        sort_idx = np.lexsort((interactions["t"], interactions["eventid"]))
+        interactions = interactions[sort_idx]
 
-        sort_idx = np.argsort(inter_reshaped["time"])
-        inter_reshaped = inter_reshaped[sort_idx]
+        if self.cut_nr_only:
+            m = (
+                (interactions["type"] == g4_codes["neutron"])
+                & (interactions["edproc"] == g4_codes["hadElastic"])
+            ) | (interactions["edproc"] == g4_codes["ionIoni"])
+            _, event_index = np.unique(interactions["eventid"], return_inverse=True)
+            e_dep_er = np.bincount(event_index, weights=interactions["ed"] * ~m)
+            e_dep_nr = np.bincount(event_index, weights=interactions["ed"] * m)
+            keep_event = (e_dep_er < 10) & (e_dep_nr > 0)
+            interactions = interactions[keep_event[event_index]]
+
+        if len(interactions) == 0:
+            return interactions, np.zeros(0, dtype=np.int64)
+
+        eventid = interactions["eventid"]
+        event_starts = np.flatnonzero(np.diff(eventid, prepend=eventid[0] - 1) != 0)
+        n_per_event = np.diff(np.append(event_starts, len(interactions)))
 
-        # Group into chunks
-        chunk_idx = dynamic_chunking(
-            inter_reshaped["time"], scale=self.separation_scale, n_min=self.n_interactions_per_chunk
-        )
+        if self.event_rate > 0:
+            interactions["t"] -= np.repeat(interactions["t"][event_starts], n_per_event)
 
-        # Calculate chunk start and end times
-        chunk_start = np.array(
-            [inter_reshaped[chunk_idx == i][0]["time"] for i in np.unique(chunk_idx)]
-        )
-        chunk_end = np.array(
-            [inter_reshaped[chunk_idx == i][-1]["time"] for i in np.unique(chunk_idx)]
-        )
+        return interactions, n_per_event
+
+    def _encode_g4_strings(self, interactions):
+        """Function which replaces the Geant4 particle and process names by
+        their int16 codes in the vocabulary."""
+        for field in g4_string_fields:
+            codes = encode_g4_strings(awkward_to_flat_numpy(interactions[field]), self.vocabulary)
+            interactions[field] = ak.unflatten(codes, ak_num(interactions[field]))
+        return interactions
+
+    def _iterate_root_file(self):
+        """Function which prepares the reading of one or multiple root files in
+        batches of entries. The batches are read by a pool of threads ahead of
+        the consumer.
+
+        Returns:
+            batches: Iterable of awkward arrays
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction
+        """
+        if self.n_decompression_threads > 1:
+            self.decompression_executor = ThreadPoolExecutor(self.n_decompression_threads)
+        if self.n_interpretation_threads > 1:
+            self.interpretation_executor = ThreadPoolExecutor(self.n_interpretation_threads)
 
-        if (len(chunk_start) > 1) & (len(chunk_end) > 1):
-            gap_length = chunk_start[1:] - chunk_end[:-1]
-            gap_length = np.append(gap_length, gap_length[-1] + self.last_chunk_length)
-            chunk_bounds = chunk_end + np.int64(self.chunk_delay_fraction * gap_length)
-            self.chunk_bounds = np.append(chunk_start[0] - self.first_chunk_left, chunk_bounds)
+        try:
+            entry_ranges, start_index, stop_index = self._get_entry_ranges()
+        except Exception:
+            self._close_root_files()
+            raise
 
+        if self.entries_in_flight is None:
+            read_ranges = entry_ranges
         else:
-            log.warning(
-                "Only one Chunk created! Only a few events simulated? "
-                "If no, your chunking parameters might not be optimal. "
-                "Try to decrease the source_rate or decrease the n_interactions_per_chunk."
-            )
-            self.chunk_bounds = [
-                chunk_start[0] - self.first_chunk_left,
-                chunk_end[0] + self.last_chunk_length,
+            step_size = max(int(self.entries_in_flight) // (self.n_reader_threads + 1), 1)
+            log.debug(f"Reading {stop_index - start_index} entries in batches of {step_size}.")
+            read_ranges = [
+                (file, entry_start, min(entry_start + step_size, entry_stop))
+                for file, file_start, entry_stop in entry_ranges
+                for entry_start in range(file_start, entry_stop, step_size)
             ]
 
-        source_done = False
-        unique_chunk_index_values = np.unique(chunk_idx)
-        log.info(f"Simulating data in {len(unique_chunk_index_values)} chunks.")
-        for c_ix, chunk_left, chunk_right in zip(
-            unique_chunk_index_values, self.chunk_bounds[:-1], self.chunk_bounds[1:]
-        ):
-            if c_ix == unique_chunk_index_values[-1]:
-                source_done = True
-                log.debug("Last chunk created!")
+        def read_batch(read_range):
+            file, entry_start, entry_stop = read_range
+            ttree, _ = self._get_ttree(file)
+            return self._read_root_entries(ttree, entry_start, entry_stop)
+
+        def read_batches():
+            try:
+                yield from _prefetch(
+                    read_batch,
+                    read_ranges,
+                    n_prefetch=self.n_reader_threads,
+                    n_threads=self.n_reader_threads,
+                )
+            finally:
+                self._close_root_files()
 
-            yield inter_reshaped[chunk_idx == c_ix], chunk_left, chunk_right, source_done
+        return read_batches(), start_index, stop_index
 
-    def last_chunk_bounds(self):
-        return self.chunk_bounds[-1]
-
-    def _load_root_file(self):
-        """Function which reads a root file using uproot, performs a simple cut
-        and builds an awkward array.
+    def _get_entry_ranges(self):
+        """Function which translates entry_start and entry_stop into the ranges
+        of entries which are read from the input files. The entries of all
+        files are treated as one continuous set.
 
         Returns:
-            interactions: awkward array
-            n_simulated_events: Total number of simulated events
-            start: Index of the first loaded interaction
-            stop: Index of the last loaded interaction
+            entry_ranges: List of (file, start, stop) entry ranges per file
+            start_index: Index of the first selected entry in the file set
+            stop_index: Index after the last selected entry in the file set
         """
-        ttree, n_simulated_events = self._get_ttree()
-
         if self.arg_debug:
-            log.info(f"Total entries in input file = {ttree.num_entries}")
             cutby_string = "output file entry"
             if self.cut_by_eventid:
                 cutby_string = "g4 eventid"
@@ -352,34 +891,33 @@ class file_loader:
                     "Make sure that entry_stop is larger than entry_start"
                 )
 
-        # If we cut by eventid we have to read all of them first to find the start and stop index
-        if self.cut_by_eventid:
-            all_eventids = ttree.arrays("eventid")
+        with ThreadPoolExecutor(max_workers=self.n_reader_threads) as executor:
+            ttrees = list(executor.map(self._get_ttree, self.files))
 
-            if self.entry_start is not None:
-                if self.entry_start > np.max(all_eventids["eventid"]):
-                    raise ValueError(
-                        "The requested eventid range is not in the file! "
-                        "Maybe you want to set cut_by_eventid to False?"
-                    )
-                start_index = np.searchsorted(all_eventids["eventid"], self.entry_start)
-            else:
-                start_index = 0
+        entries = np.array([ttree.num_entries for ttree, _ in ttrees], dtype=np.int64)
+        file_offsets = np.append(0, np.cumsum(entries))
 
-            if self.entry_stop is not None:
-                if self.entry_stop <= np.min(all_eventids["eventid"]):
-                    raise ValueError(
-                        "The requested eventid range is not in the file! "
-                        "Maybe you want to set cut_by_eventid to False?"
-                    )
-                stop_index = np.searchsorted(all_eventids["eventid"], self.entry_stop)
-            else:
-                stop_index = n_simulated_events
+        if self.arg_debug:
+            log.info(f"Total entries in {len(self.files)} input file(s) = {file_offsets[-1]}")
+
+        # If we cut by eventid we have to read all of them first to find the start and stop index
+        if self.cut_by_eventid:
+            file_ranges = [
+                self._get_eventid_range(file, ttree) for file, (ttree, _) in zip(self.files, ttrees)
+            ]
+            if sum(stop - start for start, stop in file_ranges) <= 0:
+                raise ValueError(
+                    "The requested eventid range is not in the file! "
+                    "Maybe you want to set cut_by_eventid to False?"
+                )
+            # The selected entries are placed one after the other on the entry axis
+            first_file = np.argmax([stop > start for start, stop in file_ranges])
+            start_index = file_offsets[first_file] + file_ranges[first_file][0]
+            stop_index = start_index + sum(stop - start for start, stop in file_ranges)
 
         else:
-            entries = len(ttree.arrays("eventid"))
             if self.entry_start is not None:
-                if self.entry_start > entries:
+                if self.entry_start > file_offsets[-1]:
                     raise ValueError("The requested entry range is not in the file!")
                 start_index = max(0, self.entry_start)
             else:
@@ -388,9 +926,17 @@ class file_loader:
             if self.entry_stop is not None:
                 if self.entry_stop < 0:
                     raise ValueError("The requested entry range is not in the file!")
-                stop_index = min(self.entry_stop, entries)
+                stop_index = min(self.entry_stop, file_offsets[-1])
             else:
-                stop_index = entries
+                stop_index = file_offsets[-1]
+
+            file_ranges = [
+                (
+                    np.clip(start_index - offset, 0, n_entries),
+                    np.clip(stop_index - offset, 0, n_entries),
+                )
+                for offset, n_entries in zip(file_offsets[:-1], entries)
+            ]
 
         n_simulated_events = stop_index - start_index
         if n_simulated_events <= 0:
@@ -398,51 +944,225 @@ class file_loader:
                 "No events selected! Check entry_start, entry_stop and cut_by_eventid."
             )
 
-        # Conversions and parameters to be computed:
-        alias = {
-            "x": "xp/10",  # converting "geant4" mm to "straxen" cm
-            "y": "yp/10",
-            "z": "zp/10",
-            "r": "sqrt(x**2 + y**2)",
-            "t": "time*10**9",
-        }
+        entry_ranges = [
+            (file, int(start), int(stop))
+            for file, (start, stop) in zip(self.files, file_ranges)
+            if stop > start
+        ]
+
+        if self.n_shards > 1:
+            shard_start, shard_stop = self._get_shard_range(start_index, stop_index)
+            log.debug(f"Reading entries {shard_start} to {shard_stop} of shard {self.shard_index}")
+
+            # Clip the entry ranges to the shard, positions are counted on the selected entries
+            shard_ranges = []
+            position = start_index
+            for file, start, stop in entry_ranges:
+                first = max(start, start + shard_start - position)
+                last = min(stop, start + shard_stop - position)
+                if last > first:
+                    shard_ranges.append((file, first, last))
+                position += stop - start
+            entry_ranges, start_index, stop_index = shard_ranges, shard_start, shard_stop
+
+        return entry_ranges, int(start_index), int(stop_index)
+
+    def _get_shard_range(self, start_index, stop_index):
+        """Function which splits the selected events into n_shards contiguous
+        ranges and returns the range of shard_index.
 
-        # Read in data, convert mm to cm and perform a first cut if specified:
-        interactions = ttree.arrays(
-            self.columns,
-            self.cut_string,
-            aliases=alias,
-            entry_start=start_index,
-            entry_stop=stop_index,
+        Returns:
+            start_index: Index of the first event of the shard
+            stop_index: Index after the last event of the shard
+        """
+        n_events = stop_index - start_index
+        shard_start = start_index + n_events * self.shard_index // self.n_shards
+        shard_stop = start_index + n_events * (self.shard_index + 1) // self.n_shards
+        if shard_stop <= shard_start:
+            raise ValueError(
+                f"No events selected for shard {self.shard_index}! "
+                f"{n_events} events can not be split into {self.n_shards} shards."
+            )
+        return shard_start, shard_stop
+
+    def _get_eventid_range(self, file, ttree):
+        """Function which finds the range of entries of a ttree with a g4
+        eventid between entry_start and entry_stop.
+
+        Without entry_stop, all entries after entry_start are read. The
+        number of entries of the ttree is used, the number of simulated
+        events in the file header can differ from it.
+
+        Returns:
+            start_index: Index of the first entry to read
+            stop_index: Index after the last entry to read
+        """
+        if self.use_eventid_index:
+            all_eventids = self._get_eventid_index(file, ttree)
+        else:
+            all_eventids = ttree.arrays("eventid")["eventid"]
+
+        if self.entry_start is not None:
+            start_index = np.searchsorted(all_eventids, self.entry_start)
+        else:
+            start_index = 0
+
+        if self.entry_stop is not None:
+            stop_index = np.searchsorted(all_eventids, self.entry_stop)
+        else:
+            stop_index = len(all_eventids)
+
+        return start_index, max(start_index, stop_index)
+
+    def _get_eventid_index(self, file, ttree):
+        """Function which returns the eventids of all entries of a root file.
+
+        The eventids are stored in an index in the .fuse_cache directory
+        next to the file, so later range selections do not need to read
+        the eventid branch again. The index holds the size, modification
+        time and number of entries of the file and is rebuilt if one of
+        them changed or the index can not be read.
+        """
+        file_stat = os.stat(file)
+        file_key = np.array(
+            [file_stat.st_size, file_stat.st_mtime_ns, ttree.num_entries], dtype=np.int64
         )
-        eventids = ttree.arrays("eventid", entry_start=start_index, entry_stop=stop_index)
-        eventids = ak.broadcast_arrays(eventids["eventid"], interactions["x"])[0]
-        interactions["eventid"] = eventids
+        index_file = os.path.join(
+            os.path.dirname(file), ".fuse_cache", f"{os.path.basename(file)}.eventid_index.npz"
+        )
+
+        if os.path.exists(index_file):
+            try:
+                with np.load(index_file) as index:
+                    if np.array_equal(index["file_key"], file_key):
+                        log.debug(f"Using eventid index {index_file}")
+                        return index["eventids"]
+                log.info(f"{file} was modified, rebuilding the eventid index.")
+            except (OSError, ValueError, KeyError) as e:
+                log.warning(f"Could not read eventid index {index_file}, rebuilding it: {e}")
+
+        eventids = ak.to_numpy(ttree.arrays("eventid")["eventid"]).astype(np.int64)
+        if np.any(np.diff(eventids) < 0):
+            raise ValueError(
+                f"The eventids in {file} are not sorted! "
+                "Selecting entries by eventid requires sorted eventids."
+            )
 
-        xyz_pri = ttree.arrays(
-            ["x_pri", "y_pri", "z_pri"],
-            aliases={"x_pri": "xp_pri/10", "y_pri": "yp_pri/10", "z_pri": "zp_pri/10"},
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            tmp_file = f"{index_file}.tmp-{os.getpid()}.npz"
+            np.savez(tmp_file, file_key=file_key, eventids=eventids)
+            os.replace(tmp_file, index_file)
+            log.info(f"Wrote eventid index {index_file}")
+        except OSError as e:
+            log.warning(f"Could not write eventid index {index_file}: {e}")
+
+        return eventids
+
+    def _read_root_entries(self, ttree, start_index, stop_index):
+        """Function which reads a range of entries from the ttree, converts mm
+        to cm and performs a first cut if specified.
+
+        All branches are read in one pass. The baskets are decompressed
+        and interpreted by the decompression and interpretation thread
+        pools.
+
+        Returns:
+            interactions: awkward array
+        """
+        branches = ttree.arrays(
+            self.root_branches,
             entry_start=start_index,
             entry_stop=stop_index,
+            decompression_executor=self.decompression_executor,
+            interpretation_executor=self.interpretation_executor,
+            how=dict,
         )
 
-        interactions["x_pri"] = ak.broadcast_arrays(xyz_pri["x_pri"], interactions["x"])[0]
-        interactions["y_pri"] = ak.broadcast_arrays(xyz_pri["y_pri"], interactions["x"])[0]
-        interactions["z_pri"] = ak.broadcast_arrays(xyz_pri["z_pri"], interactions["x"])[0]
+        # Perform a first cut if specified and skip events without remaining deposits
+        if self.outer_cylinder:
+            n_per_entry = ak.to_numpy(ak_num(branches["xp"]))
+            mask = self._outer_cylinder_mask(
+                awkward_to_flat_numpy(branches["xp"]),
+                awkward_to_flat_numpy(branches["yp"]),
+                awkward_to_flat_numpy(branches["zp"]),
+            )
+            n_kept = np.bincount(
+                np.repeat(np.arange(len(n_per_entry)), n_per_entry),
+                weights=mask,
+                minlength=len(n_per_entry),
+            )
+            keep_entry = n_kept > 0
+            jagged_mask = ak.unflatten(mask, n_per_entry)[keep_entry]
+            for name, branch in branches.items():
+                branch = branch[keep_entry]
+                if branch.ndim > 1:
+                    branch = branch[jagged_mask]
+                branches[name] = branch
+
+        # Conversions: "geant4" mm to "straxen" cm and s to ns
+        columns = {
+            "x": branches["xp"] / 10,
+            "y": branches["yp"] / 10,
+            "z": branches["zp"] / 10,
+            "t": branches["time"] * 10**9,
+        }
+        for column in self.columns:
+            if column not in columns:
+                columns[column] = branches[column]
+        interactions = ak.zip(columns)
+
+        interactions["eventid"] = ak.broadcast_arrays(branches["eventid"], interactions["x"])[0]
+        for column in ["x_pri", "y_pri", "z_pri"]:
+            interactions[column] = ak.broadcast_arrays(
+                branches[column.replace("_", "p_")] / 10, interactions["x"]
+            )[0]
 
-        return interactions, n_simulated_events, start_index, stop_index
+        return interactions
 
-    def _get_ttree(self):
+    def _get_ttree(self, file):
         """Function which searches for the correct ttree in MC root file.
 
+        Each file is opened only once per loader, the ttree is reused for
+        all batches until _close_root_files is called.
+
         Args:
-            directory: Directory where file is
-            file_name: Name of the file
+            file: Path to the root file
         Returns:
             root ttree and number of simulated events
         """
-        root_dir = uproot.open(self.file)
+        if file not in self.root_files:
+            root_dir = uproot.open(file)
+            try:
+                ttree, n_simulated_events = self._find_ttree(file, root_dir)
+            except Exception:
+                root_dir.close()
+                raise
+            self.root_files[file] = (root_dir, ttree, n_simulated_events)
+        _, ttree, n_simulated_events = self.root_files[file]
+        return ttree, n_simulated_events
+
+    def _close_root_files(self):
+        """Function which closes all root files opened by _get_ttree and
+        shuts down the thread pools of uproot."""
+        for root_dir, _, _ in self.root_files.values():
+            root_dir.close()
+        self.root_files.clear()
+
+        for executor in (self.decompression_executor, self.interpretation_executor):
+            if executor is not None:
+                executor.shutdown()
+        self.decompression_executor = None
+        self.interpretation_executor = None
+
+    @staticmethod
+    def _find_ttree(file, root_dir):
+        """Function which searches for the ttree according to the old and new
+        MC file structure.
 
+        Returns:
+            root ttree and number of simulated events
+        """
         # Searching for TTree according to old/new MC file structure:
         if root_dir.classname_of("events") == "TTree":
             ttree = root_dir["events"]
@@ -456,7 +1176,7 @@ class file_loader:
                 if v == "TTree":
                     ttrees.append(k)
             raise ValueError(
-                f'Cannot find ttree object of "{self.file}".'
+                f'Cannot find ttree object of "{file}".'
                 "I tried to search in events and events/events."
                 f"Found a ttree in {ttrees}?"
             )
@@ -464,10 +1184,10 @@ class file_loader:
 
     def _load_csv_file(self):
         """Function which reads a csv file using pandas, performs a simple cut
-        and builds an awkward array.
+        and builds a flat numpy array of the interactions.
 
         Returns:
-            interactions: awkward array
+            interactions: numpy array
             n_simulated_events: Total number of simulated events
             start: Index of the first loaded interaction
             stop: Index of the last loaded interaction
@@ -475,68 +1195,220 @@ class file_loader:
 
         log.debug("Load instructions from a csv file!")
 
-        df = pd.read_csv(self.file)
-
-        # unit conversion similar to root case
-        df["x"] = df["xp"] / 10
-        df["y"] = df["yp"] / 10
-        df["z"] = df["zp"] / 10
-        df["x_pri"] = df["xp_pri"] / 10
-        df["y_pri"] = df["yp_pri"] / 10
-        df["z_pri"] = df["zp_pri"] / 10
-        df["r"] = np.sqrt(df["x"] ** 2 + df["y"] ** 2)
-        df["t"] = df["time"]
-
-        missing_columns = set(self.columns) - set(df.columns)
-
         # Check if all needed columns are in place:
+        header = pd.read_csv(self.file, nrows=0).columns
+        missing_columns = set(g4_file_columns) - set(header)
         if missing_columns:
             raise ValueError(f"Not all needed columns provided! {missing_columns} are missing.")
 
-        n_simulated_events = len(np.unique(df.eventid))
+        # Numeric columns are parsed with the dtypes inferred by pandas and
+        # cast when they are assigned to the interactions
+        df = pd.read_csv(
+            self.file,
+            usecols=list(g4_file_columns),
+            dtype={column: str for column in g4_string_fields},
+        )
+        columns = {column: df[column].values for column in g4_file_columns}
+
+        return self._select_flat_interactions(
+            self._convert_g4_columns(columns), columns["xp"], columns["yp"], columns["zp"]
+        )
 
-        if self.outer_cylinder:
-            df = df.query(self.cut_string)
+    def _iterate_columnar_file(self):
+        """Function which reads a Parquet, Arrow IPC or HDF5 file with the
+        columns of the csv input. Only these columns are decoded.
 
-        df = df[self.columns + ["eventid", "x_pri", "y_pri", "z_pri"]]
+        The rows need to be sorted by eventid. The events are counted in a
+        first pass over the eventid column. Afterwards the file is read in
+        batches which are regrouped into complete events. Only one batch
+        is held in memory in both passes.
 
-        interactions = self._awkwardify_df(df)
+        Returns:
+            batches: Iterable of numpy arrays
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction
+        """
+        log.debug("Load instructions from a columnar file!")
 
-        # Use always all events in the csv file
         start = 0
-        stop = n_simulated_events
+        stop = count_sorted_events(
+            columns["eventid"] for columns in iterate_columnar_file(self.file, ["eventid"])
+        )
+        if self.n_shards > 1:
+            start, stop = self._get_shard_range(start, stop)
+
+        def read_batches():
+            n_events = 0
+            last_eventid = None
+            for columns in iterate_columnar_file(self.file, g4_file_columns):
+                interactions = self._convert_g4_columns(columns)
+                if len(interactions) == 0:
+                    continue
+
+                # Index of the event of each interaction, counted over the whole file
+                eventid = interactions["eventid"]
+                new_event = np.ones(len(eventid), dtype=bool)
+                new_event[1:] = eventid[1:] != eventid[:-1]
+                new_event[0] = (last_eventid is None) or (eventid[0] != last_eventid)
+                event_index = n_events + np.cumsum(new_event) - 1
+                n_events = event_index[-1] + 1
+                last_eventid = eventid[-1]
+
+                mask = (event_index >= start) & (event_index < stop)
+                if self.outer_cylinder:
+                    mask &= self._outer_cylinder_mask(columns["xp"], columns["yp"], columns["zp"])
+                yield interactions[mask]
+
+                if n_events > stop:
+                    break
+
+        return iterate_complete_events(read_batches()), start, stop
+
+    def _convert_g4_columns(self, columns):
+        """Function which converts the columns of a csv or columnar file into
+        a flat numpy array of the interactions.
 
-        return interactions, n_simulated_events, start, stop
+        Returns:
+            interactions: numpy array
+        """
+        interactions = np.zeros(len(columns["eventid"]), dtype=self.dtype)
+        # unit conversion similar to root case
+        positions = {
+            "x": "xp",
+            "y": "yp",
+            "z": "zp",
+            "x_pri": "xp_pri",
+            "y_pri": "yp_pri",
+            "z_pri": "zp_pri",
+        }
+        for column, file_column in positions.items():
+            interactions[column] = columns[file_column] / 10
+        interactions["t"] = columns["time"]
+        for column in ["ed", "trackid", "parentid", "eventid"]:
+            interactions[column] = columns[column]
+        for column in g4_string_fields:
+            interactions[column] = encode_g4_strings(
+                np.asarray(columns[column]).astype(str), self.vocabulary
+            )
+        return interactions
 
-    @staticmethod
-    def _awkwardify_df(df):
-        """Function which builds an jagged awkward array from pandas dataframe.
+    def _iterate_in_memory_input(self):
+        """Function which converts the batches of an in-memory input into
+        flat numpy arrays of the interactions.
 
-        Args:
-            df: Pandas Dataframe
+        Arrays and lists of arrays are selected like a csv file. Batches
+        of a callable or iterator are converted one after the other.
+        Their number of events is not known in advance.
 
         Returns:
-            ak.Array(dictionary): awkward array
+            batches: Iterable of numpy arrays
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction or None
         """
+        log.debug("Load interactions from memory!")
 
-        _, evt_offsets = np.unique(df["eventid"], return_counts=True)
-
-        dictionary = {
-            "x": reshape_awkward(df["x"].values, evt_offsets),
-            "y": reshape_awkward(df["y"].values, evt_offsets),
-            "z": reshape_awkward(df["z"].values, evt_offsets),
-            "x_pri": reshape_awkward(df["x_pri"].values, evt_offsets),
-            "y_pri": reshape_awkward(df["y_pri"].values, evt_offsets),
-            "z_pri": reshape_awkward(df["z_pri"].values, evt_offsets),
-            "t": reshape_awkward(df["t"].values, evt_offsets),
-            "ed": reshape_awkward(df["ed"].values, evt_offsets),
-            "type": reshape_awkward(np.array(df["type"], dtype=str), evt_offsets),
-            "trackid": reshape_awkward(df["trackid"].values, evt_offsets),
-            "parenttype": reshape_awkward(np.array(df["parenttype"], dtype=str), evt_offsets),
-            "parentid": reshape_awkward(df["parentid"].values, evt_offsets),
-            "creaproc": reshape_awkward(np.array(df["creaproc"], dtype=str), evt_offsets),
-            "edproc": reshape_awkward(np.array(df["edproc"], dtype=str), evt_offsets),
-            "eventid": reshape_awkward(df["eventid"].values, evt_offsets),
-        }
+        batches = (
+            self._convert_in_memory_batch(batch)
+            for batch in iterate_in_memory_input(self.file_name)
+        )
+
+        if isinstance(self.file_name, (np.ndarray, list, tuple)):
+            interactions = np.concatenate(list(batches))
+            interactions, _, start, stop = self._select_flat_interactions(
+                interactions, interactions["x"] * 10, interactions["y"] * 10, interactions["z"] * 10
+            )
+            return [interactions], start, stop
+
+        if self.n_shards > 1:
+            raise ValueError("Sharding is not supported for in-memory input from a generator!")
+
+        if self.outer_cylinder:
+            batches = (
+                batch[self._outer_cylinder_mask(batch["x"] * 10, batch["y"] * 10, batch["z"] * 10)]
+                for batch in batches
+            )
+
+        return batches, 0, None
+
+    def _convert_in_memory_batch(self, batch):
+        """Function which copies a batch of in-memory input into the dtype of
+        the interactions. Particle and process names are encoded."""
+        needed_fields = set(np.dtype(self.dtype).names) - {"time", "endtime"}
+        missing_fields = needed_fields - set(batch.dtype.names)
+        if missing_fields:
+            raise ValueError(f"Not all needed fields provided! {missing_fields} are missing.")
 
-        return ak.Array(dictionary)
+        interactions = np.zeros(len(batch), dtype=self.dtype)
+        for field in needed_fields:
+            if (field in g4_string_fields) and (batch[field].dtype.kind in "OSU"):
+                interactions[field] = encode_g4_strings(batch[field].astype(str), self.vocabulary)
+            else:
+                interactions[field] = batch[field]
+        return interactions
+
+    def _select_flat_interactions(self, interactions, xp, yp, zp):
+        """Function which applies the outer cylinder cut and the shard
+        selection to a flat array of all interactions. The positions are
+        given in the Geant4 unit mm.
+
+        Returns:
+            interactions: numpy array
+            n_simulated_events: Total number of simulated events
+            start: Index of the first loaded interaction
+            stop: Index of the last loaded interaction
+        """
+        eventids = np.unique(interactions["eventid"])
+        n_simulated_events = len(eventids)
+
+        if self.outer_cylinder:
+            mask = self._outer_cylinder_mask(xp, yp, zp)
+            interactions = interactions[mask]
+
+        # Use always all events in the input
+        start = 0
+        stop = n_simulated_events
+
+        if self.n_shards > 1:
+            start, stop = self._get_shard_range(start, stop)
+            interactions = interactions[np.isin(interactions["eventid"], eventids[start:stop])]
+
+        return interactions, n_simulated_events, start, stop
+
+    def _outer_cylinder_mask(self, xp, yp, zp):
+        """Function which returns a mask of the deposits inside the outer
+        cylinder. The positions are given in the Geant4 unit mm."""
+        r = np.sqrt((xp / 10) ** 2 + (yp / 10) ** 2)
+        mask = r < self.outer_cylinder["max_r"]
+        mask &= zp >= self.outer_cylinder["min_z"] * 10
+        mask &= zp < self.outer_cylinder["max_z"] * 10
+        return mask
+
+
+def _prefetch(function, arguments, n_prefetch=1, n_threads=1):
+    """Function which evaluates function for all arguments in a pool of
+    background threads. At most n_prefetch results are computed ahead of the
+    consumer.
+
+    Args:
+        function: Function to evaluate
+        arguments: Iterable of arguments
+        n_prefetch: Number of results to compute in advance
+        n_threads: Number of threads
+
+    Yields:
+        Results of function(argument) in the order of the arguments
+    """
+    executor = ThreadPoolExecutor(max_workers=n_threads)
+    arguments = iter(arguments)
+    futures = deque()
+    try:
+        for argument in arguments:
+            futures.append(executor.submit(function, argument))
+            if len(futures) > n_prefetch:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
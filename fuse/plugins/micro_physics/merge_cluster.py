@@ -1,6 +1,7 @@
 import strax
 import straxen
 import numpy as np
+import numba
 import logging
 
 from ...dtypes import (
@@ -9,6 +10,13 @@ from ...dtypes import (
     cluster_id_fields,
     cluster_misc_fields,
 )
+from ...common import (
+    g4_string_fields,
+    default_classification_rules,
+    classification_rule_conditions,
+    classification_vocabulary,
+    g4_run_vocabulary,
+)
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -17,8 +25,56 @@ logging.basicConfig(handlers=[logging.StreamHandler()])
 log = logging.getLogger("fuse.micro_physics.merge_cluster")
 
 
+class MergeClusterMixin:
+    """Config options and methods of the cluster merging, shared by
+    MergeCluster and FusedMicroPhysics."""
+
+    # Config options
+    tag_cluster_by = straxen.URLConfig(
+        default="take://resource://SIMULATION_CONFIG_FILE.json?fmt=json&take=tag_cluster_by",
+        cache=True,
+        help="Decide if you tag the cluster "
+        "according to first interaction (time) or most energetic (energy) one",
+    )
+
+    classification_rules = straxen.URLConfig(
+        default=default_classification_rules,
+        help="Rules to classify the clusters. List of rules with conditions on "
+        "type, parenttype, creaproc and edproc (prefixed with not_ to negate) and the "
+        "resulting A, Z and nestid. The first matching rule is used. Names need to be in "
+        "fuse.common.g4_vocabulary or extra_g4_names. Can be loaded from the simulation "
+        "config with "
+        "take://resource://SIMULATION_CONFIG_FILE.json?fmt=json&take=classification_rules",
+    )
+
+    extra_g4_names = straxen.URLConfig(
+        default=[],
+        help="Geant4 names which get their codes before the input is read, in addition to "
+        "fuse.common.g4_vocabulary. Shared with ChunkInput",
+    )
+
+    def setup(self):
+        super().setup()
+
+        self.classification_table = compile_run_classification_rules(
+            self.classification_rules, self.extra_g4_names
+        )
+
+    def merge_clusters(self, interactions, dtype):
+        """Function which merges the interactions with the same cluster
+        index into one classified interaction each."""
+        result = np.zeros(len(np.unique(interactions["cluster_ids"])), dtype=dtype)
+        result = cluster_and_classify(
+            result, interactions, self.tag_cluster_by, self.classification_table
+        )
+
+        result["endtime"] = result["time"]
+
+        return result
+
+
 @export
-class MergeCluster(FuseBasePlugin):
+class MergeCluster(MergeClusterMixin, FuseBasePlugin):
     """Plugin that merges energy deposits with the same cluster index into a
     single interaction.
 
@@ -28,10 +84,11 @@ class MergeCluster(FuseBasePlugin):
     energy deposits. The energy of the merged cluster is the sum of the
     individual energy depositions. The cluster is then classified based
     on either the first interaction in the cluster or the most energetic
-    interaction.
+    interaction. The classification follows the rules of the
+    classification_rules table.
     """
 
-    __version__ = "0.3.2"
+    __version__ = "0.5.0"
     depends_on = ("geant4_interactions", "cluster_index")
     provides = "clustered_interactions"
     data_kind = "clustered_interactions"
@@ -46,87 +103,187 @@ class MergeCluster(FuseBasePlugin):
         + strax.time_fields
     )
 
-    # Config options
-    tag_cluster_by = straxen.URLConfig(
-        default="take://resource://SIMULATION_CONFIG_FILE.json?fmt=json&take=tag_cluster_by",
-        cache=True,
-        help="Decide if you tag the cluster "
-        "according to first interaction (time) or most energetic (energy) one",
-    )
-
     def compute(self, geant4_interactions):
         if len(geant4_interactions) == 0:
             return np.zeros(0, dtype=self.dtype)
 
-        result = np.zeros(len(np.unique(geant4_interactions["cluster_ids"])), dtype=self.dtype)
-        result = cluster_and_classify(result, geant4_interactions, self.tag_cluster_by)
+        return self.merge_clusters(geant4_interactions, self.dtype)
 
-        result["endtime"] = result["time"]
 
-        return result
+def cluster_and_classify(result, interactions, tag_cluster_by, classification_table=None):
+    """Merge the energy deposits of each cluster into a single interaction.
+
+    The interactions are sorted once by cluster id, the clusters are
+    then reduced segment by segment in a compiled kernel. The result
+    is ordered by cluster id. Without a classification_table the
+    default classification rules are used.
+    """
+    if classification_table is None:
+        classification_table = compile_classification_rules(default_classification_rules)
 
+    if tag_cluster_by == "energy":
+        tag_by_energy = True
+    elif tag_cluster_by == "time":
+        tag_by_energy = False
+    else:
+        raise ValueError("tag_cluster_by must be 'energy' or 'time'")
 
-# @numba.njit()
-def cluster_and_classify(result, interactions, tag_cluster_by):
-    interaction_cluster = [
-        interactions[interactions["cluster_ids"] == i]
-        for i in np.unique(interactions["cluster_ids"])
-    ]
-
-    for i, cluster in enumerate(interaction_cluster):
-        result[i]["x"] = np.average(cluster["x"], weights=cluster["ed"])
-        result[i]["y"] = np.average(cluster["y"], weights=cluster["ed"])
-        result[i]["z"] = np.average(cluster["z"], weights=cluster["ed"])
-        result[i]["time"] = np.average(cluster["time"], weights=cluster["ed"])
-        result[i]["ed"] = np.sum(cluster["ed"])
-
-        if tag_cluster_by == "energy":
-            main_interaction_index = np.argmax(cluster["ed"])
-        elif tag_cluster_by == "time":
-            main_interaction_index = np.argmin(cluster["time"])
-        else:
-            raise ValueError("tag_cluster_by must be 'energy' or 'time'")
-
-        A, Z, nestid = classify(
-            cluster["type"][main_interaction_index],
-            cluster["parenttype"][main_interaction_index],
-            cluster["creaproc"][main_interaction_index],
-            cluster["edproc"][main_interaction_index],
-        )
-        result[i]["A"] = A
-        result[i]["Z"] = Z
-        result[i]["nestid"] = nestid
+    order = np.argsort(interactions["cluster_ids"], kind="stable")
+    interactions = interactions[order]
 
-        result[i]["x_pri"] = cluster["x_pri"][main_interaction_index]
-        result[i]["y_pri"] = cluster["y_pri"][main_interaction_index]
-        result[i]["z_pri"] = cluster["z_pri"][main_interaction_index]
-        result[i]["eventid"] = cluster["eventid"][main_interaction_index]
+    new_cluster = np.diff(interactions["cluster_ids"]) != 0
+    segment_starts = np.concatenate(([0], np.flatnonzero(new_cluster) + 1))
+
+    main_interaction_index = _merge_segments(
+        result,
+        interactions["x"],
+        interactions["y"],
+        interactions["z"],
+        interactions["time"],
+        interactions["ed"],
+        segment_starts,
+        tag_by_energy,
+    )
+    main_interactions = interactions[main_interaction_index]
 
-        # Get cluster id from and save it!
-        result[i]["cluster_id"] = cluster["cluster_ids"][main_interaction_index]
+    classification = classify(main_interactions, *classification_table)
+    result["A"] = classification["A"]
+    result["Z"] = classification["Z"]
+    result["nestid"] = classification["nestid"]
+
+    result["x_pri"] = main_interactions["x_pri"]
+    result["y_pri"] = main_interactions["y_pri"]
+    result["z_pri"] = main_interactions["z_pri"]
+    result["eventid"] = main_interactions["eventid"]
+    result["cluster_id"] = main_interactions["cluster_ids"]
 
     return result
 
 
-infinity = np.iinfo(np.int8).max
+@numba.njit
+def _merge_segments(result, x, y, z, time, ed, segment_starts, tag_by_energy):
+    """Energy weighted mean position and time, summed energy and index
+    of the main interaction of each segment of interactions."""
+    n_segments = len(segment_starts)
+    main_interaction_index = np.zeros(n_segments, dtype=np.int64)
 
+    for i in range(n_segments):
+        start = segment_starts[i]
+        stop = segment_starts[i + 1] if i + 1 < n_segments else len(ed)
 
-def classify(types, parenttype, creaproc, edproc):
-    "Function to classify a cluster according to its main interaction"
+        sum_ed = 0.0
+        sum_x = 0.0
+        sum_y = 0.0
+        sum_z = 0.0
+        sum_time = 0.0
+        main = start
+        for j in range(start, stop):
+            sum_ed += ed[j]
+            sum_x += ed[j] * x[j]
+            sum_y += ed[j] * y[j]
+            sum_z += ed[j] * z[j]
+            sum_time += ed[j] * time[j]
+            if tag_by_energy:
+                if ed[j] > ed[main]:
+                    main = j
+            elif time[j] < time[main]:
+                main = j
 
-    if (edproc == "ionIoni") & (types != "alpha"):
-        return 0, 0, 0
-    elif (types == "neutron") & (edproc == "hadElastic"):
-        return 0, 0, 0
-    elif types == "alpha":
-        return 4, 2, 6
-    elif parenttype == "Kr83[9.405]":
-        return infinity, 0, 11
-    elif parenttype == "Kr83[41.557]":
-        return infinity, 0, 11
-    elif types == "gamma":
-        return 0, 0, 7
-    elif types == "e-":
-        return 0, 0, 8
-    else:
-        return infinity, infinity, 12
+        result[i]["x"] = sum_x / sum_ed
+        result[i]["y"] = sum_y / sum_ed
+        result[i]["z"] = sum_z / sum_ed
+        result[i]["time"] = sum_time / sum_ed
+        result[i]["ed"] = sum_ed
+        main_interaction_index[i] = main
+
+    return main_interaction_index
+
+
+classification_dtype = [("A", np.int8), ("Z", np.int8), ("nestid", np.int8)]
+
+
+def compile_run_classification_rules(rules, extra_g4_names=()):
+    """Function to compile the classification rules for the vocabulary a run
+    starts with, see fuse.common.g4_run_vocabulary.
+
+    The names used in the rules need to be part of this vocabulary, the
+    codes of other names depend on the order in which they are read.
+
+    Returns:
+        conditions, outcomes: see compile_classification_rules
+    """
+    vocabulary = g4_run_vocabulary(extra_g4_names)
+    missing_names = classification_vocabulary(rules, vocabulary)[len(vocabulary) :]
+    if missing_names:
+        raise ValueError(
+            f"The names {missing_names} of the classification rules are not in the Geant4 "
+            "vocabulary! Add them to extra_g4_names."
+        )
+    return compile_classification_rules(rules, vocabulary)
+
+
+def compile_classification_rules(rules, vocabulary=None):
+    """Function to compile the classification rules into lookup tables.
+
+    Args:
+        rules: list of classification rules, see default_classification_rules
+        vocabulary: list of Geant4 names the codes refer to. Defaults to the
+            vocabulary of a run with these rules.
+
+    Returns:
+        conditions: boolean array of shape (rules, fields, codes + 1) telling
+            if a code of a field matches a rule. The last code stands for
+            all names not in the vocabulary.
+        outcomes: A, Z and nestid of each rule
+    """
+    if vocabulary is None:
+        vocabulary = classification_vocabulary(rules)
+    codes = {name: code for code, name in enumerate(vocabulary)}
+
+    conditions = np.ones((len(rules), len(g4_string_fields), len(vocabulary) + 1), dtype=bool)
+    outcomes = np.zeros(len(rules), dtype=classification_dtype)
+
+    for i, rule in enumerate(rules):
+        for field, names, negate in classification_rule_conditions(rule):
+            match = np.zeros(len(vocabulary) + 1, dtype=bool)
+            match[[codes[name] for name in names if name in codes]] = True
+            conditions[i, g4_string_fields.index(field)] = ~match if negate else match
+        for field in ("A", "Z", "nestid"):
+            outcomes[i][field] = rule[field]
+
+    return conditions, outcomes
+
+
+def classify(interactions, conditions, outcomes):
+    """Function to classify clusters according to their main interaction.
+
+    Each distinct combination of particle types and processes is
+    matched against the compiled rules once, the result is gathered
+    back to all interactions.
+
+    Args:
+        interactions: main interactions with the Geant4 codes of
+            type, parenttype, creaproc and edproc
+        conditions, outcomes: tables of compile_classification_rules
+
+    Returns:
+        numpy.array: A, Z and nestid of each interaction
+    """
+    if len(interactions) == 0:
+        return np.zeros(0, dtype=classification_dtype)
+
+    codes = np.stack([interactions[field] for field in g4_string_fields], axis=1)
+    codes = np.minimum(codes.astype(np.int64), conditions.shape[2] - 1)
+    combinations, inverse = np.unique(codes, axis=0, return_inverse=True)
+
+    field_index = np.arange(len(g4_string_fields))
+    matches = np.all(conditions[:, field_index, combinations], axis=2)
+
+    unmatched = ~np.any(matches, axis=0)
+    if np.any(unmatched):
+        raise ValueError(
+            f"No classification rule matches the Geant4 codes {combinations[unmatched][0]} "
+            f"of {g4_string_fields}!"
+        )
+
+    return outcomes[np.argmax(matches, axis=0)][inverse.reshape(-1)]
@@ -5,6 +5,7 @@ import logging
 
 from ...dtypes import propagated_photons_fields
 from ...common import pmt_gains
+from ...map_store import SharedURLConfig
 from ...plugin import FuseBasePlugin
 
 export, __all__ = strax.exporter()
@@ -85,7 +86,7 @@ class PMTAfterPulses(FuseBasePlugin):
         help="Voltage range of the digitizer boards [V]",
     )
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
@@ -8,6 +8,7 @@ import strax
 import straxen
 
 from ...plugin import FuseBaseDownChunkingPlugin
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -81,7 +82,7 @@ class PMTResponseAndDAQ(FuseBaseDownChunkingPlugin):
         help="Voltage range of the digitizer boards [V]",
     )
 
-    noise_data = straxen.URLConfig(
+    noise_data = SharedURLConfig(
         default="simple_load://resource://simulation_config://"
         "SIMULATION_CONFIG_FILE.json?"
         "&key=noise_file"
@@ -3,6 +3,7 @@ import strax
 import straxen
 
 from ...common import pmt_gains
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -68,7 +69,7 @@ class PeakTruth(strax.OverlapWindowPlugin):
         ("average_z_obs_of_contributing_clusters", np.float32),
     ] + strax.time_fields
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
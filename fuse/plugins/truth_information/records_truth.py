@@ -4,6 +4,7 @@ import numpy as np
 import numba
 
 from ...common import pmt_gains
+from ...map_store import SharedURLConfig
 
 export, __all__ = strax.exporter()
 
@@ -27,7 +28,7 @@ class RecordsTruth(strax.Plugin):
 
     dtype = strax.interval_dtype + dtype
 
-    gain_model_mc = straxen.URLConfig(
+    gain_model_mc = SharedURLConfig(
         default="cmt://to_pe_model?version=ONLINE&run_id=plugin.run_id",
         infer_type=False,
         help="PMT gain model",
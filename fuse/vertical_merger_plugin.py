@@ -1,4 +1,5 @@
 import strax
+import numba
 
 import numpy as np
 from itertools import groupby
@@ -7,7 +8,12 @@ from .plugin import FuseBasePlugin
 
 
 class VerticalMergerPlugin(FuseBasePlugin):
-    "Plugin that concatenates data from the dependencies along the fist axis"
+    """Plugin that concatenates data from the dependencies along the fist axis.
+
+    The result is sorted by time (and channel). Inputs which are already
+    sorted are merged in linear time. If only one input holds data, it
+    is passed through without a copy.
+    """
 
     save_when = strax.SaveWhen.TARGET
 
@@ -24,11 +30,115 @@ class VerticalMergerPlugin(FuseBasePlugin):
         return incoming_dtypes[0]
 
     def compute(self, **kwargs):
-        merged_data = np.concatenate([kwargs[x] for x in kwargs])
-
-        return strax.sort_by_time(merged_data)
+        return merge_sorted_by_time([kwargs[x] for x in kwargs])
 
     @staticmethod
     def all_equal(iterable):
         g = groupby(iterable)
         return next(g, True) and not next(g, False)
+
+
+def merge_sorted_by_time(arrays):
+    """Function to concatenate arrays and sort the result like
+    strax.sort_by_time.
+
+    Sorted arrays are merged without sorting them again. Entries with
+    the same time and channel keep the order of the arrays. The result
+    is always a new array.
+    """
+    non_empty = [x for x in arrays if len(x) > 0]
+    if len(non_empty) == 0:
+        return arrays[0].copy()
+
+    keys = [_sort_keys(x) for x in non_empty]
+    if not all(_is_sorted(time, channel) for time, channel in keys):
+        return strax.sort_by_time(np.concatenate(arrays))
+
+    if len(non_empty) == 1:
+        return non_empty[0].copy()
+
+    offsets = np.cumsum([0] + [len(x) for x in non_empty])
+    destination = _merge_destination(
+        np.concatenate([time for time, _ in keys]),
+        np.concatenate([channel for _, channel in keys]),
+        offsets,
+    )
+
+    merged = np.empty(offsets[-1], dtype=non_empty[0].dtype)
+    for i, x in enumerate(non_empty):
+        merged[destination[offsets[i] : offsets[i + 1]]] = x
+    return merged
+
+
+def _sort_keys(x):
+    """Time and channel used to sort the entries of x."""
+    if "channel" in x.dtype.names:
+        return x["time"], x["channel"].astype(np.int64)
+    return x["time"], np.zeros(len(x), dtype=np.int64)
+
+
+@numba.njit(nogil=True, cache=True)
+def _is_sorted(time, channel):
+    for i in range(1, len(time)):
+        if (time[i] < time[i - 1]) or ((time[i] == time[i - 1]) and (channel[i] < channel[i - 1])):
+            return False
+    return True
+
+
+@numba.njit(nogil=True, cache=True)
+def _merge_destination(time, channel, offsets):
+    """Function which returns the position of each entry in the merged
+    array.
+
+    The inputs are merged with a binary heap of their first unmerged
+    entries, ordered by time, channel and the index of the input.
+
+    Args:
+        time, channel: keys of the concatenated sorted inputs
+        offsets: start of each input, plus the end
+    """
+    n_inputs = len(offsets) - 1
+    heads = offsets[:-1].copy()
+    destination = np.empty(len(time), dtype=np.int64)
+
+    heap = np.arange(n_inputs)
+    size = n_inputs
+    for start in range(size // 2 - 1, -1, -1):
+        _sift_down(heap, start, size, time, channel, heads)
+
+    for position in range(len(time)):
+        k = heap[0]
+        destination[heads[k]] = position
+        heads[k] += 1
+        if heads[k] == offsets[k + 1]:
+            size -= 1
+            heap[0] = heap[size]
+        _sift_down(heap, 0, size, time, channel, heads)
+
+    return destination
+
+
+@numba.njit(nogil=True, cache=True)
+def _sift_down(heap, start, size, time, channel, heads):
+    parent = start
+    while True:
+        first = parent
+        for child in (2 * parent + 1, 2 * parent + 2):
+            if (child < size) and _precedes(heap[child], heap[first], time, channel, heads):
+                first = child
+        if first == parent:
+            return
+        heap[parent], heap[first] = heap[first], heap[parent]
+        parent = first
+
+
+@numba.njit(nogil=True, cache=True)
+def _precedes(k, m, time, channel, heads):
+    """Whether the next entry of input k comes before the one of input m."""
+    i = heads[k]
+    j = heads[m]
+    if time[i] != time[j]:
+        return time[i] < time[j]
+    if channel[i] != channel[j]:
+        return channel[i] < channel[j]
+    return k < m
@@ -38,3 +38,109 @@ def in_cylinder(x, y, z, min_z, max_z, max_r):
     m = m & (z < max_z)
     m = m & (z >= min_z)
     return m
+
+
+# Codes of the volume shapes used by assign_volumes
+volume_shapes = dict(cylinder=0, polycone=1, polygon=2)
+
+
+def compile_volumes(volumes):
+    """Function to compile volume definitions for assign_volumes.
+
+    Volumes are given as dicts with a shape and its geometry in cm:
+        cylinder: min_z (inclusive), max_z and max_r (exclusive)
+        polycone: z, r_min and r_max of the planes in increasing z.
+            Between two planes the radii are interpolated linearly.
+        polygon: r and z of the corners of a closed polygon in the
+            (r, z) plane
+
+    Returns:
+        shapes: shape code of each volume
+        offsets: start of the parameters of each volume, plus the end
+        parameters: geometry parameters of all volumes
+    """
+    shapes = np.zeros(len(volumes), dtype=np.int64)
+    parameters = []
+    offsets = [0]
+
+    for i, volume in enumerate(volumes):
+        shape = volume["shape"]
+        if shape not in volume_shapes:
+            raise ValueError(f"Unknown volume shape {shape}! Use one of {list(volume_shapes)}.")
+        shapes[i] = volume_shapes[shape]
+
+        if shape == "cylinder":
+            geometry = [volume["min_z"], volume["max_z"], volume["max_r"]]
+        elif shape == "polycone":
+            z = np.asarray(volume["z"], dtype=np.float64)
+            if (len(z) < 2) or np.any(np.diff(z) < 0):
+                raise ValueError("The planes of a polycone need increasing z!")
+            geometry = np.stack((z, volume["r_min"], volume["r_max"]), axis=1).ravel()
+        else:
+            if len(volume["r"]) < 3:
+                raise ValueError("A polygon needs at least three corners!")
+            geometry = np.stack((volume["r"], volume["z"]), axis=1).ravel()
+
+        parameters = np.append(parameters, geometry)
+        offsets.append(len(parameters))
+
+    return shapes, np.array(offsets, dtype=np.int64), np.array(parameters, dtype=np.float64)
+
+
+@numba.njit
+def assign_volumes(r, z, shapes, offsets, parameters):
+    """Function which returns the index of the first volume containing each
+    position, or -1 if no volume contains it.
+
+    Args:
+        r, z: Coordinates of the interactions
+        shapes, offsets, parameters: Volumes compiled with compile_volumes
+    """
+    volume_index = np.full(len(r), -1, dtype=np.int64)
+
+    for i in range(len(r)):
+        for v in range(len(shapes)):
+            p = parameters[offsets[v] : offsets[v + 1]]
+            if shapes[v] == 0:
+                inside = (r[i] < p[2]) & (z[i] < p[1]) & (z[i] >= p[0])
+            elif shapes[v] == 1:
+                inside = _in_polycone(r[i], z[i], p)
+            else:
+                inside = _in_polygon(r[i], z[i], p)
+            if inside:
+                volume_index[i] = v
+                break
+
+    return volume_index
+
+
+@numba.njit
+def _in_polycone(r, z, planes):
+    """Position in a polycone given as (z, r_min, r_max) of its planes."""
+    for j in range(len(planes) // 3 - 1):
+        z_low = planes[3 * j]
+        z_high = planes[3 * j + 3]
+        if (z >= z_low) & (z < z_high):
+            f = (z - z_low) / (z_high - z_low)
+            r_min = planes[3 * j + 1] + f * (planes[3 * j + 4] - planes[3 * j + 1])
+            r_max = planes[3 * j + 2] + f * (planes[3 * j + 5] - planes[3 * j + 2])
+            return (r >= r_min) & (r < r_max)
+    return False
+
+
+@numba.njit
+def _in_polygon(r, z, corners):
+    """Position in a polygon given as (r, z) of its corners, using the even-odd
+    rule."""
+    n = len(corners) // 2
+    inside = False
+    j = n - 1
+    for k in range(n):
+        r_k, z_k = corners[2 * k], corners[2 * k + 1]
+        r_j, z_j = corners[2 * j], corners[2 * j + 1]
+        if (z_k > z) != (z_j > z):
+            r_cross = r_k + (z - z_k) * (r_j - r_k) / (z_j - z_k)
+            if r < r_cross:
+                inside = not inside
+        j = k
+    return inside
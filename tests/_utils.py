@@ -29,3 +29,32 @@ def build_random_instructions(n):
     df["cluster_id"] = np.arange(n)
 
     return df
+
+
+def write_columnar_file(file_name, df, rows_per_batch=4):
+    """Write a DataFrame to a Parquet, Arrow IPC or HDF5 file, chosen by the
+    extension of file_name. Parquet row groups and Arrow record batches hold
+    rows_per_batch rows, so the files are read in several batches."""
+    import pyarrow as pa
+
+    extension = file_name.split(".")[-1]
+    if extension == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.Table.from_pandas(df), file_name, row_group_size=rows_per_batch)
+    elif extension == "arrow":
+        table = pa.Table.from_pandas(df)
+        with pa.ipc.new_file(file_name, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=rows_per_batch):
+                writer.write_batch(batch)
+    elif extension == "h5":
+        import h5py
+
+        with h5py.File(file_name, "w") as f:
+            for column in df.columns:
+                values = df[column].values
+                if values.dtype.kind == "O":
+                    values = values.astype("S")
+                f.create_dataset(column, data=values)
+    else:
+        raise ValueError(f"Unknown columnar file format {extension}!")
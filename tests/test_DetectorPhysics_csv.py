@@ -2,9 +2,13 @@ import os
 import shutil
 import unittest
 import tempfile
+import importlib.util
 import timeout_decorator
+import numpy as np
+import strax
 import fuse
-from _utils import build_random_instructions
+from fuse.plugins.detector_physics.csv_input import csv_file_loader
+from _utils import build_random_instructions, write_columnar_file
 
 TIMEOUT = 480
 
@@ -57,5 +61,89 @@ class TestDetectorPhysicsCsv(unittest.TestCase):
         self.test_context.make(self.run_number, "raw_records")
 
 
+class TestCsvFileLoader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.temp_dir.name, "test.csv")
+
+        # The quanta columns are written as floats, e.g. 1234.56
+        self.instructions = build_random_instructions(10)
+        self.instructions.to_csv(self.input_file, index=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def load(self, rows_per_batch):
+        loader = csv_file_loader(
+            self.input_file,
+            np.random.default_rng(42),
+            event_rate=1,
+            separation_scale=1e8,
+            n_interactions_per_chunk=1e4,
+            rows_per_batch=rows_per_batch,
+        )
+        return np.concatenate([chunk[0] for chunk in loader.output_chunk()])
+
+    def test_float_formatted_quanta(self):
+        for rows_per_batch in (None, 4):
+            loaded = self.load(rows_per_batch)
+            loaded = loaded[np.argsort(loaded["eventid"])]
+            self.assertEqual(len(loaded), 10)
+            for column in ("photons", "electrons", "excitons"):
+                np.testing.assert_array_equal(
+                    loaded[column], self.instructions[column].astype(loaded[column].dtype)
+                )
+
+    def test_streaming_gives_same_times(self):
+        reference = self.load(None)
+        for rows_per_batch in (1, 4):
+            loaded = self.load(rows_per_batch)
+            np.testing.assert_array_equal(loaded["time"], reference["time"])
+            np.testing.assert_array_equal(loaded["eventid"], reference["eventid"])
+
+    def get_array(self, input_file, **config):
+        with tempfile.TemporaryDirectory() as output_folder:
+            test_context = strax.Context(
+                storage=strax.DataDirectory(output_folder),
+                register=[fuse.plugins.detector_physics.ChunkCsvInput],
+            )
+            test_context.set_config(dict(input_file=input_file, **config))
+            return test_context.get_array("TestRun_00000", "microphysics_summary")
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    @unittest.skipIf(importlib.util.find_spec("h5py") is None, "h5py is not installed")
+    def test_columnar_files(self):
+        instructions = build_random_instructions(12)
+        instructions["eventid"] = np.arange(12) // 3
+        key = fuse.context.register_in_memory_input(instructions.to_records(index=False))
+        self.addCleanup(fuse.context.remove_in_memory_input, key)
+        reference = self.get_array(key)
+        self.assertEqual(len(reference), 12)
+
+        for file_name in ["test.parquet", "test.arrow", "test.h5"]:
+            input_file = os.path.join(self.temp_dir.name, file_name)
+            write_columnar_file(input_file, instructions)
+            for rows_per_batch in (None, 2):
+                loaded = self.get_array(input_file, rows_per_batch=rows_per_batch)
+                np.testing.assert_array_equal(loaded, reference)
+
+        input_file = os.path.join(self.temp_dir.name, "unsorted.parquet")
+        write_columnar_file(input_file, instructions.iloc[::-1])
+        with self.assertRaisesRegex(ValueError, "sorted by eventid"):
+            self.get_array(input_file, rows_per_batch=2)
+
+    def test_get_array_of_registered_input(self):
+        instructions = self.instructions.to_records(index=False)
+        test_context = strax.Context(
+            storage=strax.DataDirectory(self.temp_dir.name),
+            register=[fuse.plugins.detector_physics.ChunkCsvInput],
+        )
+        key = fuse.context.register_in_memory_input(lambda: iter([instructions]))
+        self.addCleanup(fuse.context.remove_in_memory_input, key)
+        test_context.set_config({"input_file": key})
+        loaded = test_context.get_array("TestRun_00000", "microphysics_summary")
+        self.assertEqual(len(loaded), 10)
+
+
 if __name__ == "__main__":
     unittest.main()
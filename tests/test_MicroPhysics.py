@@ -3,6 +3,8 @@ import shutil
 import unittest
 import tempfile
 import timeout_decorator
+import numpy as np
+import strax
 import fuse
 import straxen
 from _utils import test_root_file_name
@@ -10,6 +12,11 @@ from _utils import test_root_file_name
 TIMEOUT = 60
 
 
+@straxen.URLConfig.register("test_linear_efield")
+def linear_efield(offset):
+    return lambda positions: float(offset) + positions[:, 0] - positions[:, 1]
+
+
 class TestMicroPhysicsBase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -60,8 +67,8 @@ class TestMicroPhysics(TestMicroPhysicsBase):
     def test_MergeCluster(self):
         self.test_context.make(self.run_number, "clustered_interactions")
 
-    @timeout_decorator.timeout(TIMEOUT, exception_message="VolumesMerger timed out")
-    def test_VolumesMerger(self):
+    @timeout_decorator.timeout(TIMEOUT, exception_message="DetectorVolumes timed out")
+    def test_DetectorVolumes(self):
         self.test_context.make(self.run_number, "interactions_in_roi")
 
     @timeout_decorator.timeout(TIMEOUT, exception_message="ElectricField timed out")
@@ -97,6 +104,103 @@ class TestMicroPhysicsAlternativePlugins(TestMicroPhysicsBase):
         self.test_context.register(fuse.plugins.XENONnT_GasPhase)
         self.test_context.make(self.run_number, "gas_phase_interactions")
 
+    @timeout_decorator.timeout(TIMEOUT, exception_message="VolumesMerger timed out")
+    def test_VolumesMerger(self):
+        self.test_context.register(fuse.plugins.XENONnT_TPC)
+        self.test_context.register(fuse.plugins.XENONnT_BelowCathode)
+        self.test_context.register(fuse.plugins.VolumesMerger)
+        self.test_context.make(self.run_number, "interactions_in_roi")
+
+    @timeout_decorator.timeout(TIMEOUT, exception_message="FusedMicroPhysics timed out")
+    def test_FusedMicroPhysics(self):
+        self.test_context.register(fuse.plugins.FusedMicroPhysics)
+        self.test_context.make(self.run_number, "microphysics_summary")
+
+
+class TestFusedMicroPhysics(unittest.TestCase):
+    @staticmethod
+    def make_interactions(n_events=20, n_per_event=12):
+        rng = np.random.default_rng(42)
+        fields = [
+            name
+            for name in np.dtype(fuse.micro_physics.ChunkInput.dtype).names
+            if name not in ("time", "endtime")
+        ]
+        string_fields = ("type", "parenttype", "creaproc", "edproc")
+        n = n_events * n_per_event
+        interactions = np.zeros(
+            n, dtype=[(name, "U16" if name in string_fields else np.float64) for name in fields]
+        )
+        event = np.repeat(np.arange(n_events), n_per_event)
+        interactions["eventid"] = event
+
+        # Few sites per event, deposits of a site are close in space and time
+        site = rng.integers(0, 3, n)
+        r = rng.uniform(0, 80, (n_events, 3))[event, site]
+        phi = rng.uniform(0, 2 * np.pi, (n_events, 3))[event, site]
+        interactions["x"] = r * np.cos(phi) + rng.uniform(0, 1e-3, n)
+        interactions["y"] = r * np.sin(phi) + rng.uniform(0, 1e-3, n)
+        interactions["z"] = rng.uniform(-170, 10, (n_events, 3))[event, site]
+        interactions["t"] = site * 100 + rng.uniform(0, 30, n)
+        interactions["ed"] = rng.uniform(1, 100, n)
+        interactions["type"] = rng.choice(["gamma", "e-"], n)
+        interactions["parenttype"] = "none"
+        interactions["creaproc"] = "none"
+        interactions["edproc"] = rng.choice(["phot", "compt", "eIoni"], n)
+        return interactions
+
+    def get_arrays(self, plugins, key):
+        with tempfile.TemporaryDirectory() as output_folder:
+            test_context = strax.Context(
+                storage=strax.DataDirectory(output_folder),
+                register=[fuse.micro_physics.ChunkInput] + plugins,
+            )
+            test_context.set_config(
+                dict(
+                    file_name=key,
+                    n_interactions_per_chunk=50,
+                    tag_cluster_by="energy",
+                    efield_map="test_linear_efield://200",
+                )
+            )
+            return [
+                test_context.get_array("TestRun_00000", target)
+                for target in ("interactions_in_roi", "electric_field_values")
+            ]
+
+    def test_same_as_unfused_chain(self):
+        key = fuse.context.register_in_memory_input(self.make_interactions())
+        self.addCleanup(fuse.context.remove_in_memory_input, key)
+
+        plugins = fuse.micro_physics
+        reference = self.get_arrays(
+            [
+                plugins.FindCluster,
+                plugins.MergeCluster,
+                plugins.DetectorVolumes,
+                plugins.ElectricField,
+            ],
+            key,
+        )
+        fused = self.get_arrays([plugins.FusedMicroPhysics], key)
+
+        self.assertGreater(len(reference[0]), 20)
+        self.assertGreater(len(np.unique(reference[0]["vol_id"])), 1)
+        for fused_array, reference_array in zip(fused, reference):
+            np.testing.assert_array_equal(fused_array, reference_array)
+
+    def test_options_of_the_unfused_chain(self):
+        plugins = fuse.micro_physics
+        options = set(fuse.plugin.FuseBasePlugin.takes_config)
+        for plugin in [
+            plugins.FindCluster,
+            plugins.MergeCluster,
+            plugins.DetectorVolumes,
+            plugins.ElectricField,
+        ]:
+            options |= set(plugin.takes_config)
+        self.assertEqual(set(plugins.FusedMicroPhysics.takes_config), options)
+
 
 if __name__ == "__main__":
     unittest.main()
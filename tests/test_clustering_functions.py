@@ -1,6 +1,51 @@
 import unittest
 import numpy as np
-from fuse.plugins.micro_physics.find_cluster import _find_cluster, simple_1d_clustering
+import strax
+from sklearn.cluster import DBSCAN
+from fuse.plugins.micro_physics.find_cluster import (
+    FindCluster,
+    _cluster_segments,
+    simple_1d_clustering,
+)
+from fuse.plugins.micro_physics.merge_cluster import (
+    MergeCluster,
+    cluster_and_classify,
+    compile_classification_rules,
+    compile_run_classification_rules,
+    classify,
+)
+from fuse.plugins.micro_physics.input import ChunkInput
+from fuse.common import (
+    g4_codes,
+    g4_vocabulary,
+    default_classification_rules,
+    classification_vocabulary,
+    encode_g4_strings,
+)
+
+
+def _find_cluster(x, cluster_size_space):
+    """Reference clustering of three dimensional data (x, y, z) with DBSCAN.
+
+    Args:
+        x (np.ndarray): structured numpy array with x, y, z coordinates to be clustered
+        cluster_size_space (float): Clustering distance for DBSCAN
+    Returns:
+        Cluster labels
+    """
+    db_cluster = DBSCAN(eps=cluster_size_space, min_samples=1)
+
+    # Conversion from numpy structured array to regular array
+    xprime = np.stack((x["x"], x["y"], x["z"]), axis=1)
+
+    return db_cluster.fit_predict(xprime)
+
+
+def _cluster_space(x, cluster_size_space):
+    """Clustering of three dimensional data (x, y, z) with the kernel of
+    FindCluster."""
+    labels, _ = _cluster_segments(x["x"], x["y"], x["z"], np.array([0, len(x)]), cluster_size_space)
+    return labels
 
 
 class TestFindCluster(unittest.TestCase):
@@ -17,6 +62,8 @@ class TestFindCluster(unittest.TestCase):
         expected_result = np.array([0, 1, 2, 3, 4, 5], dtype=np.int32)
         result = _find_cluster(x, cluster_size_space)
         np.testing.assert_array_equal(result, expected_result)
+        result = _cluster_space(x, cluster_size_space)
+        np.testing.assert_array_equal(result, expected_result)
 
     def test__find_cluster_all_merged(self):
 
@@ -30,6 +77,8 @@ class TestFindCluster(unittest.TestCase):
         expected_result = np.array([0, 0, 0, 0, 0, 0], dtype=np.int32)
         result = _find_cluster(x, cluster_size_space)
         np.testing.assert_array_equal(result, expected_result)
+        result = _cluster_space(x, cluster_size_space)
+        np.testing.assert_array_equal(result, expected_result)
 
     def test__find_cluster_two_clusters(self):
 
@@ -43,6 +92,20 @@ class TestFindCluster(unittest.TestCase):
         expected_result = np.array([0, 0, 0, 1, 1, 1, 0], dtype=np.int32)
         result = _find_cluster(x, cluster_size_space)
         np.testing.assert_array_equal(result, expected_result)
+        result = _cluster_space(x, cluster_size_space)
+        np.testing.assert_array_equal(result, expected_result)
+
+    def test_zero_eps(self):
+        # Larger segments are clustered on a grid which can not be built from a
+        # cell size of zero
+        dtype = np.dtype([("x", np.float32), ("y", np.float32), ("z", np.float32)])
+        for n in [6, 40]:
+            x = np.ones(n, dtype=dtype)
+            np.testing.assert_array_equal(_cluster_space(x, 0), np.zeros(n))
+
+            x["x"][n // 2 :] = 2
+            expected_result = np.repeat([0, 1], [n // 2, n - n // 2])
+            np.testing.assert_array_equal(_cluster_space(x, 0), expected_result)
 
     def test_simple_1d_clustering_two_clusters_ordered_input(self):
         data = np.array([0, 1, 2, 4, 5], dtype=np.float32)
@@ -58,6 +121,134 @@ class TestFindCluster(unittest.TestCase):
         result = simple_1d_clustering(data, scale)
         np.testing.assert_array_equal(result, expected_result)
 
+    def test_find_cluster_matches_dbscan(self):
+        rng = np.random.default_rng(42)
+        dtype = np.dtype(
+            [("x", np.float32), ("y", np.float32), ("z", np.float32), ("time", np.int64)]
+        )
+        interactions = np.zeros(2000, dtype=dtype)
+        interactions["time"] = rng.integers(0, 1000, len(interactions))
+        for coordinate in ["x", "y", "z"]:
+            interactions[coordinate] = rng.normal(0, 0.1, len(interactions))
+
+        cluster_size_space = 0.01
+        cluster_size_time = 10
+
+        # Reference: DBSCAN of each time cluster
+        time_cluster = simple_1d_clustering(interactions["time"], cluster_size_time)
+        spacial_cluster = np.zeros(len(interactions), dtype=np.int32)
+        for t in np.unique(time_cluster):
+            mask = time_cluster == t
+            spacial_cluster[mask] = _find_cluster(interactions[mask], cluster_size_space)
+        _, expected_result = np.unique((time_cluster, spacial_cluster), axis=1, return_inverse=True)
+
+        for parallel in [False, True]:
+            result = FindCluster.find_cluster(
+                interactions, cluster_size_space, cluster_size_time, parallel=parallel
+            )
+            np.testing.assert_array_equal(result, expected_result.reshape(-1))
+
+
+class TestMergeCluster(unittest.TestCase):
+
+    def test_cluster_and_classify(self):
+        dtype = np.dtype(
+            [
+                ("x", np.float32),
+                ("y", np.float32),
+                ("z", np.float32),
+                ("time", np.int64),
+                ("ed", np.float32),
+                ("type", np.int16),
+                ("parenttype", np.int16),
+                ("creaproc", np.int16),
+                ("edproc", np.int16),
+                ("x_pri", np.float32),
+                ("y_pri", np.float32),
+                ("z_pri", np.float32),
+                ("eventid", np.int32),
+                ("cluster_ids", np.int32),
+            ]
+        )
+        interactions = np.zeros(5, dtype=dtype)
+        interactions["cluster_ids"] = [3, 1, 3, 1, 3]
+        interactions["x"] = [1, 2, 3, 4, 5]
+        interactions["time"] = [30, 20, 10, 40, 50]
+        interactions["ed"] = [1, 3, 2, 1, 1]
+        interactions["type"] = [g4_codes["gamma"], g4_codes["e-"], g4_codes["e-"], 0, 0]
+        interactions["eventid"] = [5, 6, 7, 8, 9]
+
+        result = np.zeros(2, dtype=MergeCluster.dtype)
+        result = cluster_and_classify(result, interactions, "energy")
+        np.testing.assert_array_equal(result["cluster_id"], [1, 3])
+        np.testing.assert_allclose(result["x"], [2.5, 3])
+        np.testing.assert_array_equal(result["time"], [25, 25])
+        np.testing.assert_allclose(result["ed"], [4, 4])
+        np.testing.assert_array_equal(result["eventid"], [6, 7])
+        np.testing.assert_array_equal(result["nestid"], [8, 8])
+
+        result = cluster_and_classify(result, interactions, "time")
+        np.testing.assert_array_equal(result["eventid"], [6, 7])
+
+        result = cluster_and_classify(result, interactions[::-1], "time")
+        np.testing.assert_array_equal(result["eventid"], [6, 7])
+        np.testing.assert_array_equal(result["nestid"], [8, 8])
+
+    def test_classification_rules(self):
+        rules = [dict(parenttype="Ar37", not_edproc="msc", A=37, Z=18, nestid=12)]
+        rules += default_classification_rules
+        vocabulary = classification_vocabulary(rules)
+        self.assertEqual(vocabulary, list(g4_vocabulary) + ["Ar37"])
+
+        dtype = np.dtype(
+            [(field, np.int16) for field in ["type", "parenttype", "creaproc", "edproc"]]
+        )
+        interactions = np.zeros(5, dtype=dtype)
+        interactions["type"] = encode_g4_strings(
+            np.array(["e-", "e-", "alpha", "gamma", "Xe131"]), vocabulary
+        )
+        interactions["parenttype"] = encode_g4_strings(
+            np.array(["Ar37", "Ar37", "none", "Kr83[9.405]", "none"]), vocabulary
+        )
+        interactions["edproc"] = encode_g4_strings(
+            np.array(["eIoni", "msc", "ionIoni", "phot", "RadioactiveDecay"]), vocabulary
+        )
+
+        result = classify(interactions, *compile_classification_rules(rules, vocabulary))
+        np.testing.assert_array_equal(result["nestid"], [12, 8, 6, 11, 12])
+        np.testing.assert_array_equal(result["A"], [37, 0, 4, 127, 127])
+        np.testing.assert_array_equal(result["Z"], [18, 0, 2, 0, 127])
+
+        with self.assertRaises(ValueError):
+            classify(interactions, *compile_classification_rules(rules[:1], vocabulary))
+
+    def test_run_classification_rules(self):
+        rules = [dict(parenttype="Ar37", not_edproc="msc", A=37, Z=18, nestid=12)]
+        rules += default_classification_rules
+        with self.assertRaisesRegex(ValueError, "extra_g4_names"):
+            compile_run_classification_rules(rules)
+
+        conditions, outcomes = compile_run_classification_rules(rules, ["Ar37"])
+        expected_conditions, expected_outcomes = compile_classification_rules(
+            rules, classification_vocabulary(rules)
+        )
+        np.testing.assert_array_equal(conditions, expected_conditions)
+        np.testing.assert_array_equal(outcomes, expected_outcomes)
+
+    def test_rules_are_not_in_the_input_lineage(self):
+        test_context = strax.Context(register=[ChunkInput, FindCluster, MergeCluster])
+        keys = []
+        for rules in [default_classification_rules, default_classification_rules[1:]]:
+            test_context.set_config(dict(classification_rules=rules))
+            keys.append(
+                [
+                    str(test_context.key_for("0", target))
+                    for target in ["geant4_interactions", "clustered_interactions"]
+                ]
+            )
+        self.assertEqual(keys[0][0], keys[1][0])
+        self.assertNotEqual(keys[0][1], keys[1][1])
+
 
 if __name__ == "__main__":
     unittest.main()
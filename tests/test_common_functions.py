@@ -1,7 +1,21 @@
+import os
+import tempfile
+import importlib.util
 import numpy as np
 import awkward as ak
 import unittest
-from fuse.common import awkward_to_flat_numpy, full_array_to_numpy, dynamic_chunking
+from fuse.common import (
+    awkward_to_flat_numpy,
+    full_array_to_numpy,
+    dynamic_chunking,
+    DynamicChunkBuilder,
+    extend_poisson_event_times,
+    iterate_columnar_file,
+    iterate_complete_events,
+    count_sorted_events,
+)
+from fuse.vertical_merger_plugin import merge_sorted_by_time
+import strax
 
 
 class TestFullArrayToNumpy(unittest.TestCase):
@@ -66,5 +80,234 @@ class TestDynamicChunking(unittest.TestCase):
         np.testing.assert_array_equal(clusters, expected_clusters)
 
 
+class TestDynamicChunkBuilder(unittest.TestCase):
+    def build_chunks(self, data, batch_size):
+        builder = DynamicChunkBuilder(
+            separation_scale=2, n_interactions_per_chunk=2, first_chunk_left=1, last_chunk_length=4
+        )
+        chunks = []
+        for i in range(0, len(data), batch_size):
+            chunks.extend(builder.add(data[i : i + batch_size]))
+        chunks.append(builder.finish())
+        return chunks
+
+    def test_chunk_bounds(self):
+        data = np.zeros(8, dtype=[("time", np.int64)])
+        data["time"] = [1, 2, 3, 4, 8, 9, 10, 11]
+
+        chunks = self.build_chunks(data, len(data))
+
+        self.assertEqual(len(chunks), 2)
+        np.testing.assert_array_equal(chunks[0][0]["time"], [1, 2, 3, 4])
+        self.assertEqual(chunks[0][1:], (0, 4 + int(0.75 * 4)))
+        self.assertEqual(chunks[1][1:], (4 + int(0.75 * 4), 11 + int(0.75 * (4 + 4))))
+
+    def test_matches_dynamic_chunking(self):
+        data = np.zeros(1000, dtype=[("time", np.int64)])
+        data["time"] = np.random.default_rng(0).exponential(10, 1000).cumsum().astype(np.int64)
+        for n_min in [1, 5, 50]:
+            clusters = dynamic_chunking(data["time"], 20, n_min)
+            builder = DynamicChunkBuilder(separation_scale=20, n_interactions_per_chunk=n_min)
+            chunks = list(builder.add(data)) + [builder.finish()]
+            np.testing.assert_array_equal(
+                [len(chunk[0]) for chunk in chunks], np.bincount(clusters)
+            )
+
+    def test_no_data(self):
+        builder = DynamicChunkBuilder(separation_scale=2, n_interactions_per_chunk=2)
+        self.assertEqual(list(builder.add(np.zeros(0, dtype=[("time", np.int64)]))), [])
+        with self.assertRaises(ValueError):
+            builder.finish()
+
+    def test_time_window(self):
+        data = np.zeros(8, dtype=[("time", np.int64)])
+        data["time"] = [1, 2, 3, 4, 8, 9, 10, 11]
+
+        builder = DynamicChunkBuilder(
+            separation_scale=2, n_interactions_per_chunk=2, time_window=(-5, 20)
+        )
+        chunks = list(builder.add(data)) + [builder.finish()]
+        self.assertEqual(builder.chunk_bounds, [-5, 4 + int(0.75 * 4), 20])
+        self.assertEqual(chunks[-1][1:], (4 + int(0.75 * 4), 20))
+
+        builder = DynamicChunkBuilder(
+            separation_scale=2, n_interactions_per_chunk=2, time_window=(None, 10)
+        )
+        list(builder.add(data))
+        with self.assertRaises(ValueError):
+            builder.finish()
+
+    def test_batches_give_same_chunks(self):
+        data = np.zeros(500, dtype=[("time", np.int64)])
+        data["time"] = np.random.default_rng(1).exponential(2, 500).cumsum().astype(np.int64)
+
+        reference = self.build_chunks(data, len(data))
+        for batch_size in [1, 7, 100]:
+            chunks = self.build_chunks(data, batch_size)
+            self.assertEqual(len(chunks), len(reference))
+            for chunk, reference_chunk in zip(chunks, reference):
+                np.testing.assert_array_equal(chunk[0], reference_chunk[0])
+                self.assertEqual(chunk[1:], reference_chunk[1:])
+
+
+class TestExtendPoissonEventTimes(unittest.TestCase):
+    def test_extend(self):
+        rng = np.random.default_rng(1)
+        event_times = extend_poisson_event_times(np.zeros(0, dtype=np.int64), 10, 1e-3, rng)
+        self.assertEqual(len(event_times), 10)
+        self.assertTrue(np.all(np.diff(event_times) >= 0))
+
+        extended = extend_poisson_event_times(event_times, 1000, 1e-3, rng)
+        np.testing.assert_array_equal(extended[:10], event_times)
+        self.assertEqual(extended.dtype, np.int64)
+        self.assertTrue(np.all(np.diff(extended) >= 0))
+        # Mean time between events is the inverse of the rate
+        self.assertAlmostEqual(extended[-1] / 1000 / 1e3, 1, delta=0.15)
+
+        self.assertIs(extend_poisson_event_times(extended, 5, 1e-3, rng), extended)
+
+
+class TestIterateColumnarFile(unittest.TestCase):
+    @staticmethod
+    def make_data():
+        data = np.zeros(10, dtype=[("eventid", np.int64), ("ed", np.float64), ("type", "U8")])
+        data["eventid"] = np.arange(10) // 3
+        data["ed"] = np.arange(10)
+        data["type"] = "gamma"
+        return data
+
+    def check_batches(self, batches, data):
+        self.assertTrue(all(set(batch) == {"eventid", "type"} for batch in batches))
+        np.testing.assert_array_equal(
+            np.concatenate([batch["eventid"] for batch in batches]), data["eventid"]
+        )
+        np.testing.assert_array_equal(
+            np.concatenate([batch["type"] for batch in batches]).astype(str), data["type"]
+        )
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    def test_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        data = self.make_data()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file = os.path.join(temp_dir, "data.parquet")
+            table = pa.table({name: data[name] for name in data.dtype.names})
+            pq.write_table(table, file, row_group_size=4)
+
+            batches = list(iterate_columnar_file(file, ["eventid", "type"]))
+            self.assertEqual(len(batches), 3)
+            self.check_batches(batches, data)
+
+            batches = list(iterate_columnar_file(file, ["eventid", "type"], rows_per_batch=6))
+            self.assertEqual(len(batches), 2)
+            self.check_batches(batches, data)
+
+            with self.assertRaises(ValueError):
+                list(iterate_columnar_file(file, ["eventid", "x"]))
+
+    @unittest.skipIf(importlib.util.find_spec("h5py") is None, "h5py is not installed")
+    def test_hdf5(self):
+        import h5py
+
+        data = self.make_data()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file = os.path.join(temp_dir, "data.h5")
+            with h5py.File(file, "w") as f:
+                f.create_dataset("eventid", data=data["eventid"])
+                f.create_dataset("ed", data=data["ed"])
+                f.create_dataset("type", data=data["type"].astype("S"))
+
+            batches = list(iterate_columnar_file(file, ["eventid", "type"], rows_per_batch=4))
+            self.assertEqual(len(batches), 3)
+            self.check_batches(batches, data)
+
+
+class TestIterateCompleteEvents(unittest.TestCase):
+    def test_events_are_not_split(self):
+        data = np.zeros(10, dtype=[("eventid", np.int64)])
+        data["eventid"] = [0, 0, 1, 1, 1, 1, 1, 2, 3, 3]
+
+        for batch_size in [1, 3, 4, 10]:
+            batches = [data[i : i + batch_size] for i in range(0, len(data), batch_size)]
+            regrouped = list(iterate_complete_events(batches))
+            np.testing.assert_array_equal(np.concatenate(regrouped), data)
+            for batch, next_batch in zip(regrouped[:-1], regrouped[1:]):
+                self.assertLess(batch["eventid"][-1], next_batch["eventid"][0])
+
+    def test_unsorted_events_raise(self):
+        data = np.zeros(6, dtype=[("eventid", np.int64)])
+        data["eventid"] = [0, 0, 2, 2, 1, 0]
+
+        for batch_size in [1, 3, 6]:
+            batches = [data[i : i + batch_size] for i in range(0, len(data), batch_size)]
+            with self.assertRaisesRegex(ValueError, "sorted by eventid"):
+                list(iterate_complete_events(batches))
+
+
+class TestCountSortedEvents(unittest.TestCase):
+    def test_count(self):
+        eventid = np.array([0, 0, 1, 1, 1, 1, 1, 2, 5, 5])
+        for batch_size in [1, 3, 4, 10]:
+            batches = [eventid[i : i + batch_size] for i in range(0, len(eventid), batch_size)]
+            self.assertEqual(count_sorted_events(batches), 4)
+        self.assertEqual(count_sorted_events([]), 0)
+
+        with self.assertRaisesRegex(ValueError, "sorted by eventid"):
+            count_sorted_events([eventid[:3], eventid[:3]])
+
+
+class TestMergeSortedByTime(unittest.TestCase):
+    dtype = [("time", np.int64), ("endtime", np.int64), ("channel", np.int16), ("id", np.int32)]
+
+    def make_data(self, time, channel, first_id):
+        data = np.zeros(len(time), dtype=self.dtype)
+        data["time"] = time
+        data["channel"] = channel
+        data["id"] = np.arange(first_id, first_id + len(time))
+        return data
+
+    def test_merge_sorted_inputs(self):
+        a = self.make_data([1, 2, 2, 5], [0, -1, 3, 0], 0)
+        b = self.make_data([0, 2, 2, 9], [1, -1, 0, 0], 10)
+        c = self.make_data([], [], 20)
+
+        result = merge_sorted_by_time([a, b, c])
+        expected = strax.sort_by_time(np.concatenate([a, b, c]))
+        np.testing.assert_array_equal(result, expected)
+        np.testing.assert_array_equal(result["id"], [10, 0, 1, 11, 12, 2, 3, 13])
+
+    def test_unsorted_input(self):
+        a = self.make_data([3, 1], [0, 0], 0)
+        b = self.make_data([2], [0], 10)
+
+        result = merge_sorted_by_time([a, b])
+        np.testing.assert_array_equal(result["id"], [1, 10, 0])
+
+    def test_single_input_is_copied(self):
+        a = self.make_data([1, 2, 3], [0, 0, 0], 0)
+        b = self.make_data([], [], 10)
+
+        for arrays, expected in [([b, a], a), ([b, b], b)]:
+            result = merge_sorted_by_time(arrays)
+            self.assertIsNot(result, expected)
+            self.assertFalse(np.shares_memory(result, expected))
+            np.testing.assert_array_equal(result, expected)
+
+    def test_merge_many_inputs(self):
+        rng = np.random.default_rng(2)
+        arrays = []
+        for i in range(20):
+            n = rng.integers(0, 50)
+            time = np.sort(rng.integers(0, 100, n))
+            channel = rng.integers(-1, 3, n)
+            data = self.make_data(time, channel, 100 * i)
+            arrays.append(strax.sort_by_time(data))
+
+        result = merge_sorted_by_time(arrays)
+        np.testing.assert_array_equal(result, strax.sort_by_time(np.concatenate(arrays)))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+from fuse.volume_plugin import compile_volumes, assign_volumes, in_cylinder
+from fuse.plugins.micro_physics.detector_volumes import DetectorVolumes, select_volumes
+
+
+class TestAssignVolumes(unittest.TestCase):
+
+    def test_cylinders_match_in_cylinder(self):
+        rng = np.random.default_rng(42)
+        x, y = rng.uniform(-80, 80, (2, 10000)).astype(np.float32)
+        z = rng.uniform(-160, 10, 10000).astype(np.float32)
+        r = np.sqrt(x**2 + y**2)
+
+        volumes = [
+            dict(shape="cylinder", min_z=-148.6515, max_z=0.0, max_r=66.4),
+            dict(shape="cylinder", min_z=-154.6555, max_z=-148.6515, max_r=66.4),
+        ]
+        volume_index = assign_volumes(r, z, *compile_volumes(volumes))
+
+        np.testing.assert_array_equal(volume_index == 0, in_cylinder(x, y, z, -148.6515, 0.0, 66.4))
+        np.testing.assert_array_equal(
+            volume_index == 1, in_cylinder(x, y, z, -154.6555, -148.6515, 66.4)
+        )
+
+    def test_polycone_and_polygon(self):
+        r = np.array([0.5, 1.5, 2.5, 1.5, 0.25, 5])
+        z = np.array([0.5, 0.5, 1.5, 1.5, -1, 0])
+
+        # Cone getting wider from z=0 to z=2, with an inner radius of 1
+        polycone = dict(shape="polycone", z=[0, 2], r_min=[1, 1], r_max=[2, 3])
+        # Triangle with corners (0, -2), (1, -2) and (0, 0)
+        polygon = dict(shape="polygon", r=[0, 1, 0], z=[-2, -2, 0])
+
+        volume_index = assign_volumes(r, z, *compile_volumes([polycone, polygon]))
+        np.testing.assert_array_equal(volume_index, [-1, 0, 0, 0, 1, -1])
+
+    def test_first_volume_wins(self):
+        volumes = [
+            dict(shape="cylinder", min_z=0, max_z=1, max_r=1),
+            dict(shape="cylinder", min_z=-1, max_z=2, max_r=2),
+        ]
+        volume_index = assign_volumes(
+            np.array([0.5, 1.5, 3]), np.array([0.5, 0.5, 0.5]), *compile_volumes(volumes)
+        )
+        np.testing.assert_array_equal(volume_index, [0, 1, -1])
+
+    def test_unknown_shape(self):
+        with self.assertRaises(ValueError):
+            compile_volumes([dict(shape="sphere", radius=1)])
+
+
+class TestSelectVolumes(unittest.TestCase):
+
+    def test_select_volumes_sorted_by_time_and_volume(self):
+        volumes = [
+            dict(shape="cylinder", min_z=0, max_z=1, max_r=1, xe_density=2, vol_id=1, create_S2=1),
+            dict(shape="cylinder", min_z=-1, max_z=0, max_r=1, xe_density=3, vol_id=2, create_S2=0),
+        ]
+        interactions = np.zeros(4, dtype=DetectorVolumes.dtype)
+        interactions["time"] = [20, 10, 10, 5]
+        interactions["z"] = [0.5, -0.5, 0.5, 5]
+        interactions["cluster_id"] = [1, 2, 3, 4]
+
+        result = select_volumes(interactions, volumes, compile_volumes(volumes))
+
+        np.testing.assert_array_equal(result["cluster_id"], [3, 2, 1])
+        np.testing.assert_array_equal(result["vol_id"], [1, 2, 1])
+        np.testing.assert_array_equal(result["xe_density"], [2, 3, 2])
+        np.testing.assert_array_equal(result["create_S2"], [True, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
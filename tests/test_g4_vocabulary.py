@@ -0,0 +1,35 @@
+import unittest
+import numpy as np
+from fuse.common import g4_vocabulary, g4_codes, encode_g4_strings, decode_g4_strings
+
+
+class TestG4Vocabulary(unittest.TestCase):
+
+    def test_encode_known_names(self):
+        vocabulary = list(g4_vocabulary)
+        names = np.array(["gamma", "e-", "gamma", "ionIoni"])
+
+        codes = encode_g4_strings(names, vocabulary)
+
+        np.testing.assert_array_equal(
+            codes, [g4_codes["gamma"], g4_codes["e-"], g4_codes["gamma"], g4_codes["ionIoni"]]
+        )
+        self.assertEqual(codes.dtype, np.int16)
+        self.assertEqual(vocabulary, list(g4_vocabulary))
+
+    def test_encode_new_names(self):
+        vocabulary = list(g4_vocabulary)
+        names = np.array(["Xe131[39.600]", "gamma", "Xe131[39.600]", "Rn222"])
+
+        codes = encode_g4_strings(names, vocabulary)
+
+        self.assertEqual(len(vocabulary), len(g4_vocabulary) + 2)
+        np.testing.assert_array_equal(decode_g4_strings(codes, vocabulary), names)
+
+    def test_encode_empty(self):
+        codes = encode_g4_strings(np.zeros(0, dtype="<U18"), list(g4_vocabulary))
+        self.assertEqual(len(codes), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
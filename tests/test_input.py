@@ -2,11 +2,17 @@ import os
 import shutil
 import unittest
 import tempfile
+import importlib.util
 import timeout_decorator
 import fuse
+import strax
 import straxen
 import numpy as np
-from _utils import test_root_file_name
+import pandas as pd
+import awkward as ak
+import uproot
+from unittest import mock
+from _utils import test_root_file_name, write_columnar_file
 
 TIMEOUT = 60
 
@@ -186,5 +192,427 @@ class TestInput(unittest.TestCase):
             test_context.make(self.run_number, "geant4_interactions")
 
 
+class TestInMemoryInput(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.run_number = "TestRun_00000"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    @staticmethod
+    def make_interactions():
+        fields = [
+            name
+            for name in np.dtype(fuse.micro_physics.ChunkInput.dtype).names
+            if name not in ("time", "endtime")
+        ]
+        string_fields = ("type", "parenttype", "creaproc", "edproc")
+        interactions = np.zeros(
+            6, dtype=[(name, "U16" if name in string_fields else np.float64) for name in fields]
+        )
+        interactions["eventid"] = [0, 0, 1, 2, 2, 2]
+        interactions["t"] = [0, 10, 0, 0, 5, 20]
+        interactions["ed"] = 1
+        interactions["type"] = "gamma"
+        interactions["edproc"] = "phot"
+        return interactions
+
+    @timeout_decorator.timeout(TIMEOUT, exception_message="LoadArray timed out")
+    def test_load_array(self):
+        test_context = fuse.context.microphysics_context(self.temp_dir.name)
+        key = fuse.context.register_in_memory_input(self.make_interactions())
+        self.addCleanup(fuse.context.remove_in_memory_input, key)
+        test_context.set_config({"file_name": key})
+        g4_loaded = test_context.get_array(self.run_number, "geant4_interactions")
+        self.assertEqual(len(g4_loaded), 6)
+        self.assertEqual(len(np.unique(g4_loaded["eventid"])), 3)
+
+        vocabulary = test_context.get_metadata(self.run_number, "geant4_interactions")[
+            "g4_vocabulary"
+        ]
+        decoded = fuse.common.decode_g4_fields(g4_loaded, vocabulary)
+        self.assertTrue(np.all(decoded["type"] == "gamma"))
+
+    def test_get_array_of_registered_input(self):
+        interactions = self.make_interactions()
+        for input_data in [interactions, lambda: iter([interactions[:3], interactions[3:]])]:
+            with tempfile.TemporaryDirectory() as output_folder:
+                test_context = strax.Context(
+                    storage=strax.DataDirectory(output_folder),
+                    register=[fuse.micro_physics.ChunkInput],
+                )
+                key = fuse.context.register_in_memory_input(input_data)
+                self.addCleanup(fuse.context.remove_in_memory_input, key)
+                test_context.set_config({"file_name": key})
+                g4_loaded = test_context.get_array(self.run_number, "geant4_interactions")
+                self.assertEqual(len(g4_loaded), 6)
+                self.assertEqual(len(np.unique(g4_loaded["eventid"])), 3)
+
+    def test_data_in_config_raises(self):
+        test_context = strax.Context(
+            storage=strax.DataDirectory(self.temp_dir.name),
+            register=[fuse.micro_physics.ChunkInput],
+        )
+        test_context.set_config({"file_name": self.make_interactions()})
+        with self.assertRaisesRegex(ValueError, "register_in_memory_input"):
+            test_context.get_array(self.run_number, "geant4_interactions")
+
+    def test_generator_input(self):
+        interactions = self.make_interactions()
+        batches = [interactions[:3], interactions[3:]]
+        reader = fuse.micro_physics.input.file_loader(
+            None, lambda: iter(batches), np.random.default_rng(42), event_rate=10
+        )
+        chunks = list(reader.output_chunk())
+        loaded = np.concatenate([chunk[0] for chunk in chunks])
+        self.assertEqual(len(loaded), 6)
+        self.assertTrue(chunks[-1][3])
+        self.assertTrue(np.all(np.diff(loaded["time"]) >= 0))
+
+
+def write_root_file(file_name, n_per_event, eventids, positions=None):
+    """Function which writes a small root file with the branches of a
+    Geant4 output file. positions are the (xp, yp, zp) of the
+    interactions in mm, default is 1 mm for all."""
+    n_interactions = int(np.sum(n_per_event))
+
+    def jagged(values):
+        return ak.unflatten(np.asarray(values), n_per_event)
+
+    branches = {
+        name: jagged(np.ones(n_interactions))
+        for name in ("xp", "yp", "zp", "time", "ed", "trackid", "parentid")
+    }
+    branches["time"] = jagged(np.arange(n_interactions) * 1e-9)
+    if positions is not None:
+        for name, values in zip(("xp", "yp", "zp"), positions):
+            branches[name] = jagged(np.asarray(values, dtype=np.float64))
+    for name in ("type", "parenttype", "creaproc", "edproc"):
+        branches[name] = ak.unflatten(ak.Array(["gamma"] * n_interactions), n_per_event)
+    for name in ("xp_pri", "yp_pri", "zp_pri"):
+        branches[name] = np.zeros(len(n_per_event))
+    branches["eventid"] = np.asarray(eventids)
+    with uproot.recreate(file_name) as root_file:
+        root_file["events"] = branches
+
+
+def find_ttree(n_simulated_events=None):
+    """Function which replaces file_loader._find_ttree for root files
+    without the nEVENTS header, which uproot can not write."""
+
+    def _find_ttree(file, root_dir):
+        ttree = root_dir["events"]
+        if n_simulated_events is None:
+            return ttree, ttree.num_entries
+        return ttree, n_simulated_events
+
+    return staticmethod(_find_ttree)
+
+
+class TestRootFiles(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for i in range(2):
+            write_root_file(
+                os.path.join(self.temp_dir.name, f"test_{i}.root"),
+                [2, 1, 3, 1],
+                np.arange(4) + 4 * i,
+            )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def load(self, **kwargs):
+        """Function which reads the root files and returns the loader and
+        its chunks."""
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name, "test_*.root", np.random.default_rng(42), **kwargs
+        )
+        with mock.patch.object(fuse.micro_physics.input.file_loader, "_find_ttree", find_ttree()):
+            chunks = list(reader.output_chunk())
+        return reader, chunks
+
+    def test_files_are_opened_once(self):
+        opened = []
+        uproot_open = uproot.open
+
+        def counted_open(*args, **kwargs):
+            root_dir = uproot_open(*args, **kwargs)
+            opened.append(root_dir)
+            return root_dir
+
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name,
+            "test_*.root",
+            np.random.default_rng(42),
+            entries_in_flight=1,
+        )
+        with mock.patch.object(
+            fuse.micro_physics.input.file_loader, "_find_ttree", find_ttree()
+        ), mock.patch.object(fuse.micro_physics.input.uproot, "open", counted_open):
+            loaded = np.concatenate([chunk[0] for chunk in reader.output_chunk()])
+
+        self.assertEqual(len(np.unique(loaded["eventid"])), 8)
+        # One open file per input file, closed after the last batch
+        self.assertEqual(len(opened), 2)
+        self.assertEqual(reader.root_files, dict())
+        self.assertTrue(all(root_dir.file.closed for root_dir in opened))
+
+    def test_thread_options(self):
+        _, reference = self.load()
+        reader, chunks = self.load(
+            entries_in_flight=2,
+            n_reader_threads=2,
+            n_decompression_threads=2,
+            n_interpretation_threads=2,
+        )
+        np.testing.assert_array_equal(
+            np.concatenate([chunk[0] for chunk in chunks]),
+            np.concatenate([chunk[0] for chunk in reference]),
+        )
+        # The thread pools of uproot are shut down after reading
+        self.assertIsNone(reader.decompression_executor)
+        self.assertIsNone(reader.interpretation_executor)
+
+    def test_eventid_index(self):
+        file = os.path.join(self.temp_dir.name, "test_0.root")
+        index_file = os.path.join(
+            self.temp_dir.name, ".fuse_cache", "test_0.root.eventid_index.npz"
+        )
+        options = dict(entry_start=2, entry_stop=6, cut_by_eventid=True, use_eventid_index=True)
+
+        _, chunks = self.load(**options)
+        self.assertTrue(os.path.exists(index_file))
+        loaded = np.concatenate([chunk[0] for chunk in chunks])
+        np.testing.assert_array_equal(np.unique(loaded["eventid"]), np.arange(2, 6))
+
+        # The index is rebuilt after the file is modified
+        write_root_file(file, [2, 1, 3, 1], [0, 1, 10, 11])
+        file_stat = os.stat(file)
+        os.utime(file, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+        _, chunks = self.load(**options)
+        loaded = np.concatenate([chunk[0] for chunk in chunks])
+        np.testing.assert_array_equal(np.unique(loaded["eventid"]), np.arange(4, 6))
+        with np.load(index_file) as index:
+            np.testing.assert_array_equal(index["eventids"], [0, 1, 10, 11])
+
+        # An index which can not be read is rebuilt
+        with open(index_file, "w") as f:
+            f.write("broken")
+        _, chunks = self.load(**options)
+        loaded = np.concatenate([chunk[0] for chunk in chunks])
+        np.testing.assert_array_equal(np.unique(loaded["eventid"]), np.arange(4, 6))
+
+    def test_outer_cylinder(self):
+        outer_cylinder = dict(max_r=5, min_z=-10, max_z=10)
+        # Positions in mm: inside, outside in r, outside in z and on the edges
+        positions = (
+            [0, 500, 0, 10, 0, 0, 30],
+            [0, 0, 0, 10, 0, 0, 40],
+            [0, 0, 500, -50, -100, 100, 0],
+        )
+        write_root_file(
+            os.path.join(self.temp_dir.name, "test_0.root"), [2, 1, 3, 1], np.arange(4), positions
+        )
+        outside = ([500] * 7, [0] * 7, [0] * 7)
+        write_root_file(
+            os.path.join(self.temp_dir.name, "test_1.root"), [2, 1, 3, 1], np.arange(4, 8), outside
+        )
+
+        _, chunks = self.load(outer_cylinder=outer_cylinder)
+        loaded = np.concatenate([chunk[0] for chunk in chunks])
+        loaded = loaded[np.lexsort((loaded["t"], loaded["eventid"]))]
+        # min_z is inside, max_z and max_r are outside of the cylinder
+        np.testing.assert_array_equal(loaded["eventid"], [0, 2, 2])
+        np.testing.assert_array_equal(loaded["x"], [0, 1, 0])
+        np.testing.assert_array_equal(loaded["z"], [0, -5, -10])
+
+        # No deposit is inside the outer cylinder
+        write_root_file(
+            os.path.join(self.temp_dir.name, "test_0.root"), [2, 1, 3, 1], np.arange(4), outside
+        )
+        with self.assertRaisesRegex(ValueError, "No interactions left"):
+            self.load(outer_cylinder=outer_cylinder)
+
+    def test_shards_follow_each_other(self):
+        n_shards = 3
+        shards = [
+            self.load(n_shards=n_shards, shard_index=shard_index, n_interactions_per_chunk=2)[1]
+            for shard_index in range(n_shards)
+        ]
+
+        eventids = []
+        for shard_index, chunks in enumerate(shards):
+            # Within a shard, the chunks follow each other and contain their data
+            for chunk, next_chunk in zip(chunks[:-1], chunks[1:]):
+                self.assertEqual(chunk[2], next_chunk[1])
+            for data, chunk_left, chunk_right, _ in chunks:
+                self.assertTrue(np.all(data["time"] >= chunk_left))
+                self.assertTrue(np.all(data["endtime"] <= chunk_right))
+            # The last chunk of a shard ends where the next shard starts
+            if shard_index < n_shards - 1:
+                self.assertEqual(chunks[-1][2], shards[shard_index + 1][0][1])
+            eventids.append(np.unique(np.concatenate([chunk[0]["eventid"] for chunk in chunks])))
+
+        # The shards contain all events, each event in one shard
+        np.testing.assert_array_equal(np.concatenate(eventids), np.arange(8))
+
+    def test_eventid_range_uses_entries(self):
+        # The number of simulated events in the header differs from the
+        # number of entries, e.g. for events without deposits
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name,
+            "test_*.root",
+            np.random.default_rng(42),
+            entry_start=2,
+            cut_by_eventid=True,
+        )
+        with mock.patch.object(fuse.micro_physics.input.file_loader, "_find_ttree", find_ttree(10)):
+            entry_ranges, start, stop = reader._get_entry_ranges()
+            loaded = np.concatenate([chunk[0] for chunk in reader.output_chunk()])
+
+        self.assertEqual([entry_range[1:] for entry_range in entry_ranges], [(2, 4), (0, 4)])
+        self.assertEqual((start, stop), (2, 8))
+        np.testing.assert_array_equal(np.unique(loaded["eventid"]), np.arange(2, 8))
+
+    def test_input_cache(self):
+        reader, chunks = self.load(use_input_cache=True)
+        cache_dir = reader._input_cache_dir()
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, "metadata.json")))
+
+        # The second read does not touch the root files
+        with mock.patch.object(
+            fuse.micro_physics.input.file_loader, "_iterate_root_file", side_effect=AssertionError
+        ):
+            _, cached_chunks = self.load(use_input_cache=True)
+        self.assertEqual(len(cached_chunks), len(chunks))
+        for cached_chunk, chunk in zip(cached_chunks, chunks):
+            np.testing.assert_array_equal(cached_chunk[0], chunk[0])
+            self.assertEqual(cached_chunk[1:], chunk[1:])
+
+        # Other options and modified files use another cache
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name, "test_*.root", np.random.default_rng(42), entry_stop=4
+        )
+        self.assertNotEqual(reader._input_cache_dir(), cache_dir)
+        file_stat = os.stat(reader.files[0])
+        os.utime(reader.files[0], ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name, "test_*.root", np.random.default_rng(42)
+        )
+        self.assertNotEqual(reader._input_cache_dir(), cache_dir)
+
+
+class TestCsvInput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_float_formatted_ids(self):
+        # Geant4 csv exports can store the ids as floats, possibly with
+        # rounding noise, which a strict integer parse would reject
+        interactions = TestInMemoryInput.make_interactions()
+        df = pd.DataFrame({name: interactions[name] for name in interactions.dtype.names})
+        df = df.rename(
+            columns=dict(
+                x="xp", y="yp", z="zp", x_pri="xp_pri", y_pri="yp_pri", z_pri="zp_pri", t="time"
+            )
+        )
+        df["eventid"] = df["eventid"] + 1e-9
+        df["trackid"] = 1.000000001
+        df["parentid"] = 0.0
+        df.to_csv(os.path.join(self.temp_dir.name, "test.csv"), index=False)
+
+        reader = fuse.micro_physics.input.file_loader(
+            self.temp_dir.name, "test.csv", np.random.default_rng(42), event_rate=10
+        )
+        loaded = np.concatenate([chunk[0] for chunk in reader.output_chunk()])
+        loaded = loaded[np.lexsort((loaded["t"], loaded["eventid"]))]
+        self.assertEqual(len(loaded), 6)
+        np.testing.assert_array_equal(loaded["eventid"], interactions["eventid"])
+        self.assertTrue(np.all(loaded["trackid"] == 1))
+        self.assertTrue(np.all(loaded["parentid"] == 0))
+
+
+@unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+@unittest.skipIf(importlib.util.find_spec("h5py") is None, "h5py is not installed")
+class TestColumnarInput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(1)
+        n_per_event = rng.integers(1, 5, 12)
+        n_interactions = np.sum(n_per_event)
+
+        # Multiples of 1/8 are written to the csv file without rounding
+        def uniform(low, high):
+            return rng.integers(low * 8, high * 8, n_interactions) / 8
+
+        self.df = pd.DataFrame(
+            {
+                "xp": uniform(-500, 500),
+                "yp": uniform(-500, 500),
+                "zp": uniform(-1000, 0),
+                "xp_pri": 0.0,
+                "yp_pri": 0.0,
+                "zp_pri": 0.0,
+                "time": uniform(0, 100),
+                "ed": uniform(1, 10),
+                "type": "gamma",
+                "trackid": 1,
+                "parenttype": "none",
+                "parentid": 0,
+                "creaproc": "none",
+                "edproc": "phot",
+                "eventid": np.repeat(np.arange(12), n_per_event),
+            }
+        )
+        self.df.to_csv(os.path.join(self.temp_dir.name, "test.csv"), index=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_array(self, file_name, **config):
+        with tempfile.TemporaryDirectory() as output_folder:
+            test_context = strax.Context(
+                storage=strax.DataDirectory(output_folder),
+                register=[fuse.micro_physics.ChunkInput],
+            )
+            test_context.set_config(
+                dict(path=self.temp_dir.name, file_name=file_name, source_rate=10, **config)
+            )
+            return test_context.get_array("TestRun_00000", "geant4_interactions")
+
+    def test_same_as_csv(self):
+        reference = self.get_array("test.csv")
+        self.assertEqual(len(reference), len(self.df))
+        for file_name in ["test.parquet", "test.arrow", "test.h5"]:
+            write_columnar_file(os.path.join(self.temp_dir.name, file_name), self.df)
+            loaded = self.get_array(file_name)
+            np.testing.assert_array_equal(loaded, reference)
+
+    def test_shards(self):
+        write_columnar_file(os.path.join(self.temp_dir.name, "test.parquet"), self.df)
+        shards = [self.get_array("test.parquet", n_shards=3, shard_index=i) for i in range(3)]
+        self.assertEqual(sum(len(np.unique(shard["eventid"])) for shard in shards), 12)
+        np.testing.assert_array_equal(
+            np.concatenate([shard["eventid"] for shard in shards]), np.sort(self.df["eventid"])
+        )
+
+    def test_unsorted_eventids_raise(self):
+        df = self.df.iloc[::-1]
+        for file_name in ["test.parquet", "test.arrow", "test.h5"]:
+            write_columnar_file(os.path.join(self.temp_dir.name, file_name), df)
+            reader = fuse.micro_physics.input.file_loader(
+                self.temp_dir.name, file_name, np.random.default_rng(42), event_rate=10
+            )
+            with self.assertRaisesRegex(ValueError, "sorted by eventid"):
+                list(reader.output_chunk())
+
+
 if __name__ == "__main__":
     unittest.main()
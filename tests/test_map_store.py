@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import strax
+import straxen
+import fuse
+from fuse.map_store import SharedURLConfig, load_shared, clear_map_store, shared_key
+
+n_loads = 0
+
+
+@straxen.URLConfig.register("test_counted_load")
+def counted_load(size):
+    global n_loads
+    n_loads += 1
+    return dict(map=np.arange(int(size), dtype=np.float64), name="test map")
+
+
+class FirstPlugin(strax.Plugin):
+    depends_on = tuple()
+    provides = "first"
+    test_map = SharedURLConfig(default="test_counted_load://1000", cache=True)
+
+
+class SecondPlugin(strax.Plugin):
+    depends_on = tuple()
+    provides = "second"
+    test_map = SharedURLConfig(default="test_counted_load://1000", cache=True)
+
+
+class TestMapStore(unittest.TestCase):
+    def setUp(self):
+        clear_map_store()
+
+    def tearDown(self):
+        clear_map_store()
+
+    def test_plugins_share_maps(self):
+        global n_loads
+        n_loads = 0
+
+        first = FirstPlugin()
+        first.config = dict(test_map="test_counted_load://1000")
+        second = SecondPlugin()
+        second.config = dict(test_map="test_counted_load://1000")
+
+        self.assertIs(first.test_map, second.test_map)
+        self.assertEqual(n_loads, 1)
+        self.assertFalse(first.test_map["map"].flags.writeable)
+        self.assertIsNotNone(shared_key(first.test_map))
+        self.assertIsNone(shared_key(dict(first.test_map)))
+
+        second.config = dict(test_map="test_counted_load://10")
+        self.assertEqual(len(second.test_map["map"]), 10)
+        self.assertEqual(n_loads, 2)
+
+    def test_large_arrays_are_memory_mapped(self):
+        itp_map = fuse.RegularGridMap(
+            dict(
+                coordinate_system=[["x", [0, 1, 100]], ["y", [0, 1, 200]]], map=np.ones((100, 200))
+            )
+        )
+        with tempfile.TemporaryDirectory() as shared_dir:
+            shared_map = load_shared(
+                "test", lambda: itp_map, min_shared_bytes=2**10, shared_dir=shared_dir
+            )
+            self.assertIsNot(shared_map, itp_map)
+            self.assertIs(load_shared("test", lambda: None), shared_map)
+
+            # The values and the reshaped data of the map share one file
+            self.assertEqual(len(os.listdir(shared_dir)), 1)
+            self.assertFalse(shared_map.values["map"].flags.writeable)
+            self.assertTrue(itp_map.values["map"].flags.writeable)
+            positions = np.random.default_rng(0).random((100, 2))
+            np.testing.assert_array_equal(shared_map(positions), itp_map(positions))
+
+    def test_memory_mapping_is_opt_in(self):
+        source = dict(map=np.ones(1000))
+        with mock.patch.object(fuse.map_store, "SHARED_MAP_DIR", None):
+            shared = load_shared("test", lambda: source, min_shared_bytes=2**5)
+        self.assertNotIsInstance(shared["map"].base, np.memmap)
+        self.assertTrue(np.shares_memory(shared["map"], source["map"]))
+
+        clear_map_store()
+        with tempfile.TemporaryDirectory() as shared_dir:
+            with mock.patch.object(fuse.map_store, "SHARED_MAP_DIR", shared_dir):
+                shared = load_shared("test", lambda: source, min_shared_bytes=2**5)
+                self.assertFalse(np.shares_memory(shared["map"], source["map"]))
+                self.assertEqual(len(os.listdir(shared_dir)), 1)
+
+                clear_map_store(remove_shared_files=True)
+                self.assertEqual(os.listdir(shared_dir), [])
+                np.testing.assert_array_equal(shared["map"], source["map"])
+
+    def test_least_recently_used_maps_are_removed(self):
+        loaded = []
+
+        def load(i):
+            loaded.append(i)
+            return dict(map=np.arange(i))
+
+        size = fuse.map_store.MAP_STORE_SIZE
+        for i in range(size):
+            load_shared(i, lambda i=i: load(i))
+        load_shared(0, lambda: load(0))
+        load_shared(size, lambda: load(size))
+        self.assertEqual(len(fuse.map_store._map_store), size)
+
+        # The first map was used again, the second one was removed
+        load_shared(0, lambda: load(0))
+        load_shared(1, lambda: load(1))
+        self.assertEqual(loaded, list(range(size + 1)) + [1])
+
+    def test_source_arrays_stay_writeable(self):
+        source = dict(map=np.arange(10, dtype=np.float64), name="test map")
+        shared = load_shared("test", lambda: source)
+
+        self.assertFalse(shared["map"].flags.writeable)
+        self.assertTrue(source["map"].flags.writeable)
+        source["map"][0] = 1
+        self.assertEqual(shared["map"][0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
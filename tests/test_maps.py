@@ -0,0 +1,384 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import straxen
+import fuse
+from scipy.interpolate import RegularGridInterpolator
+from fuse.maps import (
+    RegularGridMap,
+    rasterize_map,
+    cached_derived_array,
+    memoized_map,
+    evaluate_maps,
+    SHARED_SEARCH_ATTRIBUTES,
+    _straxen_is_supported,
+    _supports_shared_search,
+)
+
+
+class TestRegularGridMap(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(42)
+        cls.grid = (np.linspace(-70, 70, 15), np.linspace(-70, 70, 16), np.linspace(-150, 0, 10))
+        cls.values = rng.random((15, 16, 10, 8)).astype(np.float32)
+        cls.map_data = dict(
+            coordinate_system=[["x", [-70, 70, 15]], ["y", [-70, 70, 16]], ["z", [-150, 0, 10]]],
+            map=cls.values,
+        )
+        # Include positions outside of the grid to test the extrapolation
+        cls.positions = np.column_stack(
+            [
+                rng.uniform(-80, 80, 1000),
+                rng.uniform(-80, 80, 1000),
+                rng.uniform(-160, 10, 1000),
+            ]
+        )
+        cls.reference = RegularGridInterpolator(
+            cls.grid, cls.values.astype(np.float64), bounds_error=False, fill_value=None
+        )(cls.positions)
+
+    def test_matches_regular_grid_interpolator(self):
+        itp_map = RegularGridMap(self.map_data)
+        np.testing.assert_allclose(itp_map(self.positions), self.reference, atol=1e-10)
+
+    def test_point_list_coordinate_system(self):
+        points = np.array(np.meshgrid(*self.grid, indexing="ij")).reshape(3, -1).T
+        values = self.values.reshape(len(points), -1)
+        order = np.random.default_rng(0).permutation(len(points))
+
+        itp_map = RegularGridMap(dict(coordinate_system=points[order].tolist(), map=values[order]))
+        np.testing.assert_allclose(itp_map(self.positions), self.reference, atol=1e-10)
+
+    def test_scalar_map(self):
+        itp_map = RegularGridMap(dict(self.map_data, map=self.values[..., 0]))
+        result = itp_map(self.positions)
+        self.assertEqual(result.shape, (len(self.positions),))
+        np.testing.assert_allclose(result, self.reference[:, 0], atol=1e-10)
+
+    def test_quantized_map(self):
+        for bits, dtype in [(8, np.uint8), (16, np.uint16)]:
+            itp_map = RegularGridMap(self.map_data, quantize_bits=bits)
+            self.assertEqual(itp_map.values["map"].dtype, dtype)
+            # The extrapolation can amplify the quantization error
+            np.testing.assert_allclose(
+                itp_map(self.positions), self.reference, atol=4 * 2.0 ** (-bits)
+            )
+
+    def test_channel_scales_and_sums(self):
+        itp_map = RegularGridMap(self.map_data)
+        mask = np.arange(8) % 2 == 0
+
+        masked_map = itp_map.copy()
+        masked_map.scale_channels(mask)
+        np.testing.assert_allclose(masked_map(self.positions), self.reference * mask, atol=1e-10)
+        np.testing.assert_allclose(itp_map(self.positions), self.reference, atol=1e-10)
+
+        sum_map = itp_map.sum_channels(mask)
+        np.testing.assert_allclose(
+            sum_map(self.positions)[:, 0], (self.reference * mask).sum(axis=1), rtol=1e-5
+        )
+
+    def test_scale_coordinates(self):
+        itp_map = RegularGridMap(self.map_data)
+        scaled_map = itp_map.copy()
+        scaled_map.scale_coordinates([1.0, 2.0, -0.5])
+
+        scaled_positions = self.positions * [1.0, 2.0, -0.5]
+        np.testing.assert_allclose(scaled_map(scaled_positions), self.reference, atol=1e-10)
+        np.testing.assert_allclose(itp_map(self.positions), self.reference, atol=1e-10)
+
+    def test_no_extrapolation(self):
+        itp_map = RegularGridMap(self.map_data, extrapolate=False)
+        clipped_positions = np.clip(self.positions, [-70, -70, -150], [70, 70, 0])
+        np.testing.assert_allclose(itp_map(self.positions), itp_map(clipped_positions), atol=1e-10)
+
+    def test_irregular_grid(self):
+        with self.assertRaises(ValueError):
+            RegularGridMap(dict(coordinate_system=[[0], [1], [3]], map=[1, 2, 3]))
+
+
+class TestRasterizeMap(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Smooth field map in (r, z) on scattered points
+        rng = np.random.default_rng(42)
+        points = np.column_stack([rng.uniform(0, 70, 2000), rng.uniform(-150, 0, 2000)])
+        cls.map_data = dict(
+            coordinate_system=points.tolist(),
+            drift_speed_map=(1 + 0.01 * points[:, 0] - 0.001 * points[:, 1]).tolist(),
+            survival_probability_map=np.exp(points[:, 1] / 500).tolist(),
+        )
+        cls.itp_map = straxen.InterpolatingMap(cls.map_data, method="WeightedNearestNeighbors")
+        cls.positions = np.column_stack([rng.uniform(0, 70, 1000), rng.uniform(-150, 0, 1000)])
+
+    def test_raster_matches_original_map(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            raster = rasterize_map(self.itp_map, resolution=200, cache_dir=cache_dir)
+
+            for map_name in self.itp_map.map_names:
+                self.assertLess(raster.rasterization_errors[map_name], 0.05)
+                np.testing.assert_allclose(
+                    raster(self.positions, map_name=map_name),
+                    self.itp_map(self.positions, map_name=map_name),
+                    rtol=0.02,
+                )
+
+    def test_raster_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            raster = rasterize_map(self.itp_map, resolution=[100, 50], cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            cached_raster = rasterize_map(self.itp_map, resolution=[100, 50], cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            np.testing.assert_array_equal(
+                cached_raster(self.positions, map_name="drift_speed_map"),
+                raster(self.positions, map_name="drift_speed_map"),
+            )
+            self.assertEqual(cached_raster.rasterization_errors, raster.rasterization_errors)
+
+            # Another resolution or map is a new raster
+            rasterize_map(self.itp_map, resolution=[50, 50], cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            other_map = straxen.InterpolatingMap(
+                dict(self.map_data, drift_speed_map=np.ones(2000).tolist())
+            )
+            rasterize_map(other_map, resolution=[50, 50], cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+
+class TestCachedDerivedArray(unittest.TestCase):
+    def setUp(self):
+        fuse.clear_map_store()
+
+    def tearDown(self):
+        fuse.clear_map_store()
+
+    def test_derived_array_is_cached(self):
+        source = np.random.default_rng(0).random((10, 20, 30)).astype(np.float32)
+        mask = np.arange(30) % 3 > 0
+        n_derived = []
+
+        def derive():
+            n_derived.append(1)
+            return np.sum(source, axis=-1, keepdims=True, where=mask)
+
+        expected = derive()
+        for _ in range(2):
+            derived = cached_derived_array("lce", "source", dict(mask=mask.tolist()), derive)
+            np.testing.assert_array_equal(derived, expected)
+            self.assertFalse(derived.flags.writeable)
+        self.assertEqual(len(n_derived), 2)
+
+        # Without a key of the source the array is derived every time
+        cached_derived_array("lce", None, dict(mask=mask.tolist()), derive)
+        self.assertEqual(len(n_derived), 3)
+
+    def test_disk_cache(self):
+        source = np.arange(10, dtype=np.float64)
+        n_derived = []
+
+        def derive():
+            n_derived.append(1)
+            return source * 2
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for _ in range(2):
+                derived = cached_derived_array("double", "source", {}, derive, cache_dir=cache_dir)
+                np.testing.assert_array_equal(derived, source * 2)
+                fuse.clear_map_store()
+            self.assertEqual(len(n_derived), 1)
+
+            # Other parameters or sources give a new derived array
+            cached_derived_array("double", "source", dict(a=1), derive, cache_dir=cache_dir)
+            cached_derived_array("double", "other source", {}, derive, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        with mock.patch.object(fuse.maps, "DERIVED_CACHE_DIR", None):
+            with mock.patch.object(os, "makedirs") as makedirs:
+                cached_derived_array("double", "new source", {}, derive)
+                makedirs.assert_not_called()
+
+
+class TestMemoizedMap(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(42)
+        points = rng.uniform(-70, 70, (500, 2))
+        cls.itp_map = straxen.InterpolatingMap(
+            dict(coordinate_system=points.tolist(), map=np.hypot(*points.T).tolist())
+        )
+        # Many electrons of few clusters
+        cls.cluster_positions = rng.uniform(-70, 70, (20, 2)).astype(np.float32)
+        cls.cluster_id = np.repeat(np.arange(20), rng.integers(1, 100, 20))
+        cls.positions = cls.cluster_positions[cls.cluster_id]
+
+    def test_deduplicated_positions(self):
+        itp_map = memoized_map(self.itp_map)
+        self.assertIs(memoized_map(self.itp_map), itp_map)
+        itp_map.hits = itp_map.misses = 0
+
+        np.testing.assert_array_equal(itp_map(self.positions), self.itp_map(self.positions))
+        self.assertEqual(itp_map.misses, 20)
+        self.assertEqual(itp_map.hits, len(self.positions) - 20)
+        self.assertEqual(itp_map.map_names, self.itp_map.map_names)
+
+    def test_clusters_are_remembered(self):
+        itp_map = fuse.MemoizedMap(self.itp_map)
+        expected = self.itp_map(self.positions)
+
+        itp_map(self.cluster_positions[:10], cluster_id=np.arange(10))
+        self.assertEqual(itp_map.misses, 10)
+
+        result = itp_map(self.positions, cluster_id=self.cluster_id)
+        np.testing.assert_array_equal(result, expected)
+        self.assertEqual(itp_map.misses, 20)
+        self.assertEqual(itp_map.hits, len(self.positions) - 10)
+
+        # Clusters at another position are evaluated again
+        moved_positions = self.positions + 1
+        result = itp_map(moved_positions, cluster_id=self.cluster_id)
+        np.testing.assert_array_equal(result, self.itp_map(moved_positions))
+        self.assertEqual(itp_map.misses, 40)
+
+        # Positions of one cluster which differ are evaluated one by one
+        result = itp_map(self.positions, cluster_id=np.zeros(len(self.positions)))
+        np.testing.assert_array_equal(result, expected)
+        self.assertEqual(itp_map.misses, 60)
+
+
+class TestEvaluateMaps(unittest.TestCase):
+    @staticmethod
+    def make_maps(rng):
+        points = rng.uniform(-70, 70, (500, 2))
+        field_map = straxen.InterpolatingMap(
+            dict(
+                coordinate_system=points.tolist(),
+                drift_speed_map=rng.random(500).tolist(),
+                survival_probability_map=rng.random(500).tolist(),
+                pattern_map=rng.random((500, 3)).tolist(),
+            )
+        )
+        # Same points in another map, and a map on other points
+        same_points_map = straxen.InterpolatingMap(
+            dict(coordinate_system=points.tolist(), map=rng.random(500).tolist())
+        )
+        other_points_map = straxen.InterpolatingMap(
+            dict(coordinate_system=(points + 1).tolist(), map=rng.random(500).tolist())
+        )
+        grid_map = RegularGridMap(
+            dict(
+                coordinate_system=[["x", [-70, 70, 10]], ["y", [-70, 70, 10]]],
+                map=np.ones((10, 10)),
+            )
+        )
+        return dict(
+            drift_speed=(field_map, "drift_speed_map"),
+            survival_probability=(field_map, "survival_probability_map"),
+            pattern=(field_map, "pattern_map"),
+            same_points=(same_points_map, "map"),
+            other_points=(other_points_map, "map"),
+            grid=(grid_map, "map"),
+        )
+
+    def test_same_as_single_maps(self):
+        rng = np.random.default_rng(42)
+        maps = self.make_maps(rng)
+
+        positions = rng.uniform(-80, 80, (1000, 2))
+        positions[10] = np.nan
+        result = evaluate_maps(positions, maps)
+
+        self.assertEqual(list(result.keys()), list(maps.keys()))
+        for key, (itp_map, map_name) in maps.items():
+            np.testing.assert_array_equal(result[key], itp_map(positions, map_name=map_name))
+
+    def test_shared_search_attributes(self):
+        itp_map = straxen.InterpolatingMap(
+            dict(coordinate_system=[[0, 0], [1, 0], [0, 1]], map=[1, 2, 3])
+        )
+        interpolator = itp_map.interpolators["map"]
+        if _straxen_is_supported(straxen.__version__):
+            for name in SHARED_SEARCH_ATTRIBUTES:
+                self.assertTrue(hasattr(interpolator, name), name)
+            self.assertTrue(_supports_shared_search(interpolator))
+
+        self.assertTrue(_straxen_is_supported("4.1.1"))
+        self.assertTrue(_straxen_is_supported("4.0.0rc1"))
+        self.assertFalse(_straxen_is_supported("3.2.1"))
+        self.assertFalse(_straxen_is_supported("5.0.0"))
+        with mock.patch.object(straxen, "__version__", "5.0.0"):
+            self.assertFalse(_supports_shared_search(interpolator))
+
+    def test_fallback_gives_the_same_results(self):
+        rng = np.random.default_rng(42)
+        maps = self.make_maps(rng)
+        positions = rng.uniform(-80, 80, (1000, 2))
+        positions[10] = np.nan
+        result = evaluate_maps(positions, maps)
+
+        # Unsupported straxen version, and the check of the shared search fails
+        with mock.patch.object(straxen, "__version__", "5.0.0"):
+            fallback_result = evaluate_maps(positions, maps)
+        with mock.patch("fuse.maps._check_shared_search", return_value=False):
+            checked_result = evaluate_maps(positions, maps)
+
+        for key in maps:
+            np.testing.assert_array_equal(fallback_result[key], result[key])
+            np.testing.assert_array_equal(checked_result[key], result[key])
+
+    def test_neighbours_and_weights(self):
+        # Four neighbours (2 * dimensions) weighted by their inverse distance
+        points = np.array([[0, 0], [1, 0], [0, 1], [1, 1], [5, 5], [6, 6]], dtype=np.float64)
+        values = np.array([1, 2, 3, 4, 100, 200], dtype=np.float64)
+        itp_map = straxen.InterpolatingMap(
+            dict(coordinate_system=points.tolist(), map=values.tolist())
+        )
+        positions = np.array([[0.25, 0.25], [1, 1]])
+
+        distances = np.linalg.norm(points[:4] - positions[0], axis=1)
+        expected = np.sum(values[:4] / distances) / np.sum(1 / distances)
+        result = evaluate_maps(positions, dict(map=(itp_map, "map")))["map"]
+        self.assertAlmostEqual(result[0], expected, places=12)
+        # The distance is clipped at 1e-6, a position on a point gets its value
+        self.assertAlmostEqual(result[1], 4, places=4)
+        np.testing.assert_array_equal(result, itp_map(positions))
+
+    @unittest.skipUnless(
+        _straxen_is_supported(straxen.__version__), "shared search is not used with this straxen"
+    )
+    def test_falls_back_to_the_interpolator(self):
+        rng = np.random.default_rng(42)
+        points = rng.uniform(-70, 70, (100, 2))
+        positions = rng.uniform(-70, 70, (10, 2))
+
+        def changed_call(self, points):
+            return np.zeros(len(points))
+
+        # The interpolator differs from the shared neighbour search
+        itp_map = straxen.InterpolatingMap(
+            dict(coordinate_system=points.tolist(), map=rng.random(100).tolist())
+        )
+        with mock.patch.object(straxen.InterpolateAndExtrapolate, "__call__", changed_call):
+            with self.assertLogs("fuse.maps", "WARNING"):
+                result = evaluate_maps(positions, dict(map=(itp_map, "map")))
+            np.testing.assert_array_equal(result["map"], np.zeros(10))
+            result = evaluate_maps(positions, dict(map=(itp_map, "map")))
+            np.testing.assert_array_equal(result["map"], np.zeros(10))
+
+        # The interpolator misses an attribute of the shared neighbour search
+        itp_map = straxen.InterpolatingMap(
+            dict(coordinate_system=points.tolist(), map=rng.random(100).tolist())
+        )
+        del itp_map.interpolators["map"].rotated
+        with mock.patch.object(straxen.InterpolateAndExtrapolate, "__call__", changed_call):
+            with self.assertLogs("fuse.maps", "WARNING"):
+                result = evaluate_maps(positions, dict(map=(itp_map, "map")))
+            np.testing.assert_array_equal(result["map"], np.zeros(10))
+
+
+if __name__ == "__main__":
+    unittest.main()